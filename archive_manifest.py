@@ -0,0 +1,90 @@
+"""Manifest of the files archived from a delivery
+Use
+---
+    move_files.py writes archive_manifest.json into each archived delivery directory on /ifs/redcat. It records the
+    size, mtime, sha256 and destination of every file copied from the delivery (including HST references sent to
+    the central store), so a rerun only copies files that are missing or changed, and whether a delivery is fully
+    archived is answered from the manifest alone:
+    ::
+        manifest = Manifest.load('/ifs/redcat/hst/srefpipe/WFC3/2020_01_01')
+        pending = [f for f in files if manifest.needs_copy(f, target_for(f))]
+        ...
+        manifest.record(source, target, sha256)
+        manifest.save()
+"""
+
+import json
+import os
+import time
+from collections import OrderedDict
+
+MANIFEST_FILE = 'archive_manifest.json'
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class Manifest(object):
+    """ destination path -> source, size, mtime and sha256 of the file copied there
+    """
+
+    def __init__(self, directory, source=None):
+        self.directory = directory
+        self.path = os.path.join(directory, MANIFEST_FILE)
+        self.source = source
+        self.files = OrderedDict()
+        self.complete = False
+        self.updated = None
+
+    @classmethod
+    def load(cls, directory):
+        """ The manifest of an archived delivery, empty if there is none yet
+        """
+        manifest = cls(directory)
+        try:
+            with open(manifest.path) as f:
+                data = json.load(f, object_pairs_hook=OrderedDict)
+        except (OSError, ValueError):
+            return manifest
+        manifest.source = data.get('source')
+        manifest.files = data.get('files', OrderedDict())
+        manifest.complete = data.get('complete', False)
+        manifest.updated = data.get('updated')
+        return manifest
+
+    def save(self):
+        data = OrderedDict([('source', self.source),
+                            ('complete', self.complete),
+                            ('updated', time.strftime('%Y-%m-%d %H:%M:%S')),
+                            ('files', self.files)])
+        temp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+        with open(temp_path, 'w') as f:
+            json.dump(data, f, indent=1)
+        os.replace(temp_path, self.path)
+
+    def current(self, source, target):
+        """ True if the manifest records source, as it is now, copied to target
+        """
+        entry = self.files.get(os.path.abspath(target))
+        if entry is None:
+            return False
+        stat = os.stat(source)
+        return entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns
+
+    def needs_copy(self, source, target):
+        """ True unless source is recorded as copied unchanged and target is still there
+        """
+        return not (self.current(source, target) and os.path.exists(target))
+
+    def record(self, source, target, sha256):
+        stat = os.stat(source)
+        self.files[os.path.abspath(target)] = OrderedDict([('source', os.path.abspath(source)),
+                                                           ('size', stat.st_size),
+                                                           ('mtime_ns', stat.st_mtime_ns),
+                                                           ('sha256', sha256)])
+
+    def record_results(self, results):
+        """ Record the successful copy_engine.CopyResult of a batch
+        """
+        for result in results:
+            if not result.error:
+                self.record(result.source, result.target, result.checksum)
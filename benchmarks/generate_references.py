@@ -0,0 +1,251 @@
+"""Generator for synthetic HST and JWST reference files used by the benchmarks
+Use
+---
+    Writes multi-extension FITS reference files from a few KB up to several GB, JWST ETC throughput tables and JSON
+    configurations, and asdf placeholders. Large data sections are written as sparse zero-filled extents, so a GB
+    file takes no time to create:
+    ::
+        python generate_references.py -o /tmp/refs -n 10 --size 50MB --instrument WFC3
+"""
+
+import argparse
+import json
+import os
+from collections import OrderedDict
+
+import numpy as np
+from astropy.io import fits
+
+hst_filetypes = {'ACS': 'BIAS', 'WFC3': 'DARK', 'COS': 'FLAT', 'STIS': 'BIAS', 'NICMOS': 'DARK', 'WFPC2': 'FLAT'}
+jwst_reftypes = {'FGS': 'DARK', 'MIRI': 'FLAT', 'NIRCAM': 'GAIN', 'NIRISS': 'READNOISE', 'NIRSPEC': 'SUPERBIAS'}
+
+# ETC filetypes paired with the Pandeia subdirectory they live in (see jwst_etc_check.place_file)
+etc_filetypes = [('_trans', 'filters'), ('_qe', 'qe'), ('_disp', 'dispersion'), ('_optical', 'optical'),
+                 ('_blaze', 'blaze'), ('_psf', 'psfs'), ('_ipc', 'detector'), ('_trace', 'wavepix')]
+
+UNITS = {'KB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3}
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def parse_size(size):
+    """ Convert a size such as '512KB', '20MB' or '2GB' (or a plain number of bytes) to bytes
+    """
+    size = str(size).strip().upper()
+    for unit, factor in UNITS.items():
+        if size.endswith(unit):
+            return int(float(size[:-len(unit)]) * factor)
+    return int(size)
+
+
+def image_shape(n_bytes, n_ext, bitpix=-32):
+    """ Square image shape giving roughly n_bytes of data spread across n_ext extensions
+    """
+    per_ext = max(1, n_bytes // max(1, n_ext) // (abs(bitpix) // 8))
+    side = max(1, int(per_ext ** 0.5))
+    return side, side
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def primary_header(observatory, instrument, filetype, serial=0):
+    """ Primary header with the keywords the delivery tools and CRDS look at
+    """
+    header = fits.Header()
+    header['TELESCOP'] = observatory.upper()
+    header['INSTRUME'] = instrument
+    header['FILETYPE'] = filetype
+    header['USEAFTER'] = 'Jan 01 2020 00:00:{:02d}'.format(serial % 60)
+    header['PEDIGREE'] = 'INFLIGHT 01/01/2019 31/12/2019'
+    header['DESCRIP'] = 'Synthetic {} {} reference file for benchmarking'.format(instrument, filetype)
+    header['AUTHOR'] = 'ReDCaT benchmarks'
+    if observatory == 'jwst':
+        header['REFTYPE'] = filetype
+        header['DETECTOR'] = 'ANY'
+        header['EXP_TYPE'] = 'ANY'
+    header.add_comment('Generated by benchmarks/generate_references.py')
+    header.add_history('Synthetic file, not for delivery')
+    return header
+
+
+def write_extension(f, name, shape, bitpix=-32, fill=None):
+    """ Append an image extension to an open file. Without fill the data is left as a sparse zero extent
+    """
+    header = fits.Header()
+    header['XTENSION'] = 'IMAGE'
+    header['BITPIX'] = bitpix
+    header['NAXIS'] = 2
+    header['NAXIS1'] = shape[1]
+    header['NAXIS2'] = shape[0]
+    header['PCOUNT'] = 0
+    header['GCOUNT'] = 1
+    header['EXTNAME'] = name
+    f.write(header.tostring().encode('ascii'))
+
+    n_bytes = shape[0] * shape[1] * abs(bitpix) // 8
+    padded = -(-n_bytes // 2880) * 2880
+    if fill is not None:
+        data = np.full(shape, fill, dtype='>f4' if bitpix == -32 else '>i2')
+        f.write(data.tobytes())
+        f.write(b'\0' * (padded - n_bytes))
+    else:
+        f.seek(padded, os.SEEK_CUR)
+        f.truncate()
+
+
+def make_reference(path, observatory, instrument, size='1MB', n_ext=3, serial=0):
+    """ Write a multi-extension reference file (SCI, ERR, DQ, ...) of roughly size bytes.
+        Files under 64 MB get real pixel values; larger ones are sparse
+    """
+    n_bytes = parse_size(size)
+    filetype = (hst_filetypes if observatory == 'hst' else jwst_reftypes)[instrument]
+    shape = image_shape(n_bytes, n_ext)
+    names = ['SCI', 'ERR', 'DQ'] + ['EXT{}'.format(i) for i in range(3, n_ext)]
+
+    primary = fits.PrimaryHDU(header=primary_header(observatory, instrument, filetype, serial))
+    primary.header['EXTEND'] = True
+    with open(path, 'wb') as f:
+        f.write(primary.header.tostring().encode('ascii'))
+        for i in range(n_ext):
+            fill = float(serial + i) if n_bytes < 64 * UNITS['MB'] else None
+            write_extension(f, names[i], shape, fill=fill)
+        # truncate() leaves the position at the end of a sparse extent; make sure the file really ends there
+        f.truncate(f.tell())
+    return path
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def make_etc_table(path, instrument, filetype, n_rows=1000):
+    """ Write a JWST ETC throughput-style table with the header keywords jwst_etc_check.py requires
+    """
+    wave = np.linspace(0.5, 5.0, n_rows)
+    table = fits.BinTableHDU.from_columns([fits.Column(name='WAVELENGTH', format='D', array=wave),
+                                           fits.Column(name='THROUGHPUT', format='D', array=np.exp(-wave))])
+    primary = fits.PrimaryHDU()
+    header = primary.header
+    header['TELESCOP'] = 'JWST'
+    header['SYSTEM'] = 'MODELING'
+    header['INSTRUME'] = instrument.upper()
+    header['FILETYPE'] = 'THROUGHPUT_TABLE'
+    header['REFTYPE'] = filetype.strip('_').upper()
+    header['COMPNAME'] = os.path.basename(path).split('.')[0]
+    header['PEDIGREE'] = 'GROUND'
+    header['LITREF'] = 'Synthetic'
+    header['DESCRIP'] = 'Synthetic ETC table for benchmarking'
+    header['AUTHOR'] = 'ReDCaT benchmarks'
+    header.add_history('Synthetic file, not for delivery')
+    fits.HDUList([primary, table]).writeto(path, overwrite=True)
+    return path
+
+
+def meta_section(description=True):
+    """ meta block with the author/litref/history/pedigree subsections check_json_sections expects
+    """
+    entry = OrderedDict([('value', 'synthetic')])
+    if description:
+        entry['description'] = 'synthetic'
+    return OrderedDict((key, OrderedDict(entry)) for key in ['author', 'litref', 'history', 'pedigree'])
+
+
+def make_etc_config(path, instrument, table_paths, version='1.1dev'):
+    """ Write a JWST ETC configuration JSON file whose paths section points at table_paths (key -> path)
+    """
+    paths = OrderedDict([('meta', meta_section(description=False))])
+    paths.update(table_paths)
+    config = OrderedDict([('-delivered-for-version-', version),
+                          ('meta', meta_section()),
+                          ('paths', paths)])
+    with open(path, 'w') as f:
+        json.dump(config, f, indent=4)
+    return path
+
+
+def make_asdf_placeholder(path, reftype='DISTORTION', instrument='NIRCAM'):
+    """ Write a minimal asdf-like file. It is not a valid asdf model, only something for the tools to move around
+    """
+    with open(path, 'w') as f:
+        f.write('#ASDF 1.0.0\n#ASDF_STANDARD 1.5.0\n%YAML 1.1\n%TAG ! tag:stsci.edu:asdf/\n--- !core/asdf-1.1.0\n')
+        f.write('meta: {{instrument: {{name: {}}}, reftype: {}, author: ReDCaT benchmarks}}\n'.format(instrument,
+                                                                                                       reftype))
+        f.write('...\n')
+    return path
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def make_delivery(directory, instrument, n_files=5, size='1MB', n_ext=3, bad=0):
+    """ Fill directory with n_files reference files for instrument, the first `bad` of which are named so the mock
+        crds reports them as failing certify. Returns the file paths
+    """
+    observatory = 'hst' if instrument in hst_filetypes else 'jwst'
+    suffix = (hst_filetypes if observatory == 'hst' else jwst_reftypes)[instrument].lower()[:3]
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    files = []
+    for i in range(n_files):
+        name = '{}{:04d}_{}.fits'.format('bad' if i < bad else 'ref', i, suffix)
+        files.append(make_reference(os.path.join(directory, name), observatory, instrument, size, n_ext, serial=i))
+    return files
+
+
+def make_etc_delivery(directory, instrument, n_tables=8):
+    """ Fill directory with ETC tables and a configuration file for instrument (lower case, e.g. 'nircam')
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    tables = OrderedDict()
+    for i in range(n_tables):
+        filetype, _ = etc_filetypes[i % len(etc_filetypes)]
+        name = '{}_f{:03d}{}_20200101000000.fits'.format(instrument, i, filetype)
+        make_etc_table(os.path.join(directory, name), instrument, filetype)
+        tables['f{:03d}{}'.format(i, filetype)] = name
+    config = make_etc_config(os.path.join(directory, 'jwst_{}_configuration.json'.format(instrument)), instrument,
+                             tables)
+    return list(tables.values()), config
+
+
+def make_pandeia_release(destination, instrument, n_tables=8):
+    """ Build a Pandeia release tree (destination/instrument/<subdir>/...) with an older version of every table
+        make_etc_delivery writes, plus the old configuration file
+    """
+    tables = OrderedDict()
+    for i in range(n_tables):
+        filetype, subdir = etc_filetypes[i % len(etc_filetypes)]
+        directory = os.path.join(destination, instrument, subdir)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        name = '{}_f{:03d}{}_20190101000000.fits'.format(instrument, i, filetype)
+        make_etc_table(os.path.join(directory, name), instrument, filetype, n_rows=10)
+        tables['f{:03d}{}'.format(i, filetype)] = '{}/{}'.format(subdir, name)
+    make_etc_config(os.path.join(destination, instrument, 'jwst_{}_configuration_20190101000000.json'.format(
+        instrument)), instrument, tables)
+    make_etc_config(os.path.join(destination, '{}.json'.format(instrument)), instrument, tables)  # Template
+    return destination
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate synthetic reference files')
+    parser.add_argument('-o', type=str, help='Output directory', action='store', required=True)
+    parser.add_argument('-n', type=int, help='Number of files.  Default is 5', action='store', default=5)
+    parser.add_argument('--size', type=str, help='Approximate size of each file, e.g. 50KB, 20MB, 2GB',
+                        action='store', default='1MB')
+    parser.add_argument('--extensions', type=int, help='Extensions per file.  Default is 3', action='store',
+                        default=3)
+    parser.add_argument('--instrument', type=str, help='Instrument.  Default is WFC3', action='store',
+                        default='WFC3')
+    parser.add_argument('--etc', help='Write JWST ETC tables and a configuration file instead', action='store_true')
+    parser.add_argument('--asdf', type=int, help='Number of asdf placeholders to add', action='store', default=0)
+    options = parser.parse_args()
+
+    if options.etc:
+        written = make_etc_delivery(options.o, options.instrument.lower(), options.n)[0]
+    else:
+        written = make_delivery(options.o, options.instrument.upper(), options.n, options.size, options.extensions)
+    for i in range(options.asdf):
+        written.append(make_asdf_placeholder(os.path.join(options.o, 'placeholder_{:04d}.asdf'.format(i))))
+    for f in written:
+        print(f)
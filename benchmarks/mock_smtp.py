@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+"""Stand-in for the mail relay, for trying and benchmarking the notification outbox without sending mail
+Use
+---
+    Speaks enough SMTP for smtplib (EHLO/HELO, MAIL, RCPT, DATA, NOOP, RSET, QUIT) and saves each message it
+    receives as a .eml file. Point the tools at it with REDCAT_SMTP_HOST / REDCAT_SMTP_PORT:
+    ::
+        python benchmarks/mock_smtp.py --port 8025 --save /tmp/mail [--delay 0.2 --refuse 3]
+        REDCAT_SMTP_HOST=localhost REDCAT_SMTP_PORT=8025 python submit_delivery.py
+
+    --delay is the time taken to accept each message, and --refuse turns the first n connections away with a 421
+    so retries can be watched. In code, serve() runs it on a background thread:
+    ::
+        server = serve(0, directory)    # port 0: any free port, see server.server_address
+        ...
+        server.shutdown()
+"""
+
+import argparse
+import itertools
+import os
+import socketserver
+import threading
+import time
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    disable_nagle_algorithm = True
+
+    def reply(self, line):
+        self.wfile.write((line + '\r\n').encode('ascii'))
+        self.wfile.flush()
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+            refuse = server.connections <= server.refuse
+        if refuse:
+            self.reply('421 mock relay busy')
+            return
+
+        self.reply('220 mock-smtp ready')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('ascii', errors='replace').strip().upper()
+            if command.startswith(('EHLO', 'HELO')):
+                self.reply('250 mock-smtp')
+            elif command.startswith(('MAIL', 'RCPT', 'NOOP', 'RSET')):
+                self.reply('250 OK')
+            elif command == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                data = []
+                for data_line in iter(self.rfile.readline, b''):
+                    if data_line in (b'.\r\n', b'.\n'):
+                        break
+                    data.append(data_line[1:] if data_line.startswith(b'..') else data_line)
+                time.sleep(server.delay)
+                server.save(b''.join(data))
+                self.reply('250 OK queued')
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+
+class MockSMTPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, port, directory, delay=0.0, refuse=0):
+        socketserver.ThreadingTCPServer.__init__(self, ('localhost', port), SMTPHandler)
+        self.directory = directory
+        self.delay = delay
+        self.refuse = refuse
+        self.connections = 0
+        self.received = 0
+        self.lock = threading.Lock()
+        self.counter = itertools.count()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def save(self, data):
+        with self.lock:
+            self.received += 1
+        with open(os.path.join(self.directory, '{:06d}.eml'.format(next(self.counter))), 'wb') as f:
+            f.write(data)
+
+
+def serve(port, directory, delay=0.0, refuse=0):
+    server = MockSMTPServer(port, directory, delay, refuse)
+    threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Mock SMTP relay that saves the messages it receives')
+    parser.add_argument('--port', type=int, help='Port to listen on (default 8025)', default=8025)
+    parser.add_argument('--save', type=str, help='Directory for received messages', default='mock_mail')
+    parser.add_argument('--delay', type=float, help='Seconds to accept each message', default=0.0)
+    parser.add_argument('--refuse', type=int, help='Turn away the first n connections', default=0)
+    options = parser.parse_args()
+
+    mock = MockSMTPServer(options.port, options.save, options.delay, options.refuse)
+    print('Mock SMTP relay on localhost:{}, saving to {}'.format(options.port, options.save))
+    try:
+        mock.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,415 @@
+"""Benchmarks for the delivery scripts
+Use
+---
+    Times each stage of check_references, rename_files, deliver_files, move_files and jwst_etc_check on synthetic
+    reference files, with benchmarks/mock_crds standing in for the crds command line tool. Results are saved as JSON
+    under benchmarks/results so runs of different versions can be compared:
+    ::
+        python benchmarks/run_benchmarks.py -n 20 --size 5MB --repeat 3
+        python benchmarks/run_benchmarks.py --compare results/old.json results/new.json
+
+    Nothing outside the scratch directory (-w) is touched; the /ifs and /grp locations the scripts use are pointed
+    into it, and so is the state they keep in ~/.redcat (the sync hash index and the mail outbox). The jwst_etc_check
+    stages time the checks, planning the delivery, and executing the whole plan as with -u -m.
+"""
+
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import Namespace
+from collections import OrderedDict
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+MOCK_CRDS_DIR = os.path.join(BENCH_DIR, 'mock_crds')
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import check_references  # noqa: E402
+import deliver_files  # noqa: E402
+import delivery_queue  # noqa: E402
+import file_sync  # noqa: E402
+import jwst_etc_check  # noqa: E402
+import mail_outbox  # noqa: E402
+import move_files  # noqa: E402
+import rename_files  # noqa: E402
+from email.mime.text import MIMEText  # noqa: E402
+from generate_references import make_delivery, make_etc_delivery, make_pandeia_release  # noqa: E402
+from mock_smtp import serve  # noqa: E402
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+@contextlib.contextmanager
+def working_directory(path):
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+@contextlib.contextmanager
+def quiet(enabled=True):
+    """ Swallow the scripts' console output while a stage runs
+    """
+    if not enabled:
+        yield
+        return
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class Workspace(object):
+    """ Scratch tree laid out like the real staging, archive, central store and Pandeia areas
+    """
+
+    def __init__(self, root, options):
+        self.root = root
+        self.options = options
+        self.staging = os.path.join(root, 'grp', 'redcat', 'staging', 'ops')
+        self.archive = os.path.join(root, 'ifs', 'redcat')
+        self.central_store = os.path.join(root, 'grp', 'hst', 'cdbs')
+        self.pandeia = os.path.join(root, 'ifs', 'pandeia_release')
+        self.context = os.path.join(root, 'mock_0001.pmap')
+        self.redcat = os.path.join(root, 'redcat')  # Stands in for ~/.redcat
+        self.counter = 0
+
+    def reset(self):
+        if os.path.isdir(self.root):
+            shutil.rmtree(self.root)
+        for directory in (self.staging, self.central_store):
+            os.makedirs(directory)
+        for instrument in ('WFC3', 'NIRCAM'):
+            os.makedirs(os.path.join(self.archive, 'hst' if instrument == 'WFC3' else 'jwst', 'srefpipe',
+                                     instrument))
+        os.makedirs(os.path.join(self.central_store, 'iref'))
+        open(self.context, 'w').close()
+
+    def delivery(self, instrument='WFC3'):
+        """ A fresh delivery directory full of synthetic references, named like a real staging directory
+        """
+        self.counter += 1
+        directory = os.path.join(self.staging, '{}_2020_01_01_{}'.format(instrument, self.counter))
+        files = make_delivery(directory, instrument, self.options.n, self.options.size, self.options.extensions,
+                              bad=self.options.bad)
+        shutil.copy(os.path.join(REPO_DIR, 'delivery_form.txt'), directory)
+        return directory, [os.path.basename(f) for f in files]
+
+    def etc_delivery(self, instrument='nircam'):
+        self.counter += 1
+        directory = os.path.join(self.root, 'etc', 'NIRCAM_2020_01_01_{}'.format(self.counter))
+        tables, config = make_etc_delivery(directory, instrument, self.options.etc_tables)
+        destination = os.path.join(self.pandeia, str(self.counter))
+        make_pandeia_release(destination, instrument, self.options.etc_tables)
+        return directory, tables, os.path.basename(config), destination
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Each stage takes the workspace, prepares its inputs, and returns the function to time
+
+
+def stage_verify(ws, workers):
+    directory, files = ws.delivery()
+
+    def run():
+        with working_directory(directory):
+            check_references.verify_files(files, workers)
+    return run
+
+
+def stage_get_observatory(ws):
+    directory, files = ws.delivery()
+    check_references.options = Namespace(o=None)
+
+    def run():
+        with working_directory(directory):
+            check_references.get_observatory(files)
+    return run
+
+
+def stage_certify(ws, shards):
+    directory, files = ws.delivery()
+    paths = [os.path.join(directory, f) for f in files]
+
+    def run():
+        with working_directory(directory):
+            check_references.run_certify(paths, ws.context, shards)
+    return run
+
+
+def stage_check_certify_results(ws):
+    directory, files = ws.delivery()
+    with working_directory(directory):
+        with open('certify_errored_files.txt', 'w') as f:
+            f.write('\n'.join(os.path.join(directory, name) for name in files[:ws.options.bad]))
+
+    def run():
+        with working_directory(directory):
+            check_references.check_certify_results(files, {f: 'PASSED' for f in files})
+    return run
+
+
+def stage_rename(ws):
+    directory, files = ws.delivery()
+    with working_directory(directory):
+        # rename_files refuses files without passing VERIFIED/CERTIFYD stamps
+        open('certify_errored_files.txt', 'w').close()
+        check_references.check_certify_results(files, {f: 'PASSED' for f in files})
+
+    def run():
+        with working_directory(directory):
+            rename_files.rename_files(files)
+    return run
+
+
+def stage_deliver(ws):
+    directory, _ = ws.delivery()
+
+    def run():
+        os.environ['CRDS_PATH'] = os.path.join(ws.root, 'crds_cache')
+        os.environ['CRDS_SERVER_URL'] = 'https://mock-crds.example'
+        with working_directory(directory):
+            deliver_files.execute_delivery(directory, ('WFC3', '2020_01_01'))
+    return run
+
+
+def stage_queue(ws, jobs):
+    """ Submit three staged deliveries (to two CRDS servers) through the staging-queue scheduler
+    """
+    for instrument in ('WFC3', 'WFC3', 'NIRCAM'):
+        directory, _ = ws.delivery(instrument)
+        # Only checked (and, for HST, renamed) deliveries are queued
+        for name in (delivery_queue.CHECKED_FILE, delivery_queue.RENAME_LOG):
+            open(os.path.join(directory, name), 'w').close()
+
+    def run():
+        delivery_queue.run_queue(delivery_queue.find_queue(os.path.dirname(ws.staging), ['ops']), jobs)
+    return run
+
+
+def stage_move(ws):
+    directory, _ = ws.delivery()
+    for name in ('rename.log', 'certify_results.txt', 'certify_errored_files.txt', 'delivery_results.log'):
+        with open(os.path.join(directory, name), 'w') as f:
+            f.write('mock log\n' * 1000)
+    move_files.REDCAT_ARCHIVE = ws.archive
+    move_files.CENTRAL_STORE = ws.central_store
+
+    def run():
+        move_files.move_results(directory, move_files.instruments)
+    return run
+
+
+def stage_outbox(ws):
+    """ Send one notification per reference file through the outbox to the mock mail relay
+    """
+    server = serve(0, os.path.join(ws.root, 'mail_received'), delay=0.01)
+    outbox = mail_outbox.Outbox(os.path.join(ws.redcat, 'outbox'), *server.server_address)
+    with open(os.path.join(REPO_DIR, 'delivery_form.txt')) as f:
+        form = f.read()
+    for i in range(ws.options.n):
+        message = MIMEText(form)
+        message['Subject'] = 'Delivery {}'.format(i)
+        message['From'] = message['To'] = 'redcat@stsci.edu'
+        outbox.queue(message)
+
+    def run():
+        try:
+            outbox.flush_all()
+        finally:
+            server.shutdown()
+            server.server_close()
+    return run
+
+
+ETC_STEPS = ['verify_fits', 'verify_json', 'check_fits', 'check_json', 'plan', 'execute']
+
+
+def etc_stage(ws, step):
+    """ One step of the jwst_etc_check pipeline on a fresh delivery. execute applies the whole plan (renames,
+        configuration update, copies into the Pandeia tree and retirement of the old files), planned beforehand
+    """
+    directory, tables, config, destination = ws.etc_delivery()
+    jwst_etc_check.TEMPLATE_DIR = destination
+    files = tables + [config]
+
+    def plan():
+        operations, _ = jwst_etc_check.plan_delivery(files, 'nircam', destination, datetime.datetime.now())
+        return operations
+
+    def do(name):
+        if name == 'verify_fits':
+            jwst_etc_check.verify_fits_files(tables)
+        elif name == 'verify_json':
+            jwst_etc_check.verify_json_files([config])
+        elif name == 'check_fits':
+            jwst_etc_check.check_fits_files(tables)
+        elif name == 'check_json':
+            jwst_etc_check.check_json_sections([config], 'nircam')
+        elif name == 'plan':
+            plan()
+        elif name == 'execute':
+            jwst_etc_check.execute(operations, documents=jwst_etc_check.documents,
+                                   hashes=file_sync.HashIndex(os.path.join(ws.redcat, 'sync_hashes.json')))
+
+    if step == 'execute':
+        with working_directory(directory), quiet():
+            operations = plan()
+
+    def run():
+        with working_directory(directory):
+            do(step)
+    return run
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def all_stages(options):
+    stages = [('check_references.get_observatory', stage_get_observatory),
+              ('check_references.verify_files[workers=1]', lambda ws: stage_verify(ws, 1)),
+              ('check_references.verify_files[workers={}]'.format(options.workers),
+               lambda ws: stage_verify(ws, options.workers)),
+              ('check_references.run_certify[shards=1]', lambda ws: stage_certify(ws, 1)),
+              ('check_references.run_certify[shards={}]'.format(options.shards),
+               lambda ws: stage_certify(ws, options.shards)),
+              ('check_references.check_certify_results', stage_check_certify_results),
+              ('rename_files.rename_files', stage_rename),
+              ('deliver_files.execute_delivery', stage_deliver),
+              ('delivery_queue.run_queue[jobs=1]', lambda ws: stage_queue(ws, 1)),
+              ('delivery_queue.run_queue[jobs={}]'.format(options.workers),
+               lambda ws: stage_queue(ws, options.workers)),
+              ('move_files.move_results', stage_move),
+              ('mail_outbox.flush_all', stage_outbox)]
+    for step in ETC_STEPS:
+        stages.append(('jwst_etc_check.{}'.format(step), lambda ws, step=step: etc_stage(ws, step)))
+    return stages
+
+
+def run_benchmarks(options):
+    """ Run every stage options.repeat times and return the results dictionary
+    """
+    os.environ['PATH'] = MOCK_CRDS_DIR + os.pathsep + os.environ.get('PATH', '')
+    os.environ.setdefault('MOCK_CRDS_STARTUP', str(options.crds_startup))
+    os.environ.setdefault('MOCK_CRDS_PER_FILE', str(options.crds_per_file))
+
+    ws = Workspace(options.workdir, options)
+    results = OrderedDict()
+    for name, stage in all_stages(options):
+        if options.only and not any(pattern in name for pattern in options.only):
+            continue
+
+        timings = []
+        error = None
+        for _ in range(options.repeat):
+            ws.reset()
+            try:
+                with quiet(not options.verbose):
+                    run = stage(ws)
+                    start = time.perf_counter()
+                    run()
+                    timings.append(time.perf_counter() - start)
+            except Exception as e:  # Record broken stages instead of stopping the whole suite
+                error = '{}: {}'.format(type(e).__name__, e)
+                break
+
+        results[name] = {'timings': timings, 'error': error,
+                         'best': min(timings) if timings else None,
+                         'mean': sum(timings) / len(timings) if timings else None}
+        print_stage(name, results[name])
+
+    shutil.rmtree(options.workdir, ignore_errors=True)
+    return {'label': options.label,
+            'revision': git_revision(),
+            'date': datetime.datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'parameters': {'n': options.n, 'size': options.size, 'extensions': options.extensions,
+                           'workers': options.workers, 'shards': options.shards, 'repeat': options.repeat,
+                           'crds_startup': options.crds_startup, 'crds_per_file': options.crds_per_file},
+            'stages': results}
+
+
+def print_stage(name, result):
+    if result['error']:
+        print('{:<50} ERROR  {}'.format(name, result['error']))
+    else:
+        print('{:<50} best {:8.3f} s   mean {:8.3f} s'.format(name, result['best'], result['mean']))
+
+
+def compare(old_file, new_file):
+    """ Print the change in best time for every stage present in both result files
+    """
+    old = json.load(open(old_file))
+    new = json.load(open(new_file))
+    print('{:<50} {:>10} {:>10} {:>8}'.format('stage', old['label'][:10], new['label'][:10], 'speedup'))
+    for name, result in new['stages'].items():
+        before = old['stages'].get(name, {}).get('best')
+        after = result['best']
+        if before is None or after is None:
+            print('{:<50} {:>10} {:>10} {:>8}'.format(name, str(before and round(before, 3)),
+                                                       str(after and round(after, 3)), '-'))
+        else:
+            print('{:<50} {:10.3f} {:10.3f} {:7.2f}x'.format(name, before, after, before / after if after else 0))
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the ReDCaT delivery scripts')
+    parser.add_argument('-n', type=int, help='Reference files per delivery.  Default is 10', default=10)
+    parser.add_argument('--size', type=str, help='Size of each reference file (e.g. 100KB, 20MB, 2GB).  '
+                                                 'Default is 2MB', default='2MB')
+    parser.add_argument('--extensions', type=int, help='Extensions per reference file.  Default is 3', default=3)
+    parser.add_argument('--bad', type=int, help='Files per delivery that fail certify.  Default is 1', default=1)
+    parser.add_argument('--etc-tables', type=int, help='ETC tables per delivery.  Default is 16', default=16)
+    parser.add_argument('--workers', type=int, help='Workers for the parallel verify stage.  Default is 4',
+                        default=4)
+    parser.add_argument('--shards', type=int, help='Shards for the parallel certify stage.  Default is 4', default=4)
+    parser.add_argument('--repeat', type=int, help='Times each stage is run.  Default is 3', default=3)
+    parser.add_argument('--crds-startup', type=float, help='Mock crds start up time (s).  Default is 0.5',
+                        default=0.5)
+    parser.add_argument('--crds-per-file', type=float, help='Mock crds time per file (s).  Default is 0.05',
+                        default=0.05)
+    parser.add_argument('--only', type=str, nargs='*', help='Only run stages whose name contains one of these')
+    parser.add_argument('--label', type=str, help='Name for this run.  Default is the git revision', default=None)
+    parser.add_argument('-w', '--workdir', type=str, help='Scratch directory (deleted afterwards)',
+                        default=os.path.join(tempfile.gettempdir(), 'redcat_benchmarks'))
+    parser.add_argument('-v', '--verbose', help='Show the scripts\' own output', action='store_true')
+    parser.add_argument('--compare', type=str, nargs=2, metavar=('OLD', 'NEW'),
+                        help='Compare two saved result files instead of running')
+    options = parser.parse_args()
+
+    if options.compare:
+        compare(*options.compare)
+        sys.exit()
+
+    options.label = options.label or '{}_{}'.format(git_revision(), datetime.datetime.now().strftime('%Y%m%d%H%M%S'))
+    results = run_benchmarks(options)
+
+    if not os.path.isdir(RESULTS_DIR):
+        os.makedirs(RESULTS_DIR)
+    results_file = os.path.join(RESULTS_DIR, '{}.json'.format(options.label))
+    with open(results_file, 'w') as f:
+        json.dump(results, f, indent=2)
+    print('\nResults saved to {}'.format(results_file))
@@ -0,0 +1,166 @@
+"""Streaming parser for crds certify output, written out as a JSON Lines report
+Use
+---
+    Feed lines of crds certify output as they arrive; one record per certified file is written to the report as soon
+    as crds moves on to the next file:
+    ::
+        with open('certify_results.jsonl', mode='w') as out:
+            parser = CertifyParser(out)
+            for line in crds_output:
+                parser.feed(line)
+            parser.close()
+
+    Each record holds the file, its severity (PASSED, WARNING or ERROR), the warning/error messages and the
+    instrument, reftype, rmap and context involved. If crds reports on a file again after moving past it, an updated
+    record for that file is appended, so readers should keep the last record per file (read_report does this).
+    An existing certify_results.txt can be converted with python certify_report.py certify_results.txt
+"""
+
+import argparse
+import json
+import os
+import re
+
+REPORT_FILE = 'certify_results.jsonl'
+CHECKED_FILE = 'check_passed.txt'  # Written by check_references.py when every file passed, read by delivery_queue.py
+
+SEVERITIES = ('PASSED', 'WARNING', 'ERROR')
+
+# CRDS log lines, optionally with a --log-time timestamp in front
+LOG_LINE = re.compile(r'CRDS\s+-\s+(?P<level>[A-Z]+)\s+-\s+(?P<message>.*)$')
+CERTIFYING = re.compile(r"Certifying\s+'?(?P<path>[^'\s]+)'?(?:.*?relative to context\s+'?(?P<context>[^'\s]+)'?)?")
+ERROR_FIELDS = re.compile(r"(?P<key>instrument|type|data)='?(?P<value>[^'\s]+)'?")
+RMAP = re.compile(r"[\w.-]+\.rmap")
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def new_record(path, context=None):
+    return {'file': os.path.basename(path),
+            'path': path,
+            'severity': 'PASSED',
+            'messages': [],
+            'instrument': None,
+            'reftype': None,
+            'rmap': None,
+            'context': context}
+
+
+class CertifyParser(object):
+    """ Turns crds certify output into one record per file. Records are written to out (an open text file) as JSON
+        Lines as soon as they are complete, and are also kept in self.records
+    """
+
+    def __init__(self, out=None):
+        self.out = out
+        self.records = []  # In completion order
+        self.current = None
+        self.by_file = {}  # basename -> record, for messages naming a file other than the current one
+
+    def _finish(self):
+        if self.current is None:
+            return
+        self.records.append(self.current)
+        if self.out is not None:
+            self.out.write(json.dumps(self.current, sort_keys=True) + '\n')
+            self.out.flush()
+        self.current = None
+
+    def _record_for(self, path):
+        """ Record for path: the current one, one still open, or a new one
+        """
+        name = os.path.basename(path)
+        if self.current is not None and self.current['file'] == name:
+            return self.current
+        if name in self.by_file:
+            return self.by_file[name]
+        self._finish()
+        self.current = new_record(path)
+        self.by_file[name] = self.current
+        return self.current
+
+    def feed(self, line):
+        """ Parse one line of crds output
+        """
+        match = LOG_LINE.search(line)
+        if match is None:
+            # Tracebacks and other unformatted output belong to the file being certified
+            if self.current is not None and line.strip():
+                self.current['messages'].append(line.rstrip())
+            return
+
+        level, message = match.group('level'), match.group('message').strip()
+
+        certifying = CERTIFYING.match(message)
+        if certifying is not None:
+            self._finish()
+            self.current = new_record(certifying.group('path'), certifying.group('context'))
+            self.by_file[self.current['file']] = self.current
+            return
+
+        fields = dict(m.groups() for m in ERROR_FIELDS.finditer(message))
+        record = self._record_for(fields['data']) if 'data' in fields else self.current
+        if record is None:
+            return  # Summary lines before or after the per-file sections
+
+        if 'instrument' in fields:
+            record['instrument'] = fields['instrument']
+        if 'type' in fields:
+            record['reftype'] = fields['type']
+        rmap = RMAP.search(message)
+        if rmap is not None:
+            record['rmap'] = rmap.group(0)
+
+        if level in ('WARNING', 'ERROR', 'CRITICAL'):
+            severity = 'ERROR' if level == 'CRITICAL' else level
+            if SEVERITIES.index(severity) > SEVERITIES.index(record['severity']):
+                record['severity'] = severity
+            record['messages'].append(message)
+
+        if record is not self.current and self.out is not None:
+            self.out.write(json.dumps(record, sort_keys=True) + '\n')  # Supersedes the record already written
+            self.out.flush()
+
+    def close(self):
+        """ Flush the last record. Returns all records in the order they were completed
+        """
+        self._finish()
+        return self.records
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def parse_certify_log(log_file, report_file=REPORT_FILE):
+    """ Convert an existing crds certify log (e.g. certify_results.txt) into a JSON Lines report
+    """
+    with open(log_file) as log, open(report_file, mode='w') as out:
+        parser = CertifyParser(out)
+        for line in log:
+            parser.feed(line.rstrip('\n'))
+        return parser.close()
+
+
+def read_report(report_file=REPORT_FILE):
+    """ Load the records of a JSON Lines certify report, keeping the last record written for each file
+    """
+    records = {}
+    with open(report_file) as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                records.pop(record['file'], None)
+                records[record['file']] = record
+    return list(records.values())
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert crds certify output into a JSON Lines report')
+    parser.add_argument('log', type=str, help='crds certify output, e.g. certify_results.txt')
+    parser.add_argument('-o', type=str, help='Report to write.  Default is {}'.format(REPORT_FILE),
+                        action='store', required=False, default=REPORT_FILE)
+    options = parser.parse_args()
+
+    for record in parse_certify_log(options.log, options.o):
+        print('{} {}'.format(record['file'], record['severity']))
@@ -12,11 +12,26 @@ Use
 
 import argparse
 import glob
+import json
 import os
-import subprocess
+import shutil
+import tempfile
+import time
 import warnings
 import shlex
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from astropy.io import fits
+from certify_report import CHECKED_FILE, REPORT_FILE, CertifyParser, new_record
+from context_index import ContextIndex
+from fits_header import read_primary_header
+from header_stamp import report_rewrites, stamp_keywords
+from subprocess_runner import Command, run_commands
+from subprocess_runner import report as report_results
+from verify_cache import DEFAULT_CACHE_FILE, VerifyCache
+
+# Result of verifying a single file; messages holds the text of every warning astropy raised
+VerifyResult = namedtuple('VerifyResult', ['filename', 'passed', 'messages', 'elapsed'])
 
 # ----------------------------------------------------------------------------------------------------------------------
 
@@ -36,8 +51,14 @@ def parse_args():
     """
 
     files_help = 'Name of files or path to files.  Wildcards accepted Default is *.fits'
-    context_help = 'Context filename to use/check against.  Default is most recent (NOT ALWAYS OPERATIONAL).'
+    context_help = ('Context filename to use/check against, or \'latest\' or \'operational\'.  '
+                    'Default is most recent (NOT ALWAYS OPERATIONAL).')
     observatory_help = 'Observatory: either \'hst\' or \'jwst\''
+    workers_help = 'Number of worker processes used to verify files in parallel.  Default is 1 (serial).'
+    no_cache_help = 'Re-verify and re-certify every file, ignoring (and not updating) the verification cache.'
+    clear_cache_help = 'Empty the verification cache before running.'
+    shards_help = 'Split the files into this many batches and certify them with concurrent crds processes.  Default is 1.'
+    cache_file_help = 'Location of the verification cache.  Default is {}'.format(DEFAULT_CACHE_FILE)
 
     parser = argparse.ArgumentParser()
 
@@ -62,6 +83,37 @@ def parse_args():
                         required=False,
                         default=None)
 
+    parser.add_argument('-j', '--workers',
+                        type=int,
+                        help=workers_help,
+                        action='store',
+                        required=False,
+                        default=1)
+
+    parser.add_argument('-s', '--shards',
+                        type=int,
+                        help=shards_help,
+                        action='store',
+                        required=False,
+                        default=1)
+
+    parser.add_argument('--no-cache',
+                        help=no_cache_help,
+                        action='store_true',
+                        required=False)
+
+    parser.add_argument('--clear-cache',
+                        help=clear_cache_help,
+                        action='store_true',
+                        required=False)
+
+    parser.add_argument('--cache-file',
+                        type=str,
+                        help=cache_file_help,
+                        action='store',
+                        required=False,
+                        default=DEFAULT_CACHE_FILE)
+
     arguments = parser.parse_args()
     return arguments
 
@@ -69,58 +121,100 @@ def parse_args():
 
 
 def get_context(observatory, context):
-    """ Get context file for certification
+    """ Get context file for certification. context may be a path, the name of a pmap in the mappings directory,
+        'latest' or 'operational'; None means latest
     """
-    cont_dir = '/grp/crds/{}/mappings/{}'.format(observatory, observatory)
-
-    if context is not None:
-        # Check if context is in current directory/user specified path
-        cont_path = context
-
-        if not os.path.exists(cont_path):
-            # Check to see if context is in mappings directory
-            cont_path = '{}/{}'.format(cont_dir,context)
-
-        assert os.path.exists(cont_path), 'No context {} found at specified path or {}'.format(context, cont_dir)
+    if context is not None and os.path.exists(context):
+        # Context is in current directory/user specified path
+        return context
+
+    index = ContextIndex(observatory)
+    if context is None or context.lower() == 'latest':
+        # Highest numbered pmap in appropriate mapping directory
+        cont_path = index.latest()
+    elif context.lower() == 'operational':
+        cont_path = index.operational()
     else:
-        # Find highest numbered pmap in appropriate mapping directory
-        cont_path = sorted(glob.glob('{}/*pmap'.format(cont_dir)))[-1]
+        # Check to see if context is in mappings directory
+        cont_path = index.find(context)
+        if cont_path is None and os.path.exists(index.path(context)):
+            cont_path = index.path(context)  # Unnumbered mappings are not indexed but can still be used
+
+    assert cont_path is not None, 'No context {} found at specified path or {}'.format(context, index.mappings_dir)
 
     return cont_path
 
 # ----------------------------------------------------------------------------------------------------------------------
 
 
-def get_observatory(pending_files):
-    """ Retrieves the observatory info from the delivery staging directory
+def read_instrument(f):
+    """ Read INSTRUME from the primary header of f without touching the data. Returns (instrument, error message)
+    """
+    try:
+        instrument = read_primary_header(f).get('INSTRUME')
+    except (OSError, ValueError) as e:
+        return None, 'could not read header ({})'.format(e)
+    if instrument is None:
+        return None, 'INSTRUME not found in fits header'
+    return instrument.upper(), None
+
+
+def get_observatory(pending_files, workers=8):
+    """ Retrieves the observatory info from the delivery staging directory, or failing that from the INSTRUME keyword
+        of the fits files. Headers are read in a thread pool and the scan stops at the first file that names a known
+        instrument; files read by then that point to a different observatory are reported
     """
     # Instruments for each observatory
     hst_inst = ['ACS', 'WFC3', 'COS', 'STIS', 'NICMOS', 'WFPC2']
     jwst_inst = ['FGS', 'MIRI', 'NIRCAM', 'NIRISS', 'NIRSPEC']
 
-    if options.o is not None:
-        return options.o.lower()
-    else:
-        directory = os.path.split(os.getcwd())[-1]
-        instrument = directory.split('_')[0]
-
+    def observatory_of(instrument):
         if instrument in hst_inst:
             return 'hst'
         elif instrument in jwst_inst:
             return 'jwst'
-        else:
-            for f in pending_files:
-                if '.fits' in f:
-                    try:
-                        instrument = fits.getval(f, 'INSTRUME').upper()
-                        if instrument in hst_inst:
-                            return 'hst'
-                        elif instrument in jwst_inst:
-                            return 'jwst'
-                        else:
-                            raise ValueError('Cannot match {} to an observatory'.format(instrument))
-                    except KeyError:
-                        raise KeyError('INSTRUME not found in fits header, so observatory cannot be determined')
+        return None
+
+    if options.o is not None:
+        return options.o.lower()
+
+    directory = os.path.split(os.getcwd())[-1]
+    observatory = observatory_of(directory.split('_')[0])
+    if observatory is not None:
+        return observatory
+
+    candidates = [f for f in pending_files if '.fits' in f]
+    found = {}     # observatory -> files
+    problems = []  # (file, message) for files that could not be matched
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(candidates)))) as pool:
+        futures = {pool.submit(read_instrument, f): f for f in candidates}
+        for future in as_completed(futures):
+            if future.cancelled():
+                continue
+            f = futures[future]
+            instrument, error = future.result()
+            observatory = observatory_of(instrument)
+            if observatory is not None:
+                found.setdefault(observatory, []).append(f)
+                # Definitive answer, skip files that have not been read yet
+                for pending in futures:
+                    pending.cancel()
+            elif error is not None:
+                problems.append((f, error))
+            else:
+                problems.append((f, 'cannot match {} to an observatory'.format(instrument)))
+
+    if len(found) > 1:
+        print('WARNING: files in this delivery disagree about the observatory:')
+        for observatory, obs_files in sorted(found.items()):
+            print('\t{}: {}'.format(observatory, ', '.join(sorted(obs_files))))
+
+    if found:
+        # Files are matched in completion order, so report the observatory of the first file in the delivery
+        return min(found, key=lambda obs: min(candidates.index(f) for f in found[obs]))
+
+    for f, message in problems:
+        print('{}: {}'.format(f, message))
 
     # If if can't determine instrument, raise exception
     raise ValueError('Cannot match files to an observatory')
@@ -144,46 +238,203 @@ def print_extra_help():
 # ----------------------------------------------------------------------------------------------------------------------
 
 
-def verify_files(fits_files):
-    """ Check files conform to fits standard and update verification keyword
+def verify_single_file(f):
+    """ Verify one fits file. Runs inside a worker process, so only picklable values are returned.
+        The file is opened read-only; VERIFIED is stamped later together with CERTIFYD (see check_certify_results)
+    """
+    start = time.time()
+    with warnings.catch_warnings(record=True) as w:  # Workaround for astropy verify issues
+        warnings.simplefilter("always")  # Catch all warnings
+        hdu = fits.open(f, checksum=True)  # Catches the 'fixable violations'
+        hdu.verify('warn')  # Catches the unfixable ones
+
+        passed = len(w) == 0  # Check number of warnings, if =0 then file is good
+        hdu.close(output_verify='ignore')
+
+        messages = [str(warn.message) for warn in w]
+
+    return VerifyResult(f, passed, messages, time.time() - start)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def print_verify_result(result):
+    """ Print the outcome of a single verification in the same layout as a serial run
+    """
+    print('Verifying {}'.format(result.filename))
+    if result.passed:
+        print(result.filename, 'PASSED VERIFICATION')
+    else:
+        print(result.filename, 'FAILED VERIFICATION')
+        for message in result.messages:
+            print(message)
+    print('({:.2f} s)'.format(result.elapsed))
+    print('----------------------------------------------------------------')
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def verify_files(fits_files, workers=1):
+    """ Check files conform to fits standard. With workers > 1 the files are spread across a process pool; results are still printed in input order
     """
     print('----------------------------------------------------------------')
     print('--------------------------VERIFYING-----------------------------')
     print('----------------------------------------------------------------')
 
+    to_verify = []
     for f in fits_files:
         if '.json' in f or '.asdf' in f:
             print('{} is not a fits file, skipping verification'.format(f))
             continue
+        to_verify.append(f)
+
+    results = []
+    if workers > 1 and len(to_verify) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # map yields in submission order, so output stays grouped per file
+            for result in pool.map(verify_single_file, to_verify):
+                print_verify_result(result)
+                results.append(result)
+    else:
+        for f in to_verify:
+            result = verify_single_file(f)
+            print_verify_result(result)
+            results.append(result)
+
+    return results
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def split_into_shards(paths, n_shards):
+    """ Split paths into at most n_shards batches of roughly equal total size, so no single crds process is left
+        with all of the large files. Input order is kept within each batch
+    """
+    n_shards = max(1, min(n_shards, len(paths)))
+    sizes = {p: os.path.getsize(p) if os.path.exists(p) else 0 for p in paths}
 
-        print('Verifying {}'.format(f))
-        with warnings.catch_warnings(record=True) as w:  # Workaround for astropy verify issues
-            warnings.simplefilter("always")  # Catch all warnings
-            hdu = fits.open(f, mode='update', checksum=True)  # Catches the 'fixable violations'
-            hdu.verify('warn')  # Catches the unfixable ones
+    # Largest first onto the least loaded shard
+    shards = [[] for _ in range(n_shards)]
+    loads = [0] * n_shards
+    for p in sorted(paths, key=lambda x: sizes[x], reverse=True):
+        lightest = loads.index(min(loads))
+        shards[lightest].append(p)
+        loads[lightest] += sizes[p]
+
+    order = {p: i for i, p in enumerate(paths)}
+    return [sorted(shard, key=lambda x: order[x]) for shard in shards if shard]
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def build_certify_command(paths, context, errors_file, log_file, label='', parser=None):
+    """ Build the crds certify command for one batch of files, writing the unique errors to errors_file and the crds
+        output to log_file. If given, parser (a CertifyParser) is fed the output as it arrives
+    """
+    certify_command = ("crds certify --verbose -p --unique-errors-file "
+                       "{} --comparison-context={} {}").format(errors_file, context, ' '.join(paths))
+
+    shell_cmd = shlex.split(certify_command)    # Split the commmand string into a subprocess-friendly list
+    print('{}{}\n'.format('{} '.format(label) if label else '', shell_cmd))  # of "tokenized" arguments
 
-            if len(w) == 0:  # Check number of warnings, if =0 then file is good
-                print(f, 'PASSED VERIFICATION')
-                hdu[0].header['VERIFIED'] = 'PASSED'
+    # CRDS's output has been defined as standard error, but both streams are logged
+    return Command(shell_cmd, log_file, label, on_line=parser.feed if parser is not None else None)
+
+
+def certify_crashed(result, errors_file):
+    """ Reason a crds certify process did not certify its files, or None if its errors file can be trusted.
+        crds exits 1 when a file has errors, so a nonzero exit only counts as a crash if no file was named
+    """
+    if result.returncode < 0:
+        return 'killed by signal {}'.format(-result.returncode)
+    if not os.path.exists(errors_file):
+        return 'exit code {} without writing {}'.format(result.returncode, os.path.basename(errors_file))
+    if result.returncode != 0 and not any(line.strip() for line in open(errors_file)):
+        return 'exit code {} without naming a failed file'.format(result.returncode)
+    return None
+
+
+def run_certify(abs_paths, context, shards=1, report=None):
+    """ Certify abs_paths against context, writing certify_errored_files.txt and certify_results.txt.
+        With shards > 1 the files are split into batches certified by concurrent crds processes, and the per-batch
+        outputs are merged back into the same two files a single run would produce.
+        Every file of a crds process that crashed (see certify_crashed) is listed as failed.
+        If report (an open file) is given, per-file records are written to it as JSON Lines while crds runs
+    """
+    batches = split_into_shards(abs_paths, shards)
+    parsers = [CertifyParser(report) for _ in batches]
+    if len(batches) == 1:
+        if os.path.exists('certify_errored_files.txt'):
+            os.remove('certify_errored_files.txt')  # Left by an earlier run, it would hide a crash of this one
+        results = run_commands([build_certify_command(abs_paths, context, 'certify_errored_files.txt',
+                                                      'certify_results.txt', parser=parsers[0])])
+        report_results(results)
+        parsers[0].close()
+        crashed = certify_crashed(results[0], 'certify_errored_files.txt')
+        if crashed:
+            print('crds certify {}: every file is marked as failed'.format(crashed))
+            with open('certify_errored_files.txt', mode='w') as errored:
+                for path in abs_paths:
+                    print(path, file=errored)
+        return
+
+    # Work in a scratch directory so the per-shard files are never picked up by move_files.py
+    shard_dir = tempfile.mkdtemp(prefix='certify_shards_')
+    errors_files = [os.path.join(shard_dir, 'errored_{}.txt'.format(i)) for i in range(len(batches))]
+    log_files = [os.path.join(shard_dir, 'results_{}.txt'.format(i)) for i in range(len(batches))]
+
+    commands = []
+    for i, batch in enumerate(batches):
+        label = '[shard {}/{}]'.format(i + 1, len(batches))
+        print('{} {} files'.format(label, len(batch)))
+        commands.append(build_certify_command(batch, context, errors_files[i], log_files[i], label, parsers[i]))
+    results = run_commands(commands)
+    report_results(results)
+    for parser in parsers:
+        parser.close()
+
+    # Merge, keeping shard order and dropping any file reported twice
+    seen = set()
+    with open('certify_errored_files.txt', mode='w') as errored:
+        for i, errors_file in enumerate(errors_files):
+            crashed = certify_crashed(results[i], errors_file)
+            if crashed:
+                print('{} crds certify {}: its {} files are marked as failed'.format(
+                    results[i].label, crashed, len(batches[i])))
+                names = batches[i]
             else:
-                print(f, 'FAILED VERIFICATION')
-                hdu[0].header['VERIFIED'] = 'FAILED'
-                for warn in w:
-                    print(warn.message)
+                names = [line.strip() for line in open(errors_file)]
+            for name in names:
+                if name and name not in seen:
+                    seen.add(name)
+                    print(name, file=errored)
 
-            hdu.close(output_verify='ignore')
+    with open('certify_results.txt', mode='w') as cert:
+        for i, log_file in enumerate(log_files):
+            print('======== crds certify shard {} of {} ========'.format(i + 1, len(batches)), file=cert)
+            if os.path.exists(log_file):
+                with open(log_file) as log:
+                    shutil.copyfileobj(log, cert)
 
-        print('----------------------------------------------------------------')
+    shutil.rmtree(shard_dir, ignore_errors=True)
 
 # ----------------------------------------------------------------------------------------------------------------------
 
 
-def check_certify_results(certified_files):
-    """ Check files passed certify and update certification keyword
+def check_certify_results(certified_files, verify_status=None):
+    """ Check files passed certify and update certification keyword. verify_status (file -> 'PASSED'/'FAILED') gives
+        the VERIFIED value to stamp at the same time, so each file's header is written once.
+        Returns a dictionary of file -> True/False (passed certify) for every file, including json/asdf
     """
+    verify_status = verify_status or {}
+
     # Get list of files that failed certify (parses output file)
     bad_files = [os.path.split(x.strip())[-1] for x in open('certify_errored_files.txt').readlines()]
+    outcomes = {}
+    stamped = []
     for f in certified_files:
+        passed = os.path.basename(f) not in bad_files
+        outcomes[f] = passed
         if '.json' in f or '.asdf' in f:
             continue
 
@@ -191,17 +442,59 @@ def check_certify_results(certified_files):
             # for VERIFYD/CERTIFYD keywords (because thats only checked in
             # rename_files.py) and json/asdf are only jwst.
 
-        hdu = fits.open(f, mode='update')
-        if f in bad_files:
-            hdu[0].header['CERTIFYD'] = 'FAILED'
+        keywords = OrderedDict()
+        if f in verify_status:
+            keywords['VERIFIED'] = verify_status[f]
+        keywords['CERTIFYD'] = 'PASSED' if passed else 'FAILED'
+        stamped.append(stamp_keywords(f, keywords))
+
+        if not passed:
             print(f, 'FAILED CERTIFICATION')
         else:
-            hdu[0].header['CERTIFYD'] = 'PASSED'
             print(f, 'PASSED CERTIFICATION')
-
-        hdu.close(output_verify='ignore')
         print('----------------------------------------------------------------')
 
+    report_rewrites(stamped)
+    return outcomes
+
+
+def mark_checked(files, context_name, verify_status, certify_outcomes):
+    """ Write CHECKED_FILE (the context and the files checked) if every file passed verify and certify, which tells
+        delivery_queue.py the delivery is ready. Returns the files that failed
+    """
+    failed = [f for f in files if not certify_outcomes[f] or verify_status.get(f) == 'FAILED']
+    if not failed:
+        with open(CHECKED_FILE, mode='w') as marker:
+            print(context_name, file=marker)
+            for f in files:
+                print(f, file=marker)
+    return failed
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def split_cached_files(files, cache, context_name):
+    """ Split files into those with a cached outcome for this context and those that still need checking
+    """
+    cached = {}
+    pending = []
+    for f in files:
+        entry = cache.lookup(f, context_name)
+        if entry is None:
+            pending.append(f)
+            continue
+
+        cached[f] = entry
+        if entry['verify'] is not None:
+            status = 'PASSED' if entry['verify']['passed'] else 'FAILED'
+            print('{} unchanged since last run, cached verification: {}'.format(f, status))
+            for message in entry['verify']['messages']:
+                print(message)
+        else:
+            print('{} unchanged since last run, using cached certification'.format(f))
+
+    return cached, pending
+
 # ----------------------------------------------------------------------------------------------------------------------
 
 
@@ -212,38 +505,74 @@ if __name__ == '__main__':
     else:
         files = glob.glob('*.fits') + glob.glob('*.json') + glob.glob('*.asdf')
 
-    abs_paths = [os.path.abspath(f) for f in files]
-
     # Check if there are files?  Call to certify will handle this
     assert len(files) != 0, 'No files matched'
     observatory = get_observatory(files)
     assert observatory == 'hst' or observatory == 'jwst', 'Invalid observatory, specify either \'hst\' or \'jwst\''
     context = get_context(observatory, options.c)
+    context_name = os.path.basename(context)
 
     for f in files:
         print(f)
 
-    verify_files(files)
-    print('----------------------------------------------------------------')
-    print('--------------------------CERTIFYING----------------------------')
-    print('----------------------------------------------------------------')
+    if os.path.exists(CHECKED_FILE):
+        os.remove(CHECKED_FILE)  # Only this run decides whether the delivery is ready
 
-    certify_command = ("crds certify --verbose -p --unique-errors-file "
-                       "certify_errored_files.txt --comparison-context={} {}").format(context, ' '.join(abs_paths))
+    cache = VerifyCache(options.cache_file, enabled=not options.no_cache)
+    if options.clear_cache:
+        cache.clear()
 
-    shell_cmd = shlex.split(certify_command)    # Split the commmand string into a subprocess-friendly list
-    print(shell_cmd, '\n')                            # of "tokenized" arguments
+    print('----------------------------------------------------------------')
+    print('--------------------------CHECKING CACHE------------------------')
+    print('----------------------------------------------------------------')
+    cached, pending = split_cached_files(files, cache, context_name)
+    print('{} of {} files unchanged since last run against {}'.format(len(cached), len(files), context_name))
 
-    # Open a subprocess and recover the standard error, since that's what CRDS's output has ben defined as...
-    with subprocess.Popen(shell_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE) as p, \
-            open('certify_results.txt', mode='w+') as cert:
+    verify_results = {result.filename: result for result in verify_files(pending, options.workers)}
+    print('----------------------------------------------------------------')
+    print('--------------------------CERTIFYING----------------------------')
+    print('----------------------------------------------------------------')
 
-        while p.poll() is None:
-            out = p.stderr.readline().decode('utf-8')
-            if out == '' and p.poll() is not None:
-                break
-            if out:
-                print(out)
-                print(out, file=cert)  # Write the output to a file
+    abs_paths = [os.path.abspath(f) for f in pending]
+    with open(REPORT_FILE, mode='w') as report:
+        if abs_paths:
+            run_certify(abs_paths, context, options.shards, report)
+        else:
+            print('All files unchanged since last run, skipping crds certify')
+            open('certify_errored_files.txt', mode='w').close()
+            open('certify_results.txt', mode='w').close()
+
+        # Cached failures are added back so the error list covers every file, as if they had been certified this run
+        with open('certify_errored_files.txt', mode='a') as errored, open('certify_results.txt', mode='a') as cert:
+            for f, entry in cached.items():
+                print('{} skipped, unchanged since a previous certify against {} (cached: {})'.format(
+                    f, context_name, 'PASSED' if entry['certify'] else 'FAILED'), file=cert)
+                if not entry['certify']:
+                    print(os.path.abspath(f), file=errored)
+
+                record = new_record(os.path.abspath(f), context_name)
+                record['severity'] = 'PASSED' if entry['certify'] else 'ERROR'
+                record['messages'] = ['unchanged since a previous certify, result taken from the verification cache']
+                record['cached'] = True
+                print(json.dumps(record, sort_keys=True), file=report)
+
+    verify_status = {f: 'PASSED' if result.passed else 'FAILED' for f, result in verify_results.items()}
+    for f, entry in cached.items():
+        if entry['verify'] is not None:
+            verify_status[f] = 'PASSED' if entry['verify']['passed'] else 'FAILED'
+
+    certify_outcomes = check_certify_results(files, verify_status)
 
-    check_certify_results(files)
+    for f in files:
+        if f not in cached:
+            cache.store(f, context_name, verify=verify_results.get(f), certify=certify_outcomes[f])
+        elif cached[f]['verify'] is not None:
+            # Stamping rewrote the checksums, so the outcomes move to the file's new hash
+            cache.refresh(f)
+    cache.save()
+
+    failed = mark_checked(files, context_name, verify_status, certify_outcomes)
+    if failed:
+        print('{} of {} files failed, the delivery is not ready to submit'.format(len(failed), len(files)))
+    else:
+        print('All {} files passed, wrote {}'.format(len(files), CHECKED_FILE))
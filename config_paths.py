@@ -0,0 +1,153 @@
+"""Change sets for the paths section of a JWST ETC configuration file
+Use
+---
+    The paths section is indexed once by filetype (file name without timestamp and extension, see
+    pandeia_index.filetype_key) and every delivered file is matched to the keys holding its filetype exactly. The
+    result is a list of PathChange (key, old path, new path) that can be reviewed, applied and reverted:
+    ::
+        changes = plan_changes(config['paths'], delivered_files)
+        print(render_changes(changes))
+        apply_changes(config['paths'], changes)
+        write_changes(changes, 'json_changes.json', 'jwst_nircam_configuration_20200101120000.json')
+
+    A configuration file updated by jwst_etc_check.py -u can be put back with
+    python config_paths.py revert json_changes.json
+"""
+
+import argparse
+import json
+import os
+from collections import OrderedDict, namedtuple
+
+from pandeia_index import filetype_key
+
+CHANGES_FILE = 'json_changes.json'
+
+PathChange = namedtuple('PathChange', ['key', 'old', 'new'])
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def index_paths(paths):
+    """ filetype -> list of paths keys whose value is a file of that filetype. meta entries are skipped
+    """
+    index = {}
+    for key, value in paths.items():
+        if 'meta' in key or not isinstance(value, str):
+            continue
+        index.setdefault(filetype_key(value), []).append(key)
+    return index
+
+
+def merge_changes(paths, old_paths):
+    """ Changes that carry the entries of a previous paths section over into paths (the first step of updating a
+        delivered configuration file, whose paths are not yet those of the release)
+    """
+    changes = []
+    for key, value in old_paths.items():
+        if 'meta' in key or paths.get(key) == value:
+            continue
+        changes.append(PathChange(key, paths.get(key), value))
+    return changes
+
+
+def plan_changes(paths, files):
+    """ Changes pointing the paths keys at the delivered FITS files. The directory part of each entry is kept.
+        Returns (changes, unmatched files)
+    """
+    index = index_paths(paths)
+    changes = []
+    unmatched = []
+    for f in files:
+        if '.fits' not in f:
+            continue
+        keys = index.get(filetype_key(f))
+        if not keys:
+            unmatched.append(f)
+            continue
+        name = os.path.basename(f)
+        for key in keys:
+            prefix = os.path.split(paths[key])[0]
+            new_entry = '{}/{}'.format(prefix, name) if prefix else name
+            if new_entry != paths[key]:
+                changes.append(PathChange(key, paths[key], new_entry))
+    return changes, unmatched
+
+
+def apply_changes(paths, changes):
+    """ Apply changes to paths in place, in order
+    """
+    for change in changes:
+        paths[change.key] = change.new
+    return paths
+
+
+def revert_changes(paths, changes):
+    """ Undo changes on paths in place, last change first. Keys added by a change are removed again.
+        Returns the changes that could not be reverted because their entry was edited since
+    """
+    conflicts = []
+    for change in reversed(changes):
+        if paths.get(change.key) != change.new:
+            conflicts.append(change)
+        elif change.old is None:
+            del paths[change.key]
+        else:
+            paths[change.key] = change.old
+    return conflicts
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def render_changes(changes):
+    lines = []
+    for change in changes:
+        lines.append('{}: {} -> {}'.format(change.key, change.old, change.new))
+    return '\n'.join(lines)
+
+
+def write_changes(changes, filename, config_file):
+    """ Save a change set for review or a later revert
+    """
+    record = OrderedDict([('config', os.path.abspath(config_file)),
+                          ('changes', [change._asdict() for change in changes])])
+    with open(filename, 'w') as f:
+        json.dump(record, f, indent=4)
+
+
+def read_changes(filename):
+    """ Returns (config file, list of PathChange) from a saved change set
+    """
+    with open(filename) as f:
+        record = json.load(f)
+    return record['config'], [PathChange(c['key'], c['old'], c['new']) for c in record['changes']]
+
+
+def revert_file(changes_file):
+    """ Revert a configuration file using its saved change set. Returns the changes that could not be reverted
+    """
+    config_file, changes = read_changes(changes_file)
+    with open(config_file) as f:
+        config = json.load(f, object_pairs_hook=OrderedDict)
+    conflicts = revert_changes(config['paths'], changes)
+    with open(config_file, 'w') as f:
+        json.dump(config, f, indent=4)
+    return conflicts
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Review or revert a change set written by jwst_etc_check.py')
+    parser.add_argument('action', type=str, choices=['show', 'revert'], help='Print or revert the change set')
+    parser.add_argument('changes', type=str, nargs='?', help='Change set.  Default is {}'.format(CHANGES_FILE),
+                        default=CHANGES_FILE)
+    options = parser.parse_args()
+
+    if options.action == 'show':
+        config_file, changes = read_changes(options.changes)
+        print('{} ({} changes)'.format(config_file, len(changes)))
+        print(render_changes(changes))
+    else:
+        for change in revert_file(options.changes):
+            print('WARNING {} was changed since, not reverted: {}'.format(change.key, change.new))
@@ -0,0 +1,147 @@
+"""Index of the CRDS context (.pmap) files available for an observatory
+Use
+---
+    The listing of /grp/crds/<obs>/mappings/<obs> is cached on disk and only rebuilt when the directory's mtime
+    changes, and serial numbers are compared as numbers rather than text (so hst_1000.pmap is newer than
+    hst_0999.pmap):
+    ::
+        index = ContextIndex('hst')
+        index.latest()              # path to the highest numbered pmap
+        index.operational()         # path to the operational pmap, from the CRDS server_config
+        index.find('hst_0700.pmap') # path to a named pmap, or None
+
+    root can point at any tree laid out as <root>/<obs>/mappings/<obs>/*.pmap, such as a local CRDS cache.
+"""
+
+import ast
+import json
+import os
+import re
+
+CRDS_ROOT = '/grp/crds'
+INDEX_DIR = os.path.join(os.path.expanduser('~'), '.redcat')
+
+# Numbered contexts only, e.g. hst_0723.pmap or jwst_1077.pmap; edit and unnumbered mappings are ignored
+PMAP_PATTERN = re.compile(r'^(?P<observatory>[a-z]+)_(?P<serial>\d+)\.pmap$')
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def pmap_serial(name):
+    """ Return the serial number of a numbered pmap name as an int, or None if it is not one
+    """
+    match = PMAP_PATTERN.match(os.path.basename(name))
+    if match is None:
+        return None
+    return int(match.group('serial'))
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class ContextIndex(object):
+    """ Cached, numerically ordered listing of the pmaps in one observatory's mappings directory
+    """
+
+    def __init__(self, observatory, root=CRDS_ROOT, index_dir=INDEX_DIR):
+        self.observatory = observatory.lower()
+        self.root = root
+        self.mappings_dir = os.path.join(root, self.observatory, 'mappings', self.observatory)
+        self.server_config = os.path.join(root, self.observatory, 'config', self.observatory, 'server_config')
+        self.index_file = os.path.join(index_dir, 'context_index_{}.json'.format(self.observatory)) \
+            if index_dir else None
+
+        self.serials = {}  # pmap name -> serial number
+        self.latest_name = None
+        self.operational_name = None
+        self.refresh()
+
+    def refresh(self):
+        """ Make sure the index matches the mappings directory, re-listing it only if its mtime changed
+        """
+        mtimes = {'mappings': os.stat(self.mappings_dir).st_mtime_ns,
+                  'server_config': os.stat(self.server_config).st_mtime_ns
+                  if os.path.exists(self.server_config) else None}
+
+        saved = self._load()
+        if saved is not None and saved.get('root') == self.root and saved.get('mtimes') == mtimes:
+            self.serials = saved['serials']
+            self.latest_name = saved['latest']
+            self.operational_name = saved['operational']
+            return
+
+        self.serials = {}
+        for entry in os.scandir(self.mappings_dir):
+            serial = pmap_serial(entry.name)
+            if serial is not None and entry.name.startswith(self.observatory + '_'):
+                self.serials[entry.name] = serial
+
+        self.latest_name = max(self.serials, key=self.serials.get) if self.serials else None
+        self.operational_name = self._read_operational()
+        self._save(mtimes)
+
+    def _read_operational(self):
+        """ Name of the operational context recorded in the CRDS server_config, if there is one. CRDS writes the
+            file as a Python literal (the repr of a dict); JSON is accepted too
+        """
+        try:
+            with open(self.server_config) as f:
+                text = f.read()
+        except OSError:
+            return None
+        try:
+            config = ast.literal_eval(text)
+        except (ValueError, SyntaxError, MemoryError, RecursionError):
+            try:
+                config = json.loads(text)
+            except ValueError:
+                return None
+        name = config.get('operational_context') if isinstance(config, dict) else None
+        return name if name in self.serials else None
+
+    def _load(self):
+        if not self.index_file:
+            return None
+        try:
+            with open(self.index_file) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _save(self, mtimes):
+        if not self.index_file:
+            return
+        directory = os.path.dirname(self.index_file)
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            temp_path = '{}.{}.tmp'.format(self.index_file, os.getpid())
+            with open(temp_path, mode='w') as f:
+                json.dump({'root': self.root, 'mtimes': mtimes, 'serials': self.serials,
+                           'latest': self.latest_name, 'operational': self.operational_name}, f)
+            os.replace(temp_path, self.index_file)
+        except OSError:
+            pass  # The index is only an optimisation; an unwritable home directory should not stop a delivery
+
+    def path(self, name):
+        return os.path.join(self.mappings_dir, name)
+
+    def latest(self):
+        """ Path to the highest numbered pmap (NOT ALWAYS OPERATIONAL)
+        """
+        if self.latest_name is None:
+            raise ValueError('No numbered pmap files found in {}'.format(self.mappings_dir))
+        return self.path(self.latest_name)
+
+    def operational(self):
+        """ Path to the operational pmap named in the CRDS server_config
+        """
+        if self.operational_name is None:
+            raise ValueError('No operational context recorded in {}'.format(self.server_config))
+        return self.path(self.operational_name)
+
+    def find(self, name):
+        """ Path to the pmap called name (with or without the .pmap extension), or None if it is not indexed
+        """
+        if not name.endswith('.pmap'):
+            name = '{}.pmap'.format(name)
+        return self.path(name) if name in self.serials else None
@@ -0,0 +1,205 @@
+"""Parallel, verified file copies for moving deliveries to the archive and the central store
+Use
+---
+    Several copies run at once in a bounded thread pool, each reading in large blocks (or cloning on the filesystem
+    when source and target share one). Every copy is written to a .part file, read back and compared with the
+    checksum of the source before it is renamed into place. Completed copies are recorded in a journal next to the
+    sources, so rerunning an interrupted batch only copies what is left:
+    ::
+        results = copy_files([(source, target), ...], workers=4, journal='/path/to/delivery/.copy_journal.jsonl')
+        if failed(results):
+            ...
+
+    mode sets the permissions of the copies before they are renamed into place, and progress prints the running
+    total of bytes copied and the rate after each file:
+    ::
+        copy_files([(source, '/grp/redcat/staging/ops/NIRCAM_2020_01_01_0')], mode=0o777, progress=True)
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from file_sync import local_clone
+
+JOURNAL_FILE = '.copy_journal.jsonl'
+READ_SIZE = 16 * 1024 * 1024
+WORKERS = 4
+
+CopyResult = namedtuple('CopyResult', ['source', 'target', 'size', 'elapsed', 'checksum', 'skipped', 'error'])
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def checksum(filename):
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(READ_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def stream_copy(source, target):
+    """ Copy source to target in READ_SIZE blocks, hashing the data on the way. Returns the sha256 of source
+    """
+    digest = hashlib.sha256()
+    with open(source, 'rb') as src, open(target, 'wb') as dst:
+        for chunk in iter(lambda: src.read(READ_SIZE), b''):
+            digest.update(chunk)
+            dst.write(chunk)
+        dst.flush()
+        os.fsync(dst.fileno())
+    return digest.hexdigest()
+
+
+def verified_copy(source, target, mode=None):
+    """ Copy source to target through target.part and check the written file against the source before renaming
+        it into place with the permissions of source, or mode if given. Returns the sha256 of the file; raises
+        IOError if the copy does not match
+    """
+    if os.path.isdir(target):
+        target = os.path.join(target, os.path.basename(source))
+    partial = target + '.part'
+    try:
+        if local_clone(source, partial):
+            expected = checksum(source)
+        else:
+            expected = stream_copy(source, partial)
+        written = checksum(partial)
+        if written != expected:
+            raise IOError('Checksum mismatch copying {} to {}'.format(source, target))
+        os.chmod(partial, os.stat(source).st_mode & 0o7777 if mode is None else mode)
+        os.rename(partial, target)
+    except Exception:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    return expected
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class CopyJournal(object):
+    """ JSON Lines record of the copies of a batch that have completed. Thread safe
+    """
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.completed = {}
+        self.lock = threading.Lock()
+        if filename and os.path.exists(filename):
+            with open(filename) as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        self.completed[(record['source'], record['target'])] = record
+
+    def done(self, source, target):
+        """ The completed record of this copy if it was made from the same source and is still in place
+        """
+        record = self.completed.get((source, target))
+        if record is None or not os.path.exists(target):
+            return None
+        stat = os.stat(source)
+        if record['size'] != stat.st_size or record['mtime_ns'] != stat.st_mtime_ns:
+            return None
+        if os.path.getsize(target) != record['size']:
+            return None
+        return record
+
+    def record(self, source, target, digest):
+        stat = os.stat(source)
+        record = {'source': source, 'target': target, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                  'sha256': digest}
+        with self.lock:
+            self.completed[(source, target)] = record
+            if self.filename:
+                with open(self.filename, 'a') as f:
+                    f.write(json.dumps(record) + '\n')
+
+    def finish(self):
+        if self.filename and os.path.exists(self.filename):
+            os.remove(self.filename)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def _copy_one(source, target, journal, mode=None):
+    source = os.path.abspath(source)
+    if os.path.isdir(target):
+        target = os.path.join(target, os.path.basename(source))
+    target = os.path.abspath(target)
+    size = os.path.getsize(source)
+
+    record = journal.done(source, target)
+    if record is not None:
+        return CopyResult(source, target, size, 0.0, record['sha256'], True, None)
+
+    start = time.time()
+    try:
+        digest = verified_copy(source, target, mode)
+    except (OSError, IOError) as e:
+        return CopyResult(source, target, size, time.time() - start, None, False, str(e))
+    journal.record(source, target, digest)
+    return CopyResult(source, target, size, time.time() - start, digest, False, None)
+
+
+def rate(size, elapsed):
+    return '{:.1f} MB/s'.format(size / 1e6 / elapsed) if elapsed > 0 else '-'
+
+
+def print_result(result):
+    name = os.path.basename(result.source)
+    if result.error:
+        print('FAILED {}: {}'.format(name, result.error))
+    elif result.skipped:
+        print('ALREADY COPIED {} TO {}'.format(name, os.path.dirname(result.target)))
+    else:
+        print('COPIED {} TO {} ({:.1f} MB in {:.2f} s, {})'.format(name, os.path.dirname(result.target),
+                                                                  result.size / 1e6, result.elapsed,
+                                                                  rate(result.size, result.elapsed)))
+
+
+def print_progress(count, total, done, size, elapsed):
+    print('{} out of {}: {:.1f} of {:.1f} MB ({})'.format(count, total, done / 1e6, size / 1e6, rate(done, elapsed)))
+
+
+def copy_files(jobs, workers=WORKERS, journal=None, mode=None, progress=False):
+    """ Copy (source, target) pairs, target being a file or a directory, several at a time. The journal file, if
+        given, lets an interrupted batch be resumed and is removed once every copy has succeeded. mode, if given,
+        is set on every copy. Results are printed as copies finish, with the running byte count if progress.
+        Returns a CopyResult per job, in job order
+    """
+    jobs = list(jobs)
+    log = CopyJournal(journal)
+    size = sum(os.path.getsize(source) for source, _ in jobs) if progress else 0
+    done = 0
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = [pool.submit(_copy_one, source, target, log, mode) for source, target in jobs]
+        for count, future in enumerate(as_completed(futures), 1):
+            result = future.result()
+            print_result(result)
+            if progress:
+                done += result.size
+                print_progress(count, len(futures), done, size, time.time() - start)
+        results = [future.result() for future in futures]
+    elapsed = time.time() - start
+
+    copied = [r for r in results if not r.skipped and not r.error]
+    total = sum(r.size for r in copied)
+    print('{} copied, {} already in place, {} failed: {:.1f} MB in {:.2f} s ({})'.format(
+        len(copied), sum(1 for r in results if r.skipped), sum(1 for r in results if r.error), total / 1e6,
+        elapsed, rate(total, elapsed)))
+
+    if not any(r.error for r in results):
+        log.finish()
+    return results
+
+
+def failed(results):
+    return [r for r in results if r.error]
@@ -0,0 +1,338 @@
+"""SQLite catalog of the deliveries archived under /ifs/redcat
+Use
+---
+    Archived deliveries live in <archive>/{hst,jwst}/{srefpipe,cdbstest}/<INSTRUMENT>/<date> (and
+    jwst/srefpipe/ETC/deliveries/<instrument>/<date> for ETC files). Each one is indexed into a local SQLite database
+    with its instrument, date, deliverer, reason for delivery and, per file, the certify outcome, the context it was
+    certified against, the name it had before crds uniqname renamed it and its sha256 from archive_manifest.json.
+    Updates are incremental: a delivery is only read again when the mtime of its directory or one of its files
+    changed.
+    ::
+        python delivery_catalog.py update
+        python delivery_catalog.py file iaf1234_bia.fits
+        python delivery_catalog.py deliveries -i WFC3 --since 2020_01_01
+        python delivery_catalog.py hash 3f2a
+"""
+
+import argparse
+import json
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import time
+
+from archive_manifest import MANIFEST_FILE
+from certify_report import REPORT_FILE, CertifyParser, read_report
+from delivery_form import load_form
+from log_bundle import BUNDLE_FILE, extract_all
+from move_files import REDCAT_ARCHIVE, parse_directory_name
+
+DEFAULT_DATABASE = os.path.join(os.path.expanduser('~'), '.redcat', 'delivery_catalog.sqlite')
+
+# Parents of the <INSTRUMENT>/<date> directories, relative to the archive root
+AREAS = ['hst/srefpipe', 'hst/cdbstest', 'jwst/srefpipe', 'jwst/cdbstest', 'jwst/srefpipe/ETC/deliveries']
+
+# crds uniqname ("Renamed 'a.fits' --> 'b.fits'") and jwst_etc_check ("a.fits ----> b.fits") rename logs
+RENAME_LINE = re.compile(r"'?(?P<old>[^'\s]+?)'?\s+-+>\s+'?(?P<new>[^'\s]+?)'?\s*$")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS deliveries (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    observatory TEXT,
+    area TEXT,
+    instrument TEXT,
+    date TEXT,
+    deliverer TEXT,
+    reason TEXT,
+    signature INTEGER,
+    indexed REAL
+);
+CREATE TABLE IF NOT EXISTS files (
+    delivery_id INTEGER NOT NULL REFERENCES deliveries(id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    original_name TEXT,
+    destination TEXT,
+    size INTEGER,
+    sha256 TEXT,
+    certify TEXT,
+    context TEXT
+);
+CREATE INDEX IF NOT EXISTS files_name ON files(name);
+CREATE INDEX IF NOT EXISTS files_original_name ON files(original_name);
+CREATE INDEX IF NOT EXISTS files_sha256 ON files(sha256);
+CREATE INDEX IF NOT EXISTS deliveries_instrument_date ON deliveries(instrument, date);
+"""
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def find_deliveries(root=REDCAT_ARCHIVE):
+    """ Yield (observatory, area, instrument, date, path) for every archived delivery directory under root
+    """
+    for area in AREAS:
+        parent = os.path.join(root, area)
+        if not os.path.isdir(parent):
+            continue
+        for instrument_entry in os.scandir(parent):
+            if not instrument_entry.is_dir() or instrument_entry.name == 'ETC':
+                continue
+            for date_entry in os.scandir(instrument_entry.path):
+                if not date_entry.is_dir():
+                    continue
+                try:
+                    instrument, date = parse_directory_name('{}_{}'.format(instrument_entry.name, date_entry.name))
+                except NameError:
+                    continue
+                yield area.split('/')[0], area, instrument, date, date_entry.path
+
+
+def signature(path):
+    """ Latest mtime (ns) of a delivery directory and the files in it
+    """
+    latest = os.stat(path).st_mtime_ns
+    for entry in os.scandir(path):
+        latest = max(latest, entry.stat().st_mtime_ns)
+    return latest
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def read_renames(path):
+    """ original name -> new name from a rename log
+    """
+    renames = {}
+    with open(path, errors='replace') as f:
+        for line in f:
+            match = RENAME_LINE.search(line)
+            if match:
+                renames[os.path.basename(match.group('old'))] = os.path.basename(match.group('new'))
+    return renames
+
+
+def read_certify(path):
+    """ Certify records of a delivery, from its JSON Lines report or, for older deliveries, its certify log
+    """
+    report = os.path.join(path, REPORT_FILE)
+    if os.path.exists(report):
+        return read_report(report)
+    log = os.path.join(path, 'certify_results.txt')
+    if os.path.exists(log):
+        parser = CertifyParser()
+        with open(log, errors='replace') as f:
+            for line in f:
+                parser.feed(line.rstrip('\n'))
+        return parser.close()
+    return []
+
+
+def read_form(path):
+    """ (deliverer, reason for delivery) from the delivery form in path, or (None, None)
+    """
+    for name in sorted(os.listdir(path)):
+        if 'form' not in name or not name.endswith('.txt'):
+            continue
+        try:
+            form = load_form(os.path.join(path, name))
+        except OSError:
+            continue
+        if '1' in form:
+            return form.deliverer, form.reason
+    return None, None
+
+
+def read_delivery(path):
+    """ Everything the catalog keeps about one archived delivery: (deliverer, reason, list of file rows).
+        Result files packed into a bundle are unpacked into a temporary directory first
+    """
+    if os.path.exists(os.path.join(path, BUNDLE_FILE)):
+        with tempfile.TemporaryDirectory() as unpacked:
+            extract_all(os.path.join(path, BUNDLE_FILE), unpacked)
+            for name in os.listdir(path):
+                if name != BUNDLE_FILE:
+                    shutil.copy(os.path.join(path, name), unpacked)
+            deliverer, reason, files = read_delivery_files(unpacked, path)
+        return deliverer, reason, files
+    return read_delivery_files(path, path)
+
+
+def read_delivery_files(path, archived_path):
+    renames = {}
+    for name in os.listdir(path):
+        if name.startswith('rename') and name.endswith('.log'):
+            renames.update(read_renames(os.path.join(path, name)))
+    deliverer, reason = read_form(path)
+
+    files = {}
+    for record in read_certify(path):
+        name = renames.get(record['file'], record['file'])
+        files[name] = {'name': name, 'original_name': record['file'] if name != record['file'] else None,
+                       'destination': None, 'size': None, 'sha256': None,
+                       'certify': record['severity'], 'context': record.get('context')}
+
+    manifest = os.path.join(path, MANIFEST_FILE)
+    if os.path.exists(manifest):
+        with open(manifest) as f:
+            entries = json.load(f).get('files', {})
+        for destination, entry in entries.items():
+            name = os.path.basename(destination)
+            if destination.startswith(os.path.abspath(archived_path) + os.sep) and not name.endswith('.fits'):
+                continue  # The delivery's own logs
+            row = files.setdefault(name, {'name': name, 'original_name': None, 'certify': None, 'context': None})
+            row.update({'destination': destination, 'size': entry['size'], 'sha256': entry['sha256']})
+
+    for old, new in renames.items():
+        row = files.setdefault(new, {'name': new, 'destination': None, 'size': None, 'sha256': None,
+                                     'certify': None, 'context': None})
+        row['original_name'] = old
+    return deliverer, reason, [row for _, row in sorted(files.items())]
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class Catalog(object):
+    """ The SQLite database of archived deliveries
+    """
+
+    def __init__(self, database=DEFAULT_DATABASE):
+        directory = os.path.dirname(database)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.db = sqlite3.connect(database)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute('PRAGMA foreign_keys = ON')
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def update(self, root=REDCAT_ARCHIVE, verbose=False):
+        """ Index new and changed deliveries under root and drop those that disappeared.
+            Returns (added or updated, unchanged, removed)
+        """
+        known = {row['path']: row['signature'] for row in self.db.execute('SELECT path, signature FROM deliveries')}
+        seen = set()
+        changed = unchanged = 0
+        for observatory, area, instrument, date, path in find_deliveries(root):
+            seen.add(path)
+            current = signature(path)
+            if known.get(path) == current:
+                unchanged += 1
+                continue
+            deliverer, reason, files = read_delivery(path)
+            with self.db:
+                self.db.execute('DELETE FROM deliveries WHERE path = ?', (path,))
+                cursor = self.db.execute(
+                    'INSERT INTO deliveries (path, observatory, area, instrument, date, deliverer, reason, '
+                    'signature, indexed) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (path, observatory, area, instrument, date, deliverer, reason, current, time.time()))
+                self.db.executemany(
+                    'INSERT INTO files (delivery_id, name, original_name, destination, size, sha256, certify, '
+                    'context) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    [(cursor.lastrowid, f['name'], f['original_name'], f['destination'], f['size'], f['sha256'],
+                      f['certify'], f['context']) for f in files])
+            changed += 1
+            if verbose:
+                print('Indexed {} ({} files)'.format(path, len(files)))
+
+        removed = [path for path in known if path not in seen and path.startswith(os.path.abspath(root))]
+        with self.db:
+            self.db.executemany('DELETE FROM deliveries WHERE path = ?', [(path,) for path in removed])
+        return changed, unchanged, len(removed)
+
+    # Queries ----------------------------------------------------------------------------------------------------------
+
+    FILE_QUERY = ('SELECT f.name, f.original_name, f.certify, f.context, f.sha256, f.destination, d.instrument, '
+                  'd.date, d.deliverer, d.area, d.path FROM files f JOIN deliveries d ON d.id = f.delivery_id ')
+
+    def find_file(self, name):
+        """ Deliveries of a file, by its current or original name (glob wildcards allowed)
+        """
+        return self.db.execute(self.FILE_QUERY + 'WHERE f.name GLOB ? OR f.original_name GLOB ? '
+                               'ORDER BY d.date', (name, name)).fetchall()
+
+    def find_hash(self, prefix):
+        return self.db.execute(self.FILE_QUERY + 'WHERE f.sha256 LIKE ? ORDER BY d.date',
+                               (prefix.lower() + '%',)).fetchall()
+
+    def deliveries(self, instrument=None, since=None, until=None, deliverer=None):
+        clauses, values = [], []
+        if instrument:
+            clauses.append('d.instrument = ?')
+            values.append(instrument.upper())
+        if since:
+            clauses.append('d.date >= ?')
+            values.append(since)
+        if until:
+            clauses.append('d.date <= ?')
+            values.append(until)
+        if deliverer:
+            clauses.append('d.deliverer LIKE ?')
+            values.append('%{}%'.format(deliverer))
+        where = 'WHERE {} '.format(' AND '.join(clauses)) if clauses else ''
+        return self.db.execute(
+            'SELECT d.instrument, d.date, d.deliverer, d.area, d.path, COUNT(f.name) AS n_files, '
+            "SUM(f.certify = 'ERROR') AS n_errors FROM deliveries d LEFT JOIN files f ON f.delivery_id = d.id "
+            + where + 'GROUP BY d.id ORDER BY d.date, d.instrument', values).fetchall()
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def print_files(rows):
+    for row in rows:
+        renamed = ' (was {})'.format(row['original_name']) if row['original_name'] else ''
+        print('{}{}  {} {} {}  deliverer: {}  certify: {}  context: {}'.format(
+            row['name'], renamed, row['instrument'], row['date'], row['area'], row['deliverer'], row['certify'],
+            row['context']))
+        print('    {}{}'.format(row['path'], '  sha256: {}'.format(row['sha256']) if row['sha256'] else ''))
+
+
+def print_deliveries(rows):
+    for row in rows:
+        print('{:<8} {:<14} {:<24} {:>4} files {:>3} errors  {}'.format(
+            row['instrument'], row['date'], row['deliverer'] or '', row['n_files'], row['n_errors'] or 0, row['path']))
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Catalog of archived ReDCaT deliveries')
+    parser.add_argument('--db', type=str, help='Catalog database.  Default is {}'.format(DEFAULT_DATABASE),
+                        action='store', default=DEFAULT_DATABASE)
+    commands = parser.add_subparsers(dest='command')
+
+    update = commands.add_parser('update', help='Index new and changed deliveries')
+    update.add_argument('--root', type=str, help='Archive root.  Default is {}'.format(REDCAT_ARCHIVE),
+                        action='store', default=REDCAT_ARCHIVE)
+    update.add_argument('-v', help='List each delivery indexed', action='store_true')
+
+    find = commands.add_parser('file', help='Deliveries of a reference file (current or original name, wildcards)')
+    find.add_argument('name', type=str)
+
+    find_hash = commands.add_parser('hash', help='Files whose sha256 starts with a prefix')
+    find_hash.add_argument('prefix', type=str)
+
+    listing = commands.add_parser('deliveries', help='List deliveries')
+    listing.add_argument('-i', type=str, help='Instrument', action='store', default=None)
+    listing.add_argument('--since', type=str, help='First date, YYYY_MM_DD', action='store', default=None)
+    listing.add_argument('--until', type=str, help='Last date, YYYY_MM_DD', action='store', default=None)
+    listing.add_argument('--deliverer', type=str, help='Part of the deliverer name', action='store', default=None)
+
+    options = parser.parse_args()
+    catalog = Catalog(options.db)
+    start = time.time()
+    if options.command == 'update':
+        changed, unchanged, removed = catalog.update(options.root, options.v)
+        print('{} deliveries indexed, {} unchanged, {} removed'.format(changed, unchanged, removed))
+    elif options.command == 'file':
+        print_files(catalog.find_file(options.name))
+    elif options.command == 'hash':
+        print_files(catalog.find_hash(options.prefix))
+    elif options.command == 'deliveries':
+        print_deliveries(catalog.deliveries(options.i, options.since, options.until, options.deliverer))
+    else:
+        parser.print_help()
+    print('({:.3f} s)'.format(time.time() - start))
+    catalog.close()
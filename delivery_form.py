@@ -0,0 +1,224 @@
+"""Structured access to delivery_form.txt
+Use
+---
+    The delivery form is parsed once into its 17 numbered fields (and their lettered sub-fields, e.g. 1a), and the
+    parse is cached for as long as the file's size and mtime are unchanged, so every tool that asks about the same
+    form shares one read:
+    ::
+        form = load_form('delivery_form.txt')
+        form.deliverer, form.reason, form['instrument'], form['10a']
+
+    A form keeps the text of every field as written, so it is written back unchanged except for what was edited:
+    ::
+        form = load_form('delivery_form.txt').copy()
+        form.insert_lines('16', ['/grp/redcat/staging/ops/WFC3_2020_01_01_0', 'abc1234_drk.fits'])
+        form.write('/grp/redcat/staging/ops/WFC3_2020_01_01_0/delivery_form.txt')
+
+    Questions are told apart from answers using the blank form that ships with these tools, so answers written on the
+    same line as a question without a colon (sub-fields like "a. (other e-mail addresses) jdoe@stsci.edu") are found
+    too.
+"""
+
+import os
+import re
+from collections import OrderedDict
+
+FORM_FILE = 'delivery_form.txt'
+BLANK_FORM = os.path.join(os.path.dirname(os.path.abspath(__file__)), FORM_FILE)
+FIELD_COUNT = 17
+
+# Characters that make crds submit fail when they are in the description of a delivery
+ILLEGAL_CHARS = [':', '!', '@', '#', '$', '%', '^', '&', '*', '(', ')', '?', '/', '\\', '|', '=', '+', '-', '_',
+                 '`', '~', '[', ']', '{', '}', '"', "'"]
+
+FIELD_NAMES = OrderedDict([('1', 'deliverer'), ('2', 'date'), ('3', 'instrument'), ('4', 'file_type'),
+                           ('5', 'history_updated'), ('6', 'keywords_checked'), ('7', 'compliance_verified'),
+                           ('8', 'ingest'), ('9', 'pipeline_version'), ('10', 'replaces'), ('11', 'jira'),
+                           ('12', 'level_of_change'), ('13', 'modes_affected'), ('14', 'testing'),
+                           ('15', 'considerations'), ('16', 'locations'), ('17', 'reason')])
+FIELD_NUMBERS = {name: number for number, name in FIELD_NAMES.items()}
+
+FIELD = re.compile(r'\s*(\d{1,2})\.\s')
+SUBFIELD = re.compile(r'\s*([a-z])\.\s')
+
+# path -> ((size, mtime_ns), DeliveryForm)
+_forms = {}
+_questions = None
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def illegal_characters(text):
+    """ The characters of text that crds submit does not accept, in ILLEGAL_CHARS order
+    """
+    return [char for char in ILLEGAL_CHARS if char in text]
+
+
+def clean(text):
+    """ text with each illegal character replaced by a space
+    """
+    for char in ILLEGAL_CHARS:
+        text = text.replace(char, ' ')
+    return text
+
+
+def split_question(line, question=None):
+    """ (question, answer) of the first line of a field. Without the question from the blank form, the question ends
+        at the first colon outside parentheses, or is the whole line
+    """
+    text = line.rstrip('\r\n')
+    if question and text.lstrip().startswith(question):
+        end = text.index(question) + len(question)
+        return text[:end].strip(), text[end:]
+    depth = 0
+    for i, char in enumerate(text):
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth = max(0, depth - 1)
+        elif char == ':' and depth == 0:
+            return text[:i + 1].strip(), text[i + 1:]
+    return text.strip(), ''
+
+
+def parse_fields(text, questions=None):
+    """ (lines before field 1, field -> its lines). Fields are numbered in order from 1 to 17 with lettered
+        sub-fields (those of the blank form, if questions is given); anything else, including numbered lists in
+        an answer, is part of the field above it
+    """
+    preamble = []
+    fields = OrderedDict()
+    number = 0
+    letter = None
+    key = None
+    for line in text.splitlines(True):
+        field = FIELD.match(line)
+        subfield = SUBFIELD.match(line)
+        if field and int(field.group(1)) == number + 1 and number < FIELD_COUNT:
+            number += 1
+            letter = None
+            key = str(number)
+            fields[key] = [line]
+            continue
+        if subfield and number:
+            expected = 'a' if letter is None else chr(ord(letter) + 1)
+            if subfield.group(1) == expected and (questions is None or str(number) + expected in questions):
+                letter = expected
+                key = str(number) + letter
+                fields[key] = [line]
+                continue
+        if key is None:
+            preamble.append(line)
+        else:
+            fields[key].append(line)
+    return preamble, fields
+
+
+def blank_questions():
+    """ field -> question, from the blank form shipped with the tools (empty if it is missing)
+    """
+    global _questions
+    if _questions is None:
+        try:
+            with open(BLANK_FORM, encoding='utf-8', errors='surrogateescape') as f:
+                _, fields = parse_fields(f.read())
+        except OSError:
+            fields = {}
+        _questions = OrderedDict((key, split_question(lines[0])[0]) for key, lines in fields.items())
+    return _questions
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class DeliveryForm(object):
+    """ The fields of a delivery form. Answers are looked up by field ('1', '10a') or name ('deliverer', 'reason')
+    """
+
+    def __init__(self, text, path=None):
+        self.path = path
+        self.questions = blank_questions()
+        self.preamble, self.fields = parse_fields(text, self.questions or None)
+
+    @classmethod
+    def read(cls, path):
+        with open(path, encoding='utf-8', errors='surrogateescape') as f:
+            return cls(f.read(), path)
+
+    def copy(self):
+        return DeliveryForm(self.text(), self.path)
+
+    def text(self):
+        return ''.join(self.preamble + [line for lines in self.fields.values() for line in lines])
+
+    def question(self, field):
+        field = FIELD_NUMBERS.get(field, field)
+        return split_question(self.fields[field][0], self.questions.get(field))[0]
+
+    def __contains__(self, field):
+        return FIELD_NUMBERS.get(field, field) in self.fields
+
+    def __getitem__(self, field):
+        """ The answer to a field, on the question's line and the lines below it, or '' if the form lacks the field
+        """
+        field = FIELD_NUMBERS.get(field, field)
+        if field not in self.fields:
+            return ''
+        lines = self.fields[field]
+        answer = [split_question(lines[0], self.questions.get(field))[1]] + lines[1:]
+        return '\n'.join(line.strip() for line in answer).strip()
+
+    def answers(self):
+        """ name -> answer of the 17 numbered fields
+        """
+        return OrderedDict((name, self[number]) for number, name in FIELD_NAMES.items())
+
+    @property
+    def deliverer(self):
+        """ Name of the deliverer, without characters crds does not accept (falling back to the e-mail addresses)
+        """
+        return ' '.join(clean(self['1'] or self['1a']).split())
+
+    @property
+    def reason(self):
+        """ Reason for delivery on one line, as given to crds submit
+        """
+        return ' '.join(line for line in self['17'].splitlines() if line)
+
+    @property
+    def locations(self):
+        """ Lines of field 16: the staging directory followed by the names of the files delivered
+        """
+        return [line for line in self['16'].splitlines() if line]
+
+    def insert_lines(self, field, lines):
+        """ Add lines to the answer of a field, directly below its question
+        """
+        field = FIELD_NUMBERS.get(field, field)
+        first = self.fields[field][0]
+        if not first.endswith('\n'):
+            self.fields[field][0] = first + '\n'
+        self.fields[field][1:1] = ['{}\n'.format(line) for line in lines]
+
+    def write(self, path=None):
+        """ Write the form (back to where it was read from by default), replacing the file atomically
+        """
+        path = path or self.path
+        temp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temp_path, 'w', encoding='utf-8', errors='surrogateescape') as f:
+            f.write(self.text())
+        os.replace(temp_path, path)
+        return path
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def load_form(path):
+    """ The parsed form at path, shared with every other caller until the file changes. Use copy() before editing
+    """
+    stat = os.stat(path)
+    key = (stat.st_size, stat.st_mtime_ns)
+    cached = _forms.get(path)
+    if cached is None or cached[0] != key:
+        cached = (key, DeliveryForm.read(path))
+        _forms[path] = cached
+    return cached[1]
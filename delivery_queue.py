@@ -0,0 +1,232 @@
+"""Deliver everything waiting in the staging area
+Use
+---
+    Instead of running deliver_files.py by hand in each /grp/redcat/staging/{ops,test}/INSTR_YYYY_MM_DD_N directory,
+    the scheduler finds the deliveries that are ready and not yet submitted (no delivery_results.log) and runs crds
+    submit for them, several at a time. A delivery is ready once check_references.py passed every file in it (it
+    writes check_passed.txt) and, for HST, rename_files.py has renamed them (rename.log). Deliveries to the same CRDS
+    server (hst or jwst, test or ops) run one after another, since crds submit --wipe clears the upload area the
+    server keeps for the user; deliveries to different servers run side by side. Each command gets the CRDS_PATH and CRDS_SERVER_URL of its delivery area, so
+    os.environ is never changed. The CRDS password is asked for once, only if ~/.crds.ini does not exist yet:
+    ::
+        python delivery_queue.py --dry-run
+        python delivery_queue.py -j 3 [--areas ops] [--login]
+
+    The queue is ordered by priority, highest first, then by age (when the delivery form was staged), oldest first.
+    Whenever a slot frees up, the first delivery in the queue whose CRDS server is not busy is submitted next.
+    Priority is 0 unless the delivery directory holds a PRIORITY file containing a number:
+    ::
+        echo 10 > /grp/redcat/staging/ops/WFC3_2020_01_01_0/PRIORITY
+
+    While a delivery is being submitted it holds a .delivering lock, so two schedulers never submit it twice. Locked
+    deliveries are listed when the queue is read; a lock left behind by a scheduler that died has to be removed by
+    hand. A delivery is retried by removing its delivery_results.log. A delivery whose submission could not be
+    started (e.g. its form cannot be read) is reported as failed without stopping the others.
+"""
+
+import argparse
+import getpass
+import os
+import re
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from certify_report import CHECKED_FILE
+from deliver_files import LOG_FILE, crds_environment, delivery_command, instruments, observatory, write_credentials
+from delivery_form import FORM_FILE
+from subprocess_runner import CommandResult, report, run_command
+
+STAGING_ROOT = '/grp/redcat/staging'
+QUEUE_AREAS = ['ops', 'test']
+PRIORITY_FILE = 'PRIORITY'
+LOCK_FILE = '.delivering'
+RENAME_LOG = 'rename.log'
+STALE_LOCK = 6 * 3600   # A lock older than this (seconds) is reported as probably left behind
+MAX_CONCURRENT = 2
+
+DELIVERY_NAME = re.compile(r'^([A-Za-z0-9]+)_\d{4}_\d{2}_\d{2}_\d+$')
+
+Queued = namedtuple('Queued', ['path', 'area', 'instrument', 'priority', 'staged'])
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def read_priority(path):
+    try:
+        with open(os.path.join(path, PRIORITY_FILE)) as f:
+            return int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        return 0
+
+
+def report_lock(path, lock):
+    try:
+        age = time.time() - os.path.getmtime(lock)
+    except OSError:
+        return  # Released in the meantime
+    if age > STALE_LOCK:
+        print('Skipping {}: locked for {:.1f} h, probably by a scheduler that died.  Remove {} to submit it'.format(
+            os.path.basename(path), age / 3600, lock))
+    else:
+        print('Skipping {}: being submitted by another scheduler (locked {:.0f} min ago)'.format(
+            os.path.basename(path), age / 60))
+
+
+def not_ready(path, instrument):
+    """ Why the delivery cannot be submitted yet, or None once it has been checked (and renamed, for HST)
+    """
+    if not os.path.isfile(os.path.join(path, CHECKED_FILE)):
+        return 'not checked, or check_references.py found problems'
+    if observatory(instrument) == 'hst' and not os.path.isfile(os.path.join(path, RENAME_LOG)):
+        return 'checked but not renamed yet'
+    return None
+
+
+def find_queue(root=STAGING_ROOT, areas=QUEUE_AREAS):
+    """ Deliveries ready and waiting to be submitted, in the order they should go: priority, then age
+    """
+    queue = []
+    for area in areas:
+        area_directory = os.path.join(root, area)
+        if not os.path.isdir(area_directory):
+            continue
+        for entry in os.scandir(area_directory):
+            match = DELIVERY_NAME.match(entry.name)
+            if not entry.is_dir() or not match:
+                continue
+            instrument = match.group(1).upper()
+            if instrument not in instruments['hst'] and instrument not in instruments['jwst']:
+                continue
+            form = os.path.join(entry.path, FORM_FILE)
+            if not os.path.isfile(form) or os.path.exists(os.path.join(entry.path, LOG_FILE)):
+                continue  # Still being staged, or already submitted
+            lock = os.path.join(entry.path, LOCK_FILE)
+            if os.path.exists(lock):
+                report_lock(entry.path, lock)
+                continue
+            reason = not_ready(entry.path, instrument)
+            if reason is not None:
+                print('Skipping {}: {}'.format(entry.name, reason))
+                continue
+            queue.append(Queued(entry.path, area, instrument, read_priority(entry.path), os.path.getmtime(form)))
+    return sorted(queue, key=lambda q: (-q.priority, q.staged, q.path))
+
+
+def server(delivery):
+    """ The CRDS server a delivery goes to. Deliveries to the same server have to go one after another
+    """
+    return delivery.area, observatory(delivery.instrument)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def claim(path):
+    """ Take the lock of a delivery. False if another scheduler has it
+    """
+    try:
+        os.close(os.open(os.path.join(path, LOCK_FILE), os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except FileExistsError:
+        return False
+    return True
+
+
+def release(path):
+    try:
+        os.remove(os.path.join(path, LOCK_FILE))
+    except FileNotFoundError:
+        pass
+
+
+def submit(delivery):
+    """ Run crds submit for one delivery with its own CRDS environment. Returns a CommandResult, or None if it was
+        taken or submitted by someone else in the meantime
+    """
+    if not claim(delivery.path):
+        return None
+    try:
+        if os.path.exists(os.path.join(delivery.path, LOG_FILE)):
+            return None
+        env = dict(os.environ)
+        env.update(crds_environment(delivery.area, delivery.instrument))
+        args = delivery_command(delivery.path, delivery.instrument)
+        return run_command(args, log_file=os.path.join(delivery.path, LOG_FILE),
+                           label='[{}]'.format(os.path.basename(delivery.path)), env=env)
+    finally:
+        release(delivery.path)
+
+
+def outcome(future, delivery):
+    """ The CommandResult of a finished submission; one that raised is a failed result rather than an exception
+    """
+    try:
+        return future.result()
+    except Exception as e:
+        label = '[{}]'.format(os.path.basename(delivery.path))
+        print('{} could not be submitted: {}'.format(label, e))
+        return CommandResult([], -1, 0.0, None, label)
+
+
+def run_queue(queue, max_concurrent=MAX_CONCURRENT):
+    """ Submit the queue, at most max_concurrent deliveries at a time and one at a time per CRDS server. Each free
+        slot takes the first delivery in queue order whose server is free. Returns the CommandResults in queue order
+    """
+    start = time.time()
+    max_concurrent = max(1, max_concurrent)
+    waiting = list(queue)
+    running = {}  # future -> delivery
+    finished = {}
+    with ThreadPoolExecutor(max_workers=max_concurrent) as pool:
+        while waiting or running:
+            busy = set(server(delivery) for delivery in running.values())
+            for delivery in list(waiting):
+                if len(running) >= max_concurrent:
+                    break
+                if server(delivery) not in busy:
+                    busy.add(server(delivery))
+                    waiting.remove(delivery)
+                    running[pool.submit(submit, delivery)] = delivery
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                delivery = running.pop(future)
+                finished[delivery.path] = outcome(future, delivery)
+    results = [finished[delivery.path] for delivery in queue if finished[delivery.path] is not None]
+    report(results)
+    failures = [r for r in results if r.returncode != 0]
+    print('{} deliveries submitted, {} failed, in {:.1f} s'.format(len(results) - len(failures), len(failures),
+                                                                    time.time() - start))
+    return results
+
+
+def print_queue(queue):
+    for i, delivery in enumerate(queue):
+        print('{:>3}. {:<45} {:<5} priority {:<3} staged {}'.format(
+            i + 1, os.path.basename(delivery.path), delivery.area, delivery.priority,
+            time.strftime('%Y-%m-%d %H:%M', time.localtime(delivery.staged))))
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Submit every delivery waiting in the staging area to CRDS')
+    parser.add_argument('--root', type=str, help='Staging area.  Default is {}'.format(STAGING_ROOT),
+                        action='store', default=STAGING_ROOT)
+    parser.add_argument('--areas', type=str, nargs='+', help='Staging areas to deliver from.  Default is ops test',
+                        default=QUEUE_AREAS)
+    parser.add_argument('-j', '--jobs', type=int, help='Deliveries submitted at once.  Default is {}'.format(
+        MAX_CONCURRENT), action='store', default=MAX_CONCURRENT)
+    parser.add_argument('--dry-run', help='Only show the queue', action='store_true')
+    parser.add_argument('--login', help='Ask for the CRDS password even if ~/.crds.ini exists', action='store_true')
+    options = parser.parse_args()
+
+    pending = find_queue(options.root, options.areas)
+    print_queue(pending)
+    if options.dry_run or not pending:
+        print('{} deliveries waiting'.format(len(pending)))
+        raise SystemExit(0)
+
+    if options.login or not os.path.exists(os.path.join(os.environ['HOME'], '.crds.ini')):
+        write_credentials(getpass.getuser(), getpass.getpass(prompt='CRDS Webpage Password:'))
+
+    submitted = run_queue(pending, options.jobs)
+    raise SystemExit(1 if any(r.returncode != 0 for r in submitted) else 0)
@@ -0,0 +1,74 @@
+"""Parse-once cache of the JSON documents of a delivery
+Use
+---
+    Each file is parsed the first time a stage asks for it and the parsed form is handed to every later stage. An
+    entry is checked against the file's size and mtime on every access, so a file changed behind the cache's back is
+    parsed again. Stages that rename or rewrite files tell the cache, which moves or drops the entry:
+    ::
+        documents = DocumentCache()
+        config = documents.json('jwst_nircam_configuration.json')
+        documents.rename('jwst_nircam_configuration.json', 'jwst_nircam_configuration_20200101120000.json')
+        documents.put('jwst_nircam_configuration_20200101120000.json', updated_config)
+
+    Callers that modify a parsed document must work on a copy.
+"""
+
+import json
+import os
+from collections import OrderedDict
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def signature(filename):
+    st = os.stat(filename)
+    return st.st_size, st.st_mtime_ns
+
+
+class DocumentCache(object):
+    """ absolute path -> (signature, parsed JSON document)
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _get(self, filename, parse):
+        path = os.path.abspath(filename)
+        current = signature(path)
+        entry = self.entries.get(path)
+        if entry is not None and entry[0] == current:
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        document = parse(path)
+        self.entries[path] = (current, document)
+        return document
+
+    def json(self, filename):
+        """ Parsed JSON document (OrderedDict), raising ValueError for invalid JSON as json.load does
+        """
+        def parse(path):
+            with open(path) as f:
+                return json.load(f, object_pairs_hook=OrderedDict)
+        return self._get(filename, parse)
+
+    def put(self, filename, document):
+        """ Record the document just written to filename, so it is not parsed again
+        """
+        path = os.path.abspath(filename)
+        self.entries[path] = (signature(path), document)
+
+    def rename(self, old, new):
+        """ Move the entry of a file that was renamed
+        """
+        entry = self.entries.pop(os.path.abspath(old), None)
+        if entry is not None:
+            self.entries[os.path.abspath(new)] = entry
+
+    def invalidate(self, filename):
+        self.entries.pop(os.path.abspath(filename), None)
+
+    def clear(self):
+        self.entries.clear()
@@ -0,0 +1,218 @@
+"""Journaled execution of a planned set of file operations
+Use
+---
+    A plan is a list of Operation computed in memory (see jwst_etc_check.plan_delivery). Nothing touches the
+    filesystem until it is executed; execution applies the operations in order and records each one in a journal
+    as it completes, so a failed run can be resumed or rolled back:
+    ::
+        operations = plan_delivery(files, 'nircam', destination, datetime.datetime.now())
+        print(render_plan(operations))
+        execute(operations)     # or, after a failure,
+        resume()                # or rollback()
+
+    Operations:
+        rename      source -> target
+        write_json  data written to target; previous holds the document it replaces
+        copy        source copied to target, which must not exist yet; previous is the file it replaces, if any.
+                    Copies go through file_sync.sync_file: a source identical to previous is cloned from previous on
+                    the destination filesystem, and the bytes sent and saved are reported once the run is done
+        retire      source (an old file being replaced) renamed out of the way; retired files are only deleted once
+                    every operation has succeeded, so a rollback can put them back
+"""
+
+import json
+import os
+from collections import OrderedDict, namedtuple
+
+from file_sync import HashIndex, report, sync_file
+
+JOURNAL_FILE = 'etc_journal.jsonl'
+RETIRED_SUFFIX = '.retired'
+
+Operation = namedtuple('Operation', ['kind', 'source', 'target', 'data', 'previous'])
+
+KINDS = ('rename', 'write_json', 'copy', 'retire')
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def json_text(data):
+    """ The text write_json writes for data
+    """
+    return json.dumps(data, indent=4)
+
+
+def operation(kind, source=None, target=None, data=None, previous=None):
+    assert kind in KINDS, 'Unknown operation {}'.format(kind)
+    return Operation(kind, source, target, data, previous)
+
+
+def render_plan(operations):
+    lines = []
+    for i, op in enumerate(operations):
+        if op.kind == 'write_json':
+            lines.append('{:>4} {:<10} {}'.format(i, op.kind, op.target))
+        elif op.kind == 'retire':
+            lines.append('{:>4} {:<10} {}'.format(i, op.kind, op.source))
+        else:
+            lines.append('{:>4} {:<10} {} -> {}'.format(i, op.kind, op.source, op.target))
+    return '\n'.join(lines)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def apply_operation(op, documents=None, hashes=None):
+    """ Apply one operation. Returns the file_sync.SyncResult of a copy, None for the other kinds
+    """
+    if op.kind == 'rename':
+        os.rename(op.source, op.target)
+        if documents is not None:
+            documents.rename(op.source, op.target)
+    elif op.kind == 'write_json':
+        with open(op.target, 'w') as f:
+            f.write(json_text(op.data))
+        if documents is not None:
+            documents.put(op.target, op.data)
+    elif op.kind == 'copy':
+        if os.path.exists(op.target):
+            raise OSError('{} already exists'.format(op.target))
+        partial = op.target + '.part'  # Left behind by an interrupted copy, never mistaken for the real file
+        result = sync_file(op.source, partial, op.previous, hashes)
+        os.rename(partial, op.target)
+        return result._replace(target=op.target)
+    elif op.kind == 'retire':
+        os.rename(op.source, op.source + RETIRED_SUFFIX)
+
+
+def undo_operation(op, documents=None):
+    if op.kind == 'rename':
+        if os.path.exists(op.target):
+            os.rename(op.target, op.source)
+        if documents is not None:
+            documents.rename(op.target, op.source)
+    elif op.kind == 'write_json':
+        with open(op.target, 'w') as f:
+            json.dump(op.previous, f, indent=4)
+        if documents is not None:
+            documents.invalidate(op.target)
+    elif op.kind == 'copy':
+        if os.path.exists(op.target):
+            os.remove(op.target)
+    elif op.kind == 'retire':
+        if os.path.exists(op.source + RETIRED_SUFFIX):
+            os.rename(op.source + RETIRED_SUFFIX, op.source)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class Journal(object):
+    """ JSON Lines record of a plan and the operations completed so far. The first line holds the plan
+    """
+
+    def __init__(self, filename=JOURNAL_FILE):
+        self.filename = filename
+        self.operations = []
+        self.done = set()
+        self.committed = False
+
+    def exists(self):
+        return os.path.exists(self.filename)
+
+    def start(self, operations):
+        if self.exists():
+            raise RuntimeError('{} exists: resume or roll back the previous run first'.format(self.filename))
+        self.operations = list(operations)
+        self.done = set()
+        with open(self.filename, 'w') as f:
+            f.write(json.dumps({'plan': [op._asdict() for op in self.operations]}) + '\n')
+
+    def load(self):
+        with open(self.filename) as f:
+            lines = [json.loads(line, object_pairs_hook=OrderedDict) for line in f if line.strip()]
+        self.operations = [Operation(**op) for op in lines[0]['plan']]
+        self.done = set()
+        for record in lines[1:]:
+            if 'done' in record:
+                self.done.add(record['done'])
+            elif 'undone' in record:
+                self.done.discard(record['undone'])
+            elif 'committed' in record:
+                self.committed = True
+        return self
+
+    def mark(self, key, i):
+        with open(self.filename, 'a') as f:
+            f.write(json.dumps({key: i}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        if key == 'done':
+            self.done.add(i)
+        elif key == 'undone':
+            self.done.discard(i)
+
+    def finish(self):
+        os.remove(self.filename)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def _run(journal, documents=None, hashes=None):
+    hashes = hashes or HashIndex()
+    synced = []
+    try:
+        for i, op in enumerate(journal.operations):
+            if i in journal.done:
+                continue
+            try:
+                result = apply_operation(op, documents, hashes)
+            except Exception:
+                print('FAILED at operation {} ({}); rerun with --resume or --rollback'.format(i, op.kind))
+                raise
+            journal.mark('done', i)
+            if result is not None:
+                synced.append(result)
+    finally:
+        hashes.save()
+    if synced:
+        report(synced)
+
+    # Every operation succeeded: the retired files can go, after which there is no rolling back
+    journal.mark('committed', True)
+    for op in journal.operations:
+        if op.kind == 'retire' and os.path.exists(op.source + RETIRED_SUFFIX):
+            os.remove(op.source + RETIRED_SUFFIX)
+    journal.finish()
+
+
+def execute(operations, journal_file=JOURNAL_FILE, documents=None, hashes=None):
+    """ Apply operations in order, journaling each one. hashes is the file_sync.HashIndex used to compare copies
+        with the files they replace (default ~/.redcat/sync_hashes.json)
+    """
+    journal = Journal(journal_file)
+    journal.start(operations)
+    _run(journal, documents, hashes)
+
+
+def resume(journal_file=JOURNAL_FILE, documents=None, hashes=None):
+    """ Apply the operations of an interrupted run that had not completed. Returns the operations of the run
+    """
+    journal = Journal(journal_file).load()
+    print('Resuming: {} of {} operations already done'.format(len(journal.done), len(journal.operations)))
+    _run(journal, documents, hashes)
+    return journal.operations
+
+
+def rollback(journal_file=JOURNAL_FILE, documents=None):
+    """ Undo the completed operations of an interrupted run, last first. Returns the operations of the run
+    """
+    journal = Journal(journal_file).load()
+    if journal.committed:
+        raise RuntimeError('{} completed and deleted the replaced files, it cannot be rolled back'.format(
+            journal_file))
+    for i in sorted(journal.done, reverse=True):
+        op = journal.operations[i]
+        print('Undoing {} {}'.format(op.kind, op.target or op.source))
+        undo_operation(op, documents)
+        journal.mark('undone', i)
+    journal.finish()
+    return journal.operations
@@ -0,0 +1,151 @@
+"""Validation of JWST ETC configuration files against the instrument template
+Use
+---
+    The instrument template is compiled into a Schema: its delivered version, and the meta blocks it has (the
+    top-level meta and the meta of a section such as paths) with the subsections each one holds. Every configuration
+    file of a delivery is then checked against it in one pass, and all violations are returned rather than stopping
+    at the first one:
+    ::
+        schema = load_schema('/user/mcmaster/CRDS/for_matt/templates/nircam.json')
+        results = validate_files(['jwst_nircam_configuration.json'], schema)
+        print(render_results(results))
+"""
+
+import json
+from collections import namedtuple
+
+Schema = namedtuple('Schema', ['template', 'version', 'sections'])
+Section = namedtuple('Section', ['name', 'path', 'subsections', 'description'])
+Violation = namedtuple('Violation', ['section', 'message'])
+SchemaResult = namedtuple('SchemaResult', ['filename', 'passed', 'violations'])
+
+VERSION_KEY = '-delivered-for-version-'
+META_KEY = 'meta'
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def template_section(path, block):
+    """ Section for a meta block of the template: its subsections are the blocks it holds, and they need a
+        description entry if every one of them has one in the template
+    """
+    subsections = [name for name, sub in block.items() if isinstance(sub, dict)]
+    description = bool(subsections) and all('description' in block[name] for name in subsections)
+    return Section('/'.join(path), path, subsections, description)
+
+
+def compile_schema(data, template=None):
+    """ Schema for a parsed template: the top-level meta block and the meta block of every top-level section
+    """
+    sections = []
+    if isinstance(data.get(META_KEY), dict):
+        sections.append(template_section((META_KEY,), data[META_KEY]))
+    for key, block in data.items():
+        if key != META_KEY and isinstance(block, dict) and isinstance(block.get(META_KEY), dict):
+            sections.append(template_section((key, META_KEY), block[META_KEY]))
+    return Schema(template, data.get(VERSION_KEY), sections)
+
+
+def load_schema(template):
+    """ Read a template file into a Schema
+    """
+    with open(template) as f:
+        return compile_schema(json.load(f), template)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def find_block(data, path):
+    """ The block at path (a tuple of keys) in data, or None where a key is missing
+    """
+    for key in path:
+        if not isinstance(data, dict) or key not in data:
+            return None
+        data = data[key]
+    return data
+
+
+def check_section(block, section):
+    """ Check one block (e.g. data['meta']) for all required subsections and matching entries. Returns violations
+    """
+    violations = []
+    entries = []
+    for name in section.subsections:
+        sub = block.get(name)
+        if not isinstance(sub, dict):
+            violations.append(Violation(section.name, '{} NOT FOUND under {}'.format(name, section.name)))
+            continue
+        if section.description and 'description' not in sub:
+            violations.append(Violation(section.name,
+                                        'Description NOT FOUND under {}/{}'.format(section.name, name)))
+        entries.append((name, set(sub.keys())))
+
+    lengths = [len(keys) for _, keys in entries]
+    if len(set(lengths)) > 1:
+        violations.append(Violation(section.name, 'Sections {}/{} have differing numbers of entries: {}'.format(
+            section.name, [name for name, _ in entries], lengths)))
+    for name, keys in entries[1:]:
+        if keys != entries[0][1]:
+            violations.append(Violation(section.name,
+                                        '{}/{} ({} entries) does not have matching entries compared to {}'.format(
+                                            section.name, name, len(keys), entries[0][0])))
+    return violations
+
+
+def validate(data, schema):
+    """ All violations of schema in a parsed configuration file
+    """
+    violations = []
+    version = data.get(VERSION_KEY)
+    if version is None:
+        violations.append(Violation(VERSION_KEY, '{} NOT FOUND'.format(VERSION_KEY)))
+    elif version != schema.version:
+        violations.append(Violation(VERSION_KEY, 'Version of file submitted ({}) does not match template version '
+                                                 '({})'.format(version, schema.version)))
+
+    for section in schema.sections:
+        block = find_block(data, section.path)
+        if not isinstance(block, dict):
+            violations.append(Violation(section.name, '{} NOT FOUND'.format(section.name)))
+            continue
+        violations.extend(check_section(block, section))
+    return violations
+
+
+def load_json(filename):
+    with open(filename) as f:
+        return json.load(f)
+
+
+def validate_file(filename, schema, load=load_json):
+    """ Validate one configuration file, parsed with load (e.g. a DocumentCache's json method)
+    """
+    try:
+        data = load(filename)
+    except (OSError, ValueError) as e:
+        return SchemaResult(filename, False, [Violation('', 'Could not read {}: {}'.format(filename, e))])
+    if not isinstance(data, dict):
+        return SchemaResult(filename, False, [Violation('', 'Top level is not an object')])
+    violations = validate(data, schema)
+    return SchemaResult(filename, not violations, violations)
+
+
+def validate_files(filenames, schema, load=load_json):
+    """ Check every configuration file of a delivery. Results come back in the order of filenames
+    """
+    return [validate_file(f, schema, load) for f in filenames]
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def render_result(result):
+    """ Plain-text view of one file's results
+    """
+    lines = ['{} {} JSON CHECK'.format(result.filename, 'PASSED' if result.passed else 'FAILED')]
+    for v in result.violations:
+        lines.append('    {:<12} {}'.format(v.section, v.message))
+    return '\n'.join(lines) + '\n'
+
+
+def render_results(results):
+    return '\n'.join(render_result(r) for r in results)
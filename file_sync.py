@@ -0,0 +1,187 @@
+"""Incremental, content-addressed copying of delivered files into a destination tree
+Use
+---
+    Before a file is copied, its content hash is compared with the file already at the destination and with the
+    file it replaces. Identical payloads are not sent again: a file already in place is skipped, and a file whose
+    content matches the one it replaces is cloned from that file on the destination filesystem. Copies between
+    paths on the same filesystem use a reflink or os.copy_file_range where the platform has them:
+    ::
+        hashes = HashIndex()
+        result = sync_file('nircam_f070w_trans_20200101120000.fits',
+                           '/.../pandeia/nircam/filters/nircam_f070w_trans_20200101120000.fits',
+                           old='/.../pandeia/nircam/filters/nircam_f070w_trans_20190101120000.fits', hashes=hashes)
+        report([result])
+        hashes.save()
+
+    Hashes are remembered in ~/.redcat/sync_hashes.json by path, size and mtime, so files in the destination tree
+    are only read once.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+from collections import namedtuple
+
+try:
+    import fcntl
+except ImportError:  # Not on Windows
+    fcntl = None
+
+DEFAULT_HASH_FILE = os.path.join(os.path.expanduser('~'), '.redcat', 'sync_hashes.json')
+READ_SIZE = 8 * 1024 * 1024
+FICLONE = 0x40049409  # Linux ioctl to share extents with another file (btrfs, xfs, ...)
+
+SyncResult = namedtuple('SyncResult', ['source', 'target', 'action', 'size', 'sent'])
+
+# Actions
+UNCHANGED = 'unchanged'    # Identical file already at target
+REUSED = 'reused'          # Cloned from the identical file it replaces
+CLONED = 'cloned'          # Source and target on one filesystem: reflink / copy_file_range
+COPIED = 'copied'          # Read and written across filesystems
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def file_digest(filename):
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(READ_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class HashIndex(object):
+    """ absolute path -> size, mtime and sha256 of its content, persisted between runs
+    """
+
+    def __init__(self, path=DEFAULT_HASH_FILE, enabled=True):
+        self.path = path
+        self.enabled = enabled
+        self.files = {}
+        if enabled:
+            self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                self.files = json.load(f)
+        except (OSError, ValueError):
+            self.files = {}
+
+    def save(self):
+        """ Forget files that no longer exist and write the index back to disk atomically
+        """
+        if not self.enabled:
+            return
+        self.files = {k: v for k, v in self.files.items() if os.path.exists(k)}
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        temp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+        with open(temp_path, mode='w') as f:
+            json.dump(self.files, f, indent=1, sort_keys=True)
+        os.replace(temp_path, self.path)
+
+    def digest(self, filename):
+        path = os.path.abspath(filename)
+        stat = os.stat(path)
+        known = self.files.get(path)
+        if known is not None and known['size'] == stat.st_size and known['mtime_ns'] == stat.st_mtime_ns:
+            return known['hash']
+        digest = file_digest(path)
+        self.files[path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'hash': digest}
+        return digest
+
+    def same(self, a, b):
+        """ True if the two files have identical content. Sizes are compared first, so files that differ in size
+            are never read
+        """
+        if not (os.path.isfile(a) and os.path.isfile(b)):
+            return False
+        if os.path.getsize(a) != os.path.getsize(b):
+            return False
+        return self.digest(a) == self.digest(b)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def same_filesystem(source, target):
+    """ True if source and the directory target goes into are on the same device
+    """
+    return os.stat(source).st_dev == os.stat(os.path.dirname(os.path.abspath(target))).st_dev
+
+
+def _reflink(source, target):
+    if fcntl is None:
+        return False
+    with open(source, 'rb') as src, open(target, 'wb') as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            return True
+        except OSError:
+            return False
+
+
+def _copy_range(source, target):
+    if not hasattr(os, 'copy_file_range'):
+        return False
+    with open(source, 'rb') as src, open(target, 'wb') as dst:
+        remaining = os.fstat(src.fileno()).st_size
+        try:
+            while remaining > 0:
+                n = os.copy_file_range(src.fileno(), dst.fileno(), min(remaining, 1 << 30))
+                if n == 0:
+                    break
+                remaining -= n
+        except OSError:
+            return False
+    return remaining == 0
+
+
+def local_clone(source, target):
+    """ Copy source to target on the filesystem (reflink or copy_file_range) if both are on the same one.
+        Returns False, having copied nothing, if that is not possible
+    """
+    if same_filesystem(source, target) and (_reflink(source, target) or _copy_range(source, target)):
+        shutil.copymode(source, target)
+        return True
+    return False
+
+
+def clone(source, target):
+    """ Copy source to target without moving the data through this process where the filesystem allows.
+        Returns True if the data stayed on the filesystem (reflink or copy_file_range), False if it was read and
+        written
+    """
+    if local_clone(source, target):
+        return True
+    shutil.copy(source, target)
+    return False
+
+
+def sync_file(source, target, old=None, hashes=None):
+    """ Bring target up to date with source. old is the file target replaces, if any. Returns a SyncResult
+    """
+    hashes = hashes or HashIndex(enabled=False)
+    size = os.path.getsize(source)
+    if hashes.same(source, target):
+        return SyncResult(source, target, UNCHANGED, size, 0)
+    if old and hashes.same(source, old):
+        clone(old, target)
+        return SyncResult(source, target, REUSED, size, 0)
+    if clone(source, target):
+        return SyncResult(source, target, CLONED, size, 0)
+    return SyncResult(source, target, COPIED, size, size)
+
+
+def report(results):
+    """ Print how many bytes were sent and how many were saved by not sending identical or local data
+    """
+    total = sum(r.size for r in results)
+    sent = sum(r.sent for r in results)
+    counts = {}
+    for r in results:
+        counts[r.action] = counts.get(r.action, 0) + 1
+    print('{} files, {} bytes: {} bytes sent, {} bytes saved ({})'.format(
+        len(results), total, sent, total - sent, ', '.join('{} {}'.format(n, a) for a, n in sorted(counts.items()))))
@@ -0,0 +1,99 @@
+"""Minimal readers for raw FITS headers
+Use
+---
+    Reads only the 2880-byte header blocks of a FITS file, up to the END card, without astropy:
+    ::
+        header = read_primary_header('file.fits')
+        header.get('INSTRUME')
+"""
+
+from collections import OrderedDict
+
+BLOCK_SIZE = 2880
+CARD_SIZE = 80
+
+# Commentary keywords have no value and may repeat, so they are not returned by read_primary_header
+COMMENTARY = ('COMMENT', 'HISTORY', '')
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def card_value(card):
+    """ Return the value of a header card as a string, with quotes and comments removed
+    """
+    value = card[10:].strip()
+    if value.startswith("'"):
+        end = value.find("'", 1)
+        while end != -1 and value[end + 1:end + 2] == "'":  # '' is an escaped quote inside a FITS string
+            end = value.find("'", end + 2)
+        return value[1:end].replace("''", "'").rstrip()
+    return value.split('/')[0].strip()
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def data_size(keywords):
+    """ Size in bytes of the data section following a header, padded to whole FITS blocks
+    """
+    naxis = int(keywords.get('NAXIS', 0))
+    if naxis == 0:
+        return 0
+
+    bitpix = abs(int(keywords['BITPIX']))
+    gcount = int(keywords.get('GCOUNT', 1))
+    pcount = int(keywords.get('PCOUNT', 0))
+
+    # Random groups have NAXIS1 = 0, which is not part of the data size
+    axes = [int(keywords['NAXIS{}'.format(i)]) for i in range(1, naxis + 1)]
+    if axes[0] == 0 and keywords.get('GROUPS') == 'T':
+        axes = axes[1:]
+
+    n_elements = 1
+    for axis in axes:
+        n_elements *= axis
+
+    size = bitpix // 8 * gcount * (pcount + n_elements)
+    return -(-size // BLOCK_SIZE) * BLOCK_SIZE
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def read_header_blocks(f):
+    """ Read header blocks from the current position of an open binary file up to and including the one holding
+        END. Returns the raw bytes, or raises ValueError for a truncated or non-FITS header
+    """
+    blocks = []
+    while True:
+        block = f.read(BLOCK_SIZE)
+        if len(block) != BLOCK_SIZE:
+            raise ValueError('Truncated FITS header')
+        if not blocks and not (block.startswith(b'SIMPLE') or block.startswith(b'XTENSION')):
+            raise ValueError('Not a FITS header')
+        blocks.append(block)
+        for i in range(0, BLOCK_SIZE, CARD_SIZE):
+            if block[i:i + 8] == b'END     ':
+                return b''.join(blocks)
+
+
+def read_primary_header(filename, commentary=False):
+    """ Read the primary header of a FITS file into an OrderedDict of keyword -> value string.
+        Only the header blocks are read, never the data. With commentary=True, COMMENT and HISTORY are included as
+        lists of their text
+    """
+    with open(filename, 'rb') as f:
+        raw = read_header_blocks(f)
+
+    header = OrderedDict()
+    for i in range(0, len(raw), CARD_SIZE):
+        card = raw[i:i + CARD_SIZE].decode('ascii', errors='replace')
+        key = card[:8].strip()
+        if key == 'END':
+            break
+        if key in COMMENTARY:
+            if commentary and key:
+                header.setdefault(key, []).append(card[8:].strip())
+            continue
+        if card[8:10] != '= ' or key in header:
+            continue
+        header[key] = card_value(card)
+    return header
@@ -0,0 +1,105 @@
+"""Declarative checks of FITS primary header keywords
+Use
+---
+    A rule table maps each required keyword to the values it may take, given as a list of allowed values and/or
+    regular expressions. The table is compiled once and each header is checked in a single pass over a dictionary
+    of its keywords:
+    ::
+        rules = compile_rules(OrderedDict([('TELESCOP', {'allowed': ['JWST']}),
+                                           ('PEDIGREE', {'allowed': ['GROUND'], 'pattern': r'INFLIGHT .*'}),
+                                           ('AUTHOR', {})]))
+        results = check_headers(['a.fits', 'b.fits'], rules)
+        print(render_results(results))
+"""
+
+import re
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from fits_header import read_primary_header
+
+Rule = namedtuple('Rule', ['keyword', 'allowed', 'pattern'])
+KeywordResult = namedtuple('KeywordResult', ['keyword', 'value', 'status', 'message'])
+HeaderResult = namedtuple('HeaderResult', ['filename', 'passed', 'keywords'])
+
+# Keyword statuses
+OK = 'OK'
+MISSING = 'MISSING'
+INVALID = 'INVALID'
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def compile_rules(table):
+    """ Turn a rule table (keyword -> {'allowed': [...], 'pattern': regex}) into a list of Rule, in table order.
+        A keyword with neither only has to be present
+    """
+    rules = []
+    for keyword, spec in table.items():
+        allowed = frozenset(spec.get('allowed', ()))
+        pattern = re.compile('^(?:{})$'.format(spec['pattern'])) if spec.get('pattern') else None
+        rules.append(Rule(keyword.upper(), allowed, pattern))
+    return rules
+
+
+def check_header(header, rules):
+    """ Check one header (a dictionary of keyword -> value) against compiled rules. Returns a list of KeywordResult
+    """
+    results = []
+    for rule in rules:
+        if rule.keyword not in header:
+            results.append(KeywordResult(rule.keyword, None, MISSING, 'Keyword {} not found'.format(rule.keyword)))
+            continue
+
+        value = header[rule.keyword]
+        if isinstance(value, list):  # HISTORY/COMMENT
+            value = ' '.join(value)
+        if not rule.allowed and rule.pattern is None:
+            results.append(KeywordResult(rule.keyword, value, OK, ''))
+        elif value in rule.allowed or (rule.pattern is not None and rule.pattern.match(value)):
+            results.append(KeywordResult(rule.keyword, value, OK, ''))
+        else:
+            results.append(KeywordResult(rule.keyword, value, INVALID,
+                                         '{} IS NOT A VALID ENTRY for: {}'.format(value, rule.keyword)))
+    return results
+
+
+def check_file(filename, rules):
+    """ Read the primary header of filename (header blocks only) and check it. Returns a HeaderResult
+    """
+    try:
+        header = read_primary_header(filename, commentary=True)
+    except (OSError, ValueError) as e:
+        keywords = [KeywordResult(rule.keyword, None, MISSING, 'Could not read header: {}'.format(e))
+                    for rule in rules]
+        return HeaderResult(filename, False, keywords)
+
+    keywords = check_header(header, rules)
+    return HeaderResult(filename, all(k.status == OK for k in keywords), keywords)
+
+
+def check_headers(filenames, rules, workers=8):
+    """ Check many files in a thread pool. Results come back in the order of filenames
+    """
+    filenames = list(filenames)
+    if workers <= 1 or len(filenames) <= 1:
+        return [check_file(f, rules) for f in filenames]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(lambda f: check_file(f, rules), filenames))
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def render_result(result):
+    """ Plain-text view of one file's results
+    """
+    lines = ['File: {} KEYWORDS in EXT [0]: {}'.format(result.filename, 'PASSED' if result.passed else 'FAILED')]
+    for k in result.keywords:
+        value = '' if k.value is None else repr(str(k.value))
+        lines.append('    {:<9}{:<8} {}{}'.format(k.keyword, k.status, value,
+                                                  '  ({})'.format(k.message) if k.message and k.status != OK else ''))
+    return '\n'.join(lines) + '\n'
+
+
+def render_results(results):
+    return '\n'.join(render_result(r) for r in results)
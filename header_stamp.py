@@ -0,0 +1,171 @@
+"""In-place stamping of primary header keywords (VERIFIED, CERTIFYD) into FITS reference files
+Use
+---
+    Keywords are written into the blank padding that already follows the END card, so only the primary header
+    blocks are rewritten and the data section is never touched. Several keywords are written in a single write:
+    ::
+        result = stamp_keywords('file.fits', OrderedDict([('VERIFIED', 'PASSED'), ('CERTIFYD', 'PASSED')]))
+        if not result.in_place:
+            print(result.reason)  # astropy had to rewrite the whole file
+
+    A CHECKSUM already present in the primary header is recomputed from the new header and the recorded DATASUM.
+"""
+
+import os
+import struct
+from collections import namedtuple
+
+from astropy.io import fits
+
+from fits_header import BLOCK_SIZE, CARD_SIZE, card_value, read_header_blocks
+
+StampResult = namedtuple('StampResult', ['filename', 'in_place', 'reason'])
+
+END_CARD = b'END'.ljust(CARD_SIZE)
+BLANK_CARD = b' ' * CARD_SIZE
+
+# Characters the FITS checksum encoding must avoid (punctuation between the digits and letters)
+CHECKSUM_EXCLUDE = (0x3a, 0x3b, 0x3c, 0x3d, 0x3e, 0x3f, 0x40, 0x5b, 0x5c, 0x5d, 0x5e, 0x5f, 0x60)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class NeedsRewrite(Exception):
+    """ The keywords cannot be written into the existing header blocks
+    """
+    pass
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def format_card(keyword, value):
+    """ Fixed-format card for a string value, as astropy would write it
+    """
+    quoted = "'{}'".format(str(value).replace("'", "''").ljust(8))
+    card = '{}= {}'.format(keyword.ljust(8), quoted.ljust(20))
+    if len(card) > CARD_SIZE:
+        raise NeedsRewrite('value of {} is too long for a single card'.format(keyword))
+    return card.ljust(CARD_SIZE).encode('ascii')
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def ones_complement_sum(data, sum32=0):
+    """ 32-bit ones' complement sum of data (a multiple of 4 bytes), as used by the FITS checksum convention
+    """
+    words = struct.unpack('>{}I'.format(len(data) // 4), data)
+    total = sum32 + sum(words)
+    while total >> 32:
+        total = (total & 0xffffffff) + (total >> 32)
+    return total
+
+
+def encode_checksum(value):
+    """ Encode a 32-bit value as the 16 character ASCII string used for CHECKSUM
+    """
+    asc = [0] * 16
+    for i in range(4):
+        byte = (value >> ((3 - i) * 8)) & 0xff
+        quotient = byte // 4 + 0x30
+        ch = [quotient] * 4
+        ch[0] += byte % 4
+
+        check = True
+        while check:
+            check = False
+            for k in CHECKSUM_EXCLUDE:
+                for j in (0, 2):
+                    if ch[j] == k or ch[j + 1] == k:
+                        ch[j] += 1
+                        ch[j + 1] -= 1
+                        check = True
+
+        for j in range(4):
+            asc[4 * j + i] = ch[j]
+
+    # The encoded string is rotated one place to the right
+    return ''.join(chr(asc[(i + 15) % 16]) for i in range(16))
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def stamp_in_place(filename, keywords):
+    """ Write keywords into the primary header of filename without moving any data. Raises NeedsRewrite if the
+        existing header blocks have no room
+    """
+    with open(filename, 'r+b') as f:
+        try:
+            raw = read_header_blocks(f)
+        except ValueError as e:
+            raise NeedsRewrite(str(e))
+
+        cards = [raw[i:i + CARD_SIZE] for i in range(0, len(raw), CARD_SIZE)]
+        end = cards.index(END_CARD) if END_CARD in cards else None
+        if end is None:
+            raise NeedsRewrite('END card is malformed')
+
+        keys = [card[:8].decode('ascii', errors='replace').strip() for card in cards[:end]]
+        for keyword, value in keywords.items():
+            new_card = format_card(keyword, value)
+            if keyword in keys:
+                cards[keys.index(keyword)] = new_card
+                continue
+
+            # Take the first blank card after END and move END down one
+            if end + 1 >= len(cards) or any(card != BLANK_CARD for card in cards[end + 1:]):
+                raise NeedsRewrite('no blank padding left in the primary header')
+            cards[end] = new_card
+            cards[end + 1] = END_CARD
+            keys.append(keyword)
+            end += 1
+
+        if 'CHECKSUM' in keys:
+            if 'DATASUM' not in keys:
+                raise NeedsRewrite('CHECKSUM present without DATASUM')
+            try:
+                datasum = int(card_value(cards[keys.index('DATASUM')].decode('ascii')))
+            except ValueError:
+                raise NeedsRewrite('DATASUM is not a number')
+
+            position = keys.index('CHECKSUM')
+            old_card = cards[position]
+            if old_card[10:11] != b"'" or old_card[27:28] != b"'":
+                raise NeedsRewrite('CHECKSUM card is not in fixed format')
+            cards[position] = old_card[:11] + b'0' * 16 + old_card[27:]
+            checksum = ones_complement_sum(b''.join(cards), datasum)
+            cards[position] = old_card[:11] + encode_checksum(~checksum & 0xffffffff).encode('ascii') + old_card[27:]
+
+        header = b''.join(cards)
+        assert len(header) == len(raw) and len(header) % BLOCK_SIZE == 0
+
+        f.seek(0)
+        f.write(header)
+
+
+def stamp_keywords(filename, keywords):
+    """ Stamp keywords (keyword -> string value) into the primary header of filename in one write. When the header
+        has no room, falls back to astropy, which rewrites the whole file. Returns a StampResult
+    """
+    try:
+        stamp_in_place(filename, keywords)
+        return StampResult(filename, True, '')
+    except NeedsRewrite as e:
+        reason = str(e)
+
+    hdu = fits.open(filename, mode='update', checksum=True)
+    for keyword, value in keywords.items():
+        hdu[0].header[keyword] = value
+    hdu.close(output_verify='ignore')
+
+    return StampResult(filename, False, reason)
+
+
+def report_rewrites(results):
+    """ Print which files could not be stamped in place and had to be rewritten in full
+    """
+    rewritten = [r for r in results if not r.in_place]
+    if not rewritten:
+        return
+    print('{} of {} files were rewritten in full to add header keywords:'.format(len(rewritten), len(results)))
+    for r in rewritten:
+        print('\t{} ({}, {:.1f} MB)'.format(r.filename, r.reason, os.path.getsize(r.filename) / 1e6))
@@ -15,19 +15,45 @@ Use
 """
 
 import argparse
+import copy
 import datetime
 import glob
-import json
 import os
-import shlex
-import shutil
-import subprocess
 import time
 import warnings
 
 from astropy.io import fits
 from collections import OrderedDict
+from config_paths import CHANGES_FILE, apply_changes, merge_changes, plan_changes, render_changes, write_changes
+from document_cache import DocumentCache
+from etc_plan import JOURNAL_FILE, execute, operation, render_plan, resume, rollback
+from etc_schema import load_schema, validate_files, render_result as render_schema_result
+from header_rules import check_headers, compile_rules, render_result
+from header_stamp import stamp_keywords
 from move_files import move_results
+from pandeia_index import PandeiaIndex, match_subdirectory
+
+# Location of the per-instrument JSON configuration templates
+TEMPLATE_DIR = '/user/mcmaster/CRDS/for_matt/templates'
+
+# Required primary header keywords of ETC fits files, with the values they may take ('allowed' and/or a regex
+# 'pattern'). Keywords with neither only have to be present
+FITS_HEADER_RULES = OrderedDict([
+    ('TELESCOP', {'allowed': ['JWST']}),
+    ('SYSTEM', {'allowed': ['MODELING']}),
+    ('INSTRUME', {'allowed': ['NIRCAM', 'MIRI', 'NIRSPEC', 'NIRISS', 'TELESCOPE']}),
+    ('FILETYPE', {'allowed': ['THROUGHPUT_TABLE', 'IMAGE', 'CORR_MATRIX', 'DATA_TABLE']}),
+    ('REFTYPE', {}),
+    ('COMPNAME', {}),
+    ('PEDIGREE', {'allowed': ['GROUND', 'PLACEHOLDER', 'DUMMY'],
+                  'pattern': r'INFLIGHT \d{4}-\d{2}-\d{2} \d{4}-\d{2}-\d{2}'}),
+    ('LITREF', {}),
+    ('DESCRIP', {}),
+    ('AUTHOR', {}),
+    ('HISTORY', {})])
+
+# Parsed JSON documents, shared by every stage of a run
+documents = DocumentCache()
 
 # ----------------------------------------------------------------------------------------------------------------------
 
@@ -51,6 +77,9 @@ def parse_args():
     destination_help = 'Path to directory structure of pandeia directories. Default is /ifs/redcat/jwst/srefpipe/ETC/pandeia/pandeia_jwst_release_1.1dev UPDATE THIS AS NEW RELEASES ARE MADE'
     update_json_help = 'Actually update the JSON file?  Default: False'
     move_help = 'Actually replace the files in destination?  Default: False'
+    plan_help = 'Only print the renames, JSON update and moves that would be made, changing nothing'
+    resume_help = 'Finish an interrupted run from {}'.format(JOURNAL_FILE)
+    rollback_help = 'Undo an interrupted run recorded in {}'.format(JOURNAL_FILE)
 
     parser = argparse.ArgumentParser()
 
@@ -80,259 +109,206 @@ def parse_args():
                         help=update_json_help,
                         action='store_true',
                         required=False)
+    parser.add_argument('--plan',
+                        help=plan_help,
+                        action='store_true',
+                        required=False)
+    parser.add_argument('--resume',
+                        help=resume_help,
+                        action='store_true',
+                        required=False)
+    parser.add_argument('--rollback',
+                        help=rollback_help,
+                        action='store_true',
+                        required=False)
 
     arguments = parser.parse_args()
     return arguments
 # ----------------------------------------------------------------------------------------------------------------------
 
-def add_timestamps(files, local_time, instrument):
-    new_filenames = []
-    l = open('rename.log', 'w')  # log file containing renaming history
-    timestamp = time.strftime('%Y%m%d%H%M%S', local_time.timetuple())
-    for f in files:
-        name, extension = os.path.splitext(f)
-        last = name.split('_')[-1]
-        if all(c.isdigit() for c in last) and len(last) == 14:
-            name = '_'.join(name.split('_')[:-1]) # To check if a timestamp is already there
-        new_name = '{}_{}{}'.format(name,timestamp,extension)
-        if 'json' in extension:
-            if '_shutters' not in name and '_cr' not in name: # check to make sure its a configuration file
-                new_name = 'jwst_{}_configuration_{}.json'.format(instrument,timestamp)
-        os.rename(f,new_name)
-        new_filenames.append(new_name)
-        print('Renaming {} to {}'.format(f, new_name))
-        l.write('{} ----> {}\n'.format(f, new_name))
-    l.close()
-    return new_filenames
-
-# ----------------------------------------------------------------------------------------------------------------------
-
-def check_single_section(json_block, section_name):
-    """ Check a block of json (i.e. data['meta'] or data['paths']['meta']) for
-        all required subsections and lengths of subsections
+def timestamped_name(f, timestamp, instrument):
+    """ Name f is delivered under, with timestamp replacing any timestamp already in it
     """
-    passed = True
-    second_keys = ['author','litref','history','pedigree']
-    third_key_lists = []
-    for sk in second_keys:
-        if sk not in json_block.keys():
-            '{} NOT FOUND under {}'.format(sk, section_name)
-            passed = False
-        s_data = json_block[sk]
-        # Only check subsections of meta for description entry
-        if section_name == 'meta' and 'description' not in s_data.keys():
-            'Description NOT FOUND under {}/{}'.format(section_name,sk)
-            passed = False
-        third_key_lists.append(s_data.keys())
-
-    lengths = [len(keys) for keys in third_key_lists]
-    if len(set(lengths)) != 1: # Check to see all subsections have same number of entries
-        'Sections {}/{} have differing numbers of entries: {}'.format(section_name,second_keys,lengths)
-        passed = False
-    for i, keys in enumerate(third_key_lists):
-        if third_key_lists[0] != keys:
-            print('{}/{} ({} entries) does not have matching entries compared to {}'.format(section_name,second_keys[i],lengths[i],second_keys[0]))
-            passed = False
-    return passed
+    name, extension = os.path.splitext(f)
+    last = name.split('_')[-1]
+    if all(c.isdigit() for c in last) and len(last) == 14:
+        name = '_'.join(name.split('_')[:-1]) # To check if a timestamp is already there
+    new_name = '{}_{}{}'.format(name,timestamp,extension)
+    if 'json' in extension:
+        if '_shutters' not in name and '_cr' not in name: # check to make sure its a configuration file
+            new_name = 'jwst_{}_configuration_{}.json'.format(instrument,timestamp)
+    return new_name
 
+# ----------------------------------------------------------------------------------------------------------------------
 
 def check_json_sections(json_files, instrument):
-    """ Check a json file for required top level sections, wrap subsection
-        checking.
+    """ Check json files against the instrument template for required top level
+        sections and subsections.  Every violation is reported, not just the first.
+        Returns a list of SchemaResult
     """
-    template = '/user/mcmaster/CRDS/for_matt/templates/{}.json'.format(instrument)
-    template_data = json.load(open(template))
-    template_version = template_data['-delivered-for-version-']
-    for f in json_files:
-        statuses = []
-        print('Checking {}'.format(f))
-        with open(f) as json_data:
-            data = json.load(json_data)
-            version = data['-delivered-for-version-']
-            if version != template_version:
-                print('WARNING: Version of file submitted ({}) does not match template version ({})'.format(version, template_version))
-                statuses.append(False)
-            first_keys = ['meta', 'paths']
-            for fk in first_keys:
-                section_name = fk
-                assert fk in data.keys(), '{} NOT FOUND'.format(fk)
-                json_block = data[fk]
-                if fk == 'paths':
-                    json_block = json_block['meta']
-                    section_name = '{}/meta'.format(fk)
-                status = check_single_section(json_block, section_name)
-                statuses.append(status)
-        if all(statuses):
-            print('{} PASSED JSON CHECK'.format(f))
-        else:
-            print('{} FAILED JSON CHECK'.format(f))
+    schema = load_schema('{}/{}.json'.format(TEMPLATE_DIR, instrument))
+    results = validate_files(json_files, schema, documents.json)
+    for result in results:
+        print(render_schema_result(result))
         print('----------------------------------------------------------------\n')
+    return results
 
-def check_fits_files(fits_files):
-    ''' This checks the fits files for required keywords.  It works, but this
-        has been harvested from old code and should really be updated to be
-        more pythonic and have real handling of errors, currently just prints,
-        but fits files are likely lower priority/issue prone.
-    '''
-    out_file = open('fits_header_out.txt', 'w')
-    keys = ['TELESCOP','SYSTEM','INSTRUME','FILETYPE','REFTYPE','COMPNAME','PEDIGREE','LITREF','DESCRIP','AUTHOR','HISTORY']
-    print('keys are :', keys)
-    for f in fits_files:
-        hdu = fits.open(f)
-        if len(keys) > 0:
-            result = '['
-            resultk = '\n File: '+f+' KEYWORD in EXT [0]:\n ['
-            for i in xrange(len(keys)):
-                matches = [x for x in hdu[0].header if x == keys[i]]
-                if len(matches) > 0:
-                  read_key=hdu[0].header[keys[i]]
-                  resultk += keys[i]+', '
-                  result +=  '\''+str(read_key)+'\','
-                  if  keys[i] =='TELESCOP':
-                      if read_key != 'JWST':
-                        print(read_key, 'IS NOT A VALID ENTRY for:', keys[i])
-
-                  if  keys[i] =='SYSTEM':
-                      if read_key != 'MODELING':
-                        print(read_key, 'IS NOT A VALID ENTRY for:', keys[i])
-
-
-                  if  keys[i] =='INSTRUME':
-                      if read_key not in ['NIRCAM', 'MIRI','NIRSPEC', 'NIRISS', 'TELESCOPE']:
-                        print(read_key, 'IS NOT A VALID ENTRY for:', keys[i])
-
-                  if  keys[i] =='FILETYPE':
-                      if read_key not in ['THROUGHPUT_TABLE', 'IMAGE', 'CORR_MATRIX', 'DATA_TABLE']:
-                        print(read_key, 'IS NOT A VALID ENTRY for:', keys[i])
-
-                  if  keys[i] =='PEDIGREE':
-                      if read_key not in  ['INFLIGHT YYYY-MM-DD YYYY-MM-DD', 'GROUND','PLACEHOLDER', 'DUMMY']:
-                        print(read_key, 'IS NOT A VALID ENTRY for:', keys[i])
-
-                else:
-                    print('Keyword ',keys[i],' not found')
-                    result += '============Keyword '+keys[i]+' not found\n'
-            resultk += ']\n'
-            result += ']\n'
-            resultall = resultk + result
-            print(resultall)
+def check_fits_files(fits_files, workers=8):
+    """ Check the primary headers of the fits files against FITS_HEADER_RULES, several files at a time.
+        Prints and returns a header_rules.HeaderResult per file (with a result per keyword), and writes the same
+        report to fits_header_out.txt
+    """
+    rules = compile_rules(FITS_HEADER_RULES)
+    print('keys are :', [rule.keyword for rule in rules])
+
+    results = check_headers(fits_files, rules, workers)
+    with open('fits_header_out.txt', 'w') as out_file:
+        for result in results:
+            rendered = render_result(result)
+            print(rendered)
             print('----------------------------------------------------------------')
-            out_file.write(resultall)
-    out_file.close()
+            out_file.write(rendered + '\n')
+
+    return results
 
 # ----------------------------------------------------------------------------------------------------------------------
 
-def find_old_file(filename, target_dir):
-    ''' This function uses the filename to determine what the corresponding
-        old file is.  THIS BREAKS IF NEW FILES NOT IN THE PANDEIA DESTINATION
-        DIRECTORY.  This can be an enhancement later
+# Take care when editing this dictionary: each file goes to the directory of the longest key found in its name, so
+# '_trans_modmean' wins over '_trans'. Names containing two unrelated keys that point to different directories
+# (e.g. '_lyot' and '_trans') are ambiguous and only placed if the old file is found in exactly one of them
+
+# This dictionary maps the part of the filename to the directory
+EXT_TO_DIR = OrderedDict([
+            ('_disp', '/dispersion/'),
+            ('_blaze', '/blaze/'),
+            ('_optical', '/optical/'),
+            ('_dich', '/optical/'),
+            ('_ge_ar1_trans', '/optical/'),
+            ('_ge_ar2_trans', '/optical/'),
+            ('_trans_modmean', '/optical/'),
+            ('_substrate_trans', '/optical/'),
+            ('_trans', '/filters/'),
+            ('_psf', '/psfs/'),
+            ('_r.', '/resolving_power/'),
+            ('_ldwave', '/wavecal/'),
+            ('_specef', '/blaze/'),
+            ('_ipc', '/detector/'),
+            ('_qe', '/qe/'),
+            ('_throughput', '/optical/'),
+            ('_telescope', '/'),
+            ('_configuration', '/'),
+            ('_shutters', '/'),
+            ('_internaloptics', '/optical/'),
+            ('_lyot', '/optical/'),
+            ('_substrate', '/optical/'),
+            ('_dbs_', '/optical/'),
+            ('_trace', '/wavepix/'),
+            ('_wl', '/optical/')])
+
+
+def place_file(filename, index):
+    ''' Subdirectory filename goes into, or None if it can't be placed.
+        Ambiguous names are resolved by where their old file lives
     '''
-    ext = os.path.splitext(filename)
-    filetype = '_'.join(filename.split('_')[:-1])
-    matched = glob.glob('{}{}*'.format(target_dir,filetype))
-    if len(matched) != 1:
-        print('WARNING Too many or no files matched for {}'.format(filename))
-        return ''
-    old_file = matched[0]
-    full_path = os.path.abspath(old_file)
-    return full_path
-
-def move_to_pandeia(files, instrument, destination):
-    ''' This function figures out which subdirectory each of the delivered files
-        goes into, figures out the corresponding OLD file, deletes it (if one exists), 
-        and moves the new one into its correct place.
+    match = match_subdirectory(filename, EXT_TO_DIR)
+    if match.subdirectory is None:
+        print('WARNING No Pandeia subdirectory matches {}, skipping'.format(filename))
+        return None
+    if not match.ambiguous:
+        return match.subdirectory
+
+    subdir = index.resolve(filename, match, EXT_TO_DIR)
+    candidates = ', '.join('{} -> {}'.format(ext, EXT_TO_DIR[ext]) for ext in match.candidates)
+    if subdir is None:
+        print('WARNING Ambiguous Pandeia subdirectory for {} ({}), skipping'.format(filename, candidates))
+    else:
+        print('Ambiguous Pandeia subdirectory for {} ({}), old file found in {}'.format(filename, candidates, subdir))
+    return subdir
+
+def plan_delivery(files, instrument, destination, local_time):
+    ''' Work out every change the rename, update and move stages would make,
+        without touching the filesystem.  Returns the etc_plan operations (renames,
+        the updated configuration file, copies into the Pandeia tree and retirement
+        of the files they replace) and the paths change set.  The plan is always
+        complete; select_operations picks the part -u and -m allow to run
     '''
-    # Take care when editing this dictionary, since the files are matched to their directory
-    # based on the presence the dictionaries keys in the filenames.  For instance, 'trans'
-    # would get matched to filters, but would return a positive match for a file containing
-    # the name 'trans_modmean'
-
-    # This dictionary maps the part of the filename to the directory
-    ext_to_dir = OrderedDict([
-                ('_disp', '/dispersion/'),
-                ('_blaze', '/blaze/'),
-                ('_optical', '/optical/'),
-                ('_dich', '/optical/'),
-                ('_ge_ar1_trans', '/optical/'),
-                ('_ge_ar2_trans', '/optical/'),
-                ('_trans_modmean', '/optical/'),
-                ('_substrate_trans', '/optical/'),
-                ('_trans', '/filters/'),
-                ('_psf', '/psfs/'),
-                ('_r.', '/resolving_power/'),
-                ('_ldwave', '/wavecal/'),
-                ('_specef', '/blaze/'),
-                ('_ipc', '/detector/'),
-                ('_qe', '/qe/'),
-                ('_throughput', '/optical/'),
-                ('_telescope', '/'),
-                ('_configuration', '/'),
-                ('_shutters', '/'),
-                ('_internaloptics', '/optical/'),
-                ('_lyot', '/optical/'),
-                ('_substrate', '/optical/'),
-                ('_dbs_', '/optical/'),
-                ('_trace', '/wavepix/'),
-                ('_wl', '/optical/')])
-
-    new_to_old = {}
-    l = open('replacement.log', 'w')
-    l.write('#REPLACEMENT ONLY PERFORMED IF -m FLAG IS GIVEN\n')
-    l.write('#However, this log is created regardless.\n')
+    timestamp = time.strftime('%Y%m%d%H%M%S', local_time.timetuple())
+    operations = []
+    renamed = OrderedDict()
     for f in files:
-        for ext in ext_to_dir.keys():
-            if ext in f:
-                subdir = ext_to_dir[ext]
-                break
-        final_dir = '{}/{}/{}'.format(destination,instrument,subdir)
-        old_file = find_old_file(f,final_dir)
-        new_to_old[f] = old_file
-        print('Replacing {} with {}'.format(old_file,f))
-        l.write('Replacing {} with {} in {}\n'.format(old_file,f,final_dir))
-        if options.m: # Explicit control for replacing the files
-            shutil.copy(f,final_dir)
-            if old_file:
-                os.remove(old_file)
-    l.close()
-
-
-def update_json_file(config_file, files, destination, instrument):
-    ''' This updates the new JSON file (the paths sections) by first getting
-        the paths from the previous corresponding JSON file, and the accordingly
-        Updating the paths for each new fits file in the delivery directory.
-        This was a bear of a function.
-    '''
+        new_name = os.path.abspath(timestamped_name(f, timestamp, instrument))
+        renamed[os.path.abspath(f)] = new_name
+        if new_name != os.path.abspath(f):
+            operations.append(operation('rename', os.path.abspath(f), new_name))
+
+    configs = [(old, new) for old, new in renamed.items() if '.json' in new and 'configuration' in new]
+    assert configs, 'NO CONFIGURATION FILE'
+    config_file, new_config = configs[-1]
     old_config = glob.glob('{}/{}/*configuration*.json'.format(destination,instrument))[0]
-    print('OLD CONFIG: {}'.format(old_config))
-    old_data = json.loads(open(old_config, 'r').read(),object_pairs_hook=OrderedDict)
-
-    new_data = json.loads(open(config_file, 'r').read(),object_pairs_hook=OrderedDict)
-
-    # first update with old paths:
-    for key in old_data['paths'].keys():
-        if 'meta' in key:
+    previous = documents.json(config_file)
+    new_data = copy.deepcopy(previous)
+    changes = merge_changes(new_data['paths'], documents.json(old_config)['paths'])
+    apply_changes(new_data['paths'], changes)
+    file_changes, unmatched = plan_changes(new_data['paths'], renamed.values())
+    apply_changes(new_data['paths'], file_changes)
+    changes += file_changes
+    for f in unmatched:
+        print('WARNING No paths entry matches {}'.format(f))
+    operations.append(operation('write_json', target=new_config, data=new_data, previous=previous))
+
+    index = PandeiaIndex(os.path.join(destination, instrument))
+    for f in renamed.values():
+        subdir = place_file(f, index)
+        if subdir is None:
             continue
-        new_data['paths'][key] = old_data['paths'][key]
-        print('First setting {} to old value: {}'.format(key, old_data['paths'][key]))
+        final_dir = index.directory(subdir)
+        old_file = index.find(f, subdir)
+        operations.append(operation('copy', f, os.path.join(final_dir, os.path.basename(f)), previous=old_file))
+        if old_file:
+            operations.append(operation('retire', old_file))
+        else:
+            print('WARNING Too many or no files matched for {}'.format(f))
 
+    return operations, changes
 
-    for f in files:
-        if '.fits' not in f: continue
-        print('Attempting to update json file with {}'.format(f))
-        filetype = '_'.join(f.split('_')[:-1])
-        for key in new_data['paths'].keys():
-            if 'meta' in key:
-                continue
-            elif filetype in new_data['paths'][key]:
-                prefix = os.path.split(new_data['paths'][key])[0]
-                new_entry = '{}/{}'.format(prefix, f)
-                print('Changing {} to {}'.format(new_data['paths'][key], new_entry))
-                new_data['paths'][key] = new_entry
-        print('--------------------------------------')
-
-    if options.u: # only write updated JSON file if supplied in commandline flag:
-        with open(config_file, 'w') as tmp:
-            json.dump(new_data, tmp, indent=4)
+def select_operations(operations, update, move):
+    ''' The operations of a plan a run applies: the renames always, the updated
+        configuration file with -u, and the copies into the Pandeia tree (and
+        retirement of the files they replace) with -m
+    '''
+    allowed = {'rename'}
+    if update:
+        allowed.add('write_json')
+    if move:
+        allowed.update(('copy', 'retire'))
+    return [op for op in operations if op.kind in allowed]
+
+def write_plan_logs(operations, changes, config_file):
+    ''' rename.log, replacement.log and json_changes.json for the complete plan of
+        a run, whether or not -u and -m let it apply the update and the moves
+    '''
+    with open('rename.log', 'w') as l:
+        for op in operations:
+            if op.kind == 'rename':
+                l.write('{} ----> {}\n'.format(os.path.basename(op.source), os.path.basename(op.target)))
+    with open('replacement.log', 'w') as l:
+        l.write('#REPLACEMENT ONLY PERFORMED IF -m FLAG IS GIVEN\n')
+        l.write('#However, this log is created regardless.\n')
+        for op in operations:
+            if op.kind == 'copy':
+                l.write('Replacing {} with {} in {}\n'.format(op.previous or '', os.path.basename(op.target),
+                                                              os.path.dirname(op.target)))
+    write_changes(changes, CHANGES_FILE, config_file)
+
+def finish_delivery(operations):
+    ''' Steps after the plan of a run has been applied, resumed or rolled back:
+        a run that moved files into the Pandeia tree has its logs archived
+    '''
+    if any(op.kind == 'copy' for op in operations):
+        obs_instruments = {'hst': ['STIS', 'COS', 'ACS', 'WFC3', 'NICMOS', 'WFPC2'],
+               'jwst': ['FGS', 'MIRI', 'NIRCAM', 'NIRISS', 'NIRSPEC', 'TELESCOPE']}
+        delivery_directory = os.getcwd()
+        move_results(delivery_directory, obs_instruments)
 
 # ----------------------------------------------------------------------------------------------------------------------
 
@@ -347,10 +323,7 @@ def verify_json_files(json_files):
         print('Verifying {}'.format(f))
         fname = os.path.abspath(f)
         try:
-            tmp = open(fname, 'r')
-            buf = tmp.read()
-            tmp.close()
-            obj = json.loads(buf)
+            obj = documents.json(fname)
             key_str = str(' '.join(obj.keys()))
             print('{} appears valid with keys: {}'.format(f, key_str))
         except Exception as e:
@@ -362,26 +335,28 @@ def verify_json_files(json_files):
 
 
 def verify_fits_files(fits_files):
-    """ Check files conform to fits standard and update verification keyword
+    """ Check files conform to fits standard and update verification keyword.
+        The file is opened read-only and VERIFIED stamped into the header afterwards
     """
     for f in fits_files:
 
         print('Verifying {}'.format(f))
         with warnings.catch_warnings(record=True) as w:  # Workaround for astropy verify issues
             warnings.simplefilter("always")  # Catch all warnings
-            hdu = fits.open(f, mode='update')  # Catches the 'fixable violations'
+            hdu = fits.open(f)  # Catches the 'fixable violations'
             hdu.verify('warn')  # Catches the unfixable ones
+            hdu.close(output_verify='ignore')
 
             if len(w) == 0:  # Check number of warnings, if =0 then file is good
                 print(f, 'PASSED VERIFICATION')
-                hdu[0].header['VERIFIED'] = 'PASSED'
+                status = 'PASSED'
             else:
                 print(f, 'FAILED VERIFICATION')
-                hdu[0].header['VERIFIED'] = 'FAILED'
+                status = 'FAILED'
                 for warn in w:
                     print(warn.message)
 
-            hdu.close(output_verify='ignore')
+        stamp_keywords(f, {'VERIFIED': status})
 
         print('----------------------------------------------------------------')
 
@@ -390,6 +365,10 @@ def verify_fits_files(fits_files):
 
 if __name__ == '__main__':
     options = parse_args()
+    if options.resume or options.rollback:
+        finish_delivery((resume if options.resume else rollback)(documents=documents))
+        raise SystemExit(0)
+
     if options.f:
         files = glob.glob(options.f)
     else:
@@ -410,6 +389,14 @@ if __name__ == '__main__':
                 break
     assert instrument in instruments, 'Cannot match instrument to one of: {}'.format(' '.join(instruments))
 
+    destination = options.d
+    local_time = datetime.datetime.now()
+    if options.plan:
+        operations, changes = plan_delivery(files, instrument, destination, local_time)
+        print(render_changes(changes))
+        print(render_plan(select_operations(operations, options.u, options.m)))
+        raise SystemExit(0)
+
     # Verify both file types
     print('----------------------------------------------------------------')
     print('--------------------------VERIFYING-----------------------------')
@@ -426,30 +413,17 @@ if __name__ == '__main__':
 
     # !!Check to make sure all files passed, otherwise do not allow moving/updating
     print('----------------------------------------------------------------')
-    print('--------------------------RENAMING------------------------------')
+    print('--------------------------PLANNING------------------------------')
     print('----------------------------------------------------------------')
-    local_time = datetime.datetime.now()
-    files = add_timestamps(files, local_time, instrument)
-
+    operations, changes = plan_delivery(files, instrument, destination, local_time)
+    print(render_changes(changes))
+    config_file = [op.target for op in operations if op.kind == 'write_json']
+    write_plan_logs(operations, changes, config_file[0])
+    operations = select_operations(operations, options.u, options.m)
+    print(render_plan(operations))
 
     print('----------------------------------------------------------------')
-    print('--------------------------UPDATING JSON-------------------------')
+    print('--------------------------RENAMING, UPDATING AND MOVING---------')
     print('----------------------------------------------------------------')
-    config_file = ''
-    for f in files:
-        if '.json' in f and 'configuration' in f:
-            config_file = f
-    assert config_file != '', 'NO CONFIGURATION FILE'
-
-    destination = options.d
-    update_json_file(config_file, files, destination, instrument)
-
-    print('----------------------------------------------------------------')
-    print('--------------------------MOVING FILES--------------------------')
-    print('----------------------------------------------------------------')
-    move_to_pandeia(files, instrument, destination)
-    if options.m:
-        obs_instruments = {'hst': ['STIS', 'COS', 'ACS', 'WFC3', 'NICMOS', 'WFPC2'],
-               'jwst': ['FGS', 'MIRI', 'NIRCAM', 'NIRISS', 'NIRSPEC', 'TELESCOPE']}
-        delivery_directory = os.getcwd()
-        move_results(delivery_directory, obs_instruments)
+    execute(operations, documents=documents)
+    finish_delivery(operations)
@@ -0,0 +1,168 @@
+"""Compressed bundles of the result files of archived deliveries
+Use
+---
+    In bundle mode (python move_files.py --bundle) the .log, .txt and .jsonl files of a delivery are archived as a
+    single deflate-compressed zip, results.zip, instead of one file each. The zip central directory is the index:
+    any one log can be listed and read without unpacking the rest:
+    ::
+        python log_bundle.py list /ifs/redcat/hst/srefpipe/WFC3/2020_01_01
+        python log_bundle.py cat /ifs/redcat/hst/srefpipe/WFC3/2020_01_01 certify_results.txt
+
+    Date directories archived before bundles existed are converted in bulk (loose files are removed only after the
+    bundle has been read back and checked):
+    ::
+        python log_bundle.py convert --root /ifs/redcat [--dry-run]
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import zipfile
+
+from archive_manifest import MANIFEST_FILE, Manifest
+
+BUNDLE_FILE = 'results.zip'
+BUNDLED_EXTENSIONS = ('.log', '.txt', '.jsonl')
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def bundle_path(directory):
+    """ The bundle of an archived delivery directory (a directory or the bundle itself may be given)
+    """
+    return directory if directory.endswith('.zip') else os.path.join(directory, BUNDLE_FILE)
+
+
+def member_path(bundle, name):
+    """ Path-like name of a file inside a bundle, as recorded in archive manifests
+    """
+    return os.path.join(bundle, os.path.basename(name))
+
+
+def make_bundle(files, bundle):
+    """ Write files (paths) into a new compressed bundle, replacing any existing one atomically
+    """
+    partial = bundle + '.part'
+    with zipfile.ZipFile(partial, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=9) as zf:
+        for f in sorted(files):
+            zf.write(f, os.path.basename(f))
+    os.replace(partial, bundle)
+    return bundle
+
+
+def list_members(bundle):
+    """ (name, size, compressed size) of every file in a bundle
+    """
+    with zipfile.ZipFile(bundle_path(bundle)) as zf:
+        return [(info.filename, info.file_size, info.compress_size) for info in zf.infolist()]
+
+
+def read_member(bundle, name):
+    """ Text of one file in a bundle. Only that member is read and decompressed
+    """
+    with zipfile.ZipFile(bundle_path(bundle)) as zf:
+        return zf.read(name).decode('utf-8', errors='replace')
+
+
+def extract_all(bundle, directory):
+    with zipfile.ZipFile(bundle_path(bundle)) as zf:
+        zf.extractall(directory)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def loose_results(directory):
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                  if name.endswith(BUNDLED_EXTENSIONS) and name != MANIFEST_FILE)
+
+
+def convert_directory(directory, dry_run=False):
+    """ Pack the loose result files of an archived delivery into its bundle (adding to an existing bundle), check
+        the bundle, then delete the loose files and point their manifest entries at the bundle.
+        Returns the number of files packed
+    """
+    loose = loose_results(directory)
+    if not loose or dry_run:
+        return len(loose)
+
+    bundle = bundle_path(directory)
+    staging = bundle + '.d'
+    os.makedirs(staging, exist_ok=True)
+    try:
+        if os.path.exists(bundle):
+            extract_all(bundle, staging)
+        for f in loose:
+            shutil.copy2(f, staging)
+        make_bundle([os.path.join(staging, name) for name in os.listdir(staging)], bundle)
+    finally:
+        shutil.rmtree(staging)
+
+    with zipfile.ZipFile(bundle) as zf:
+        bad = zf.testzip()
+        names = set(zf.namelist())
+    missing = [f for f in loose if os.path.basename(f) not in names]
+    if bad or missing:
+        raise IOError('Bundle {} failed its check ({}), loose files kept'.format(bundle, bad or missing))
+
+    manifest = Manifest.load(directory)
+    for f in loose:
+        entry = manifest.files.pop(os.path.abspath(f), None)
+        if entry is not None:
+            manifest.files[member_path(bundle, f)] = entry
+        os.remove(f)
+    if manifest.files:
+        manifest.save()
+    return len(loose)
+
+
+def convert_tree(root, dry_run=False):
+    """ Convert every archived delivery under root. Returns (directories converted, files packed)
+    """
+    from delivery_catalog import find_deliveries
+
+    directories = files = 0
+    for _, _, _, _, path in find_deliveries(root):
+        try:
+            n = convert_directory(path, dry_run)
+        except (OSError, IOError, zipfile.BadZipFile) as e:
+            print('FAILED {}: {}'.format(path, e))
+            continue
+        if n:
+            directories += 1
+            files += n
+            print('{} {} files in {}'.format('Would pack' if dry_run else 'Packed', n, path))
+    return directories, files
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+if __name__ == '__main__':
+    from move_files import REDCAT_ARCHIVE
+
+    parser = argparse.ArgumentParser(description='Read or create bundles of archived delivery results')
+    commands = parser.add_subparsers(dest='command')
+
+    listing = commands.add_parser('list', help='List the files in a bundle')
+    listing.add_argument('bundle', type=str, help='Archived delivery directory or bundle')
+
+    cat = commands.add_parser('cat', help='Print one file from a bundle')
+    cat.add_argument('bundle', type=str, help='Archived delivery directory or bundle')
+    cat.add_argument('name', type=str, help='File in the bundle, e.g. certify_results.txt')
+
+    convert = commands.add_parser('convert', help='Pack loose results of archived deliveries into bundles')
+    convert.add_argument('--root', type=str, help='Archive root.  Default is {}'.format(REDCAT_ARCHIVE),
+                         action='store', default=REDCAT_ARCHIVE)
+    convert.add_argument('--dry-run', help='Only report what would be packed', action='store_true')
+
+    options = parser.parse_args()
+    if options.command == 'list':
+        for name, size, compressed in list_members(options.bundle):
+            print('{:<40} {:>10} {:>10}'.format(name, size, compressed))
+    elif options.command == 'cat':
+        sys.stdout.write(read_member(options.bundle, options.name))
+    elif options.command == 'convert':
+        directories, files = convert_tree(options.root, options.dry_run)
+        print('{} files in {} deliveries {}'.format(files, directories, 'to pack' if options.dry_run else 'packed'))
+    else:
+        parser.print_help()
@@ -0,0 +1,271 @@
+"""Spooled, asynchronous email for delivery notifications
+Use
+---
+    Messages are written to a spool directory, ~/.redcat/outbox, and sent from there by a background thread, so a
+    submission never waits on, or fails because of, the mail relay. The sender keeps one SMTP connection open for
+    everything that is queued, sends in batches and retries with exponential backoff while the relay is down.
+    Anything still unsent when the program exits stays spooled and goes out with the next run, or with:
+    ::
+        python mail_outbox.py list
+        python mail_outbox.py flush
+
+    In code:
+    ::
+        outbox = Outbox()
+        outbox.start()
+        outbox.queue(message)    # email.message.Message
+        ...
+        unsent = outbox.stop(timeout=30)
+
+    The relay is smtp.stsci.edu unless REDCAT_SMTP_HOST / REDCAT_SMTP_PORT say otherwise; point them at
+    benchmarks/mock_smtp.py to try the tools without sending mail. Messages the relay refuses permanently (5xx) are
+    moved to the failed/ directory of the spool instead of being retried.
+"""
+
+import argparse
+import email
+import itertools
+import os
+import smtplib
+import threading
+import time
+from collections import namedtuple
+
+OUTBOX_DIR = os.path.join(os.path.expanduser('~'), '.redcat', 'outbox')
+SMTP_HOST = os.environ.get('REDCAT_SMTP_HOST', 'smtp.stsci.edu')
+SMTP_PORT = int(os.environ.get('REDCAT_SMTP_PORT', 25))
+SMTP_TIMEOUT = 30
+BATCH_SIZE = 20         # Messages sent per pass over the connection
+RETRY_DELAY = 2         # Seconds before the first retry; doubled each time up to MAX_RETRY_DELAY
+MAX_RETRY_DELAY = 300
+IDLE_CHECK = 10        # A connection idle this long is checked with NOOP before it is used again
+CLAIM_TIMEOUT = 600     # A message claimed by a sender this long ago (that presumably died) is sent again
+
+FlushResult = namedtuple('FlushResult', ['sent', 'failed', 'pending', 'error'])
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class SMTPPool(object):
+    """ A single SMTP connection, opened on first use and reused for as long as the relay keeps it open
+    """
+
+    def __init__(self, host=SMTP_HOST, port=SMTP_PORT, timeout=SMTP_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.smtp = None
+        self.last_used = 0
+        self.connections = 0
+
+    def connection(self):
+        if self.smtp is not None:
+            if time.time() - self.last_used < IDLE_CHECK:
+                return self.smtp
+            try:
+                if self.smtp.noop()[0] == 250:
+                    return self.smtp
+            except (smtplib.SMTPException, OSError):
+                pass
+            self.close()
+        self.smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        self.connections += 1
+        return self.smtp
+
+    def send(self, message):
+        self.connection().send_message(message)
+        self.last_used = time.time()
+
+    def close(self):
+        if self.smtp is not None:
+            try:
+                self.smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self.smtp = None
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class Outbox(object):
+    """ Spool directory of messages waiting to be sent, and the thread that sends them
+    """
+
+    def __init__(self, directory=OUTBOX_DIR, host=SMTP_HOST, port=SMTP_PORT):
+        self.directory = directory
+        self.failed_directory = os.path.join(directory, 'failed')
+        self.pool = SMTPPool(host, port)
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.stopping = threading.Event()
+        self.deadline = None
+        self.thread = None
+        if not os.path.isdir(self.failed_directory):
+            os.makedirs(self.failed_directory)
+
+    def queue(self, message):
+        """ Spool a message for sending. Returns its path in the spool
+        """
+        name = '{:020d}_{}_{}.eml'.format(time.time_ns(), os.getpid(), next(self.counter))
+        path = os.path.join(self.directory, name)
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(message.as_bytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+        self.wake.set()
+        return path
+
+    def pending(self):
+        """ Spooled messages not yet sent, oldest first
+        """
+        return sorted(os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                      if name.endswith('.eml'))
+
+    def _claim(self, path):
+        """ Take a message so no other sender sends it too. Returns the claimed path, or None if it is gone
+        """
+        claimed = '{}.{}.sending'.format(path, os.getpid())
+        try:
+            os.rename(path, claimed)
+        except FileNotFoundError:
+            return None
+        os.utime(claimed)  # Staleness counts from the claim; rename keeps the mtime of when it was spooled
+        return claimed
+
+    def _release_stale(self):
+        now = time.time()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith('.sending') and now - os.path.getmtime(path) > CLAIM_TIMEOUT:
+                os.rename(path, path.rsplit('.', 2)[0])
+
+    def flush(self, batch_size=BATCH_SIZE):
+        """ Send up to batch_size spooled messages over the pooled connection. Stops at the first error that is not
+            the fault of the message itself, leaving the rest spooled. Returns a FlushResult
+        """
+        sent = failed = 0
+        error = None
+        with self.lock:
+            self._release_stale()
+            for path in self.pending()[:batch_size]:
+                claimed = self._claim(path)
+                if claimed is None:
+                    continue
+                with open(claimed, 'rb') as f:
+                    message = email.message_from_binary_file(f)
+                try:
+                    self.pool.send(message)
+                except smtplib.SMTPRecipientsRefused as e:
+                    os.rename(claimed, os.path.join(self.failed_directory, os.path.basename(path)))
+                    print('Mail relay refused every recipient of {}: {}'.format(os.path.basename(path), e.recipients))
+                    failed += 1
+                    continue
+                except smtplib.SMTPResponseException as e:
+                    if e.smtp_code < 500 or isinstance(e, smtplib.SMTPConnectError):
+                        os.rename(claimed, path)
+                        error = '{} {}'.format(e.smtp_code, e.smtp_error)
+                        self.pool.close()
+                        break
+                    os.rename(claimed, os.path.join(self.failed_directory, os.path.basename(path)))
+                    print('Mail relay refused {}: {} {}'.format(os.path.basename(path), e.smtp_code, e.smtp_error))
+                    failed += 1
+                    continue
+                except (smtplib.SMTPException, OSError) as e:
+                    os.rename(claimed, path)
+                    error = str(e) or type(e).__name__
+                    self.pool.close()
+                    break
+                os.remove(claimed)
+                sent += 1
+            pending = len(self.pending())
+        return FlushResult(sent, failed, pending, error)
+
+    def flush_all(self):
+        """ Send everything spooled, in batches, until the spool is empty or the relay fails. Returns FlushResult
+        """
+        sent = failed = 0
+        while True:
+            result = self.flush()
+            sent += result.sent
+            failed += result.failed
+            if result.error or not result.pending or not (result.sent or result.failed):
+                self.pool.close()
+                return FlushResult(sent, failed, result.pending, result.error)
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def run(self):
+        """ Body of the sender thread: send whatever is spooled, then wait for more, until stopped
+        """
+        delay = RETRY_DELAY
+        while True:
+            self.wake.clear()
+            result = self.flush()
+            if result.error:
+                if self.stopping.is_set():
+                    wait = min(delay, self.deadline - time.time())
+                    if wait <= 0:
+                        break
+                    print('Mail relay unavailable ({}), {} messages spooled, retrying in {:.1f} s'.format(
+                        result.error, result.pending, wait))
+                    time.sleep(wait)
+                else:
+                    print('Mail relay unavailable ({}), {} messages spooled, retrying in {} s'.format(
+                        result.error, result.pending, delay))
+                    self.stopping.wait(delay)
+                delay = min(delay * 2, MAX_RETRY_DELAY)
+                continue
+            delay = RETRY_DELAY
+            if result.pending and (result.sent or result.failed):
+                continue
+            if self.stopping.is_set():
+                break
+            self.wake.wait(RETRY_DELAY)
+        self.pool.close()
+
+    def start(self):
+        """ Start sending in the background. Anything left spooled by earlier runs is sent first
+        """
+        if self.thread is None:
+            self.stopping.clear()
+            self.thread = threading.Thread(target=self.run, name='outbox', daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self, timeout=0):
+        """ Stop the sender once what is queued has been sent, waiting (and retrying) at most timeout seconds.
+            Returns the number of messages left in the spool
+        """
+        if self.thread is not None:
+            self.deadline = time.time() + timeout
+            self.stopping.set()
+            self.wake.set()
+            self.thread.join(timeout)
+            self.thread = None
+        return len(self.pending())
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Show or send the spooled notification emails')
+    parser.add_argument('command', choices=['list', 'flush'], help='list the spooled messages or send them now')
+    parser.add_argument('--outbox', type=str, help='Spool directory.  Default is {}'.format(OUTBOX_DIR),
+                        action='store', default=OUTBOX_DIR)
+    options = parser.parse_args()
+
+    outbox = Outbox(options.outbox)
+    if options.command == 'list':
+        for path in outbox.pending():
+            with open(path, 'rb') as f:
+                message = email.message_from_binary_file(f)
+            print('{}  {:<30}  {}'.format(os.path.basename(path), message['From'], message['Subject']))
+        print('{} messages spooled, {} failed'.format(len(outbox.pending()), len(os.listdir(outbox.failed_directory))))
+    else:
+        result = outbox.flush_all()
+        print('{} sent, {} refused, {} still spooled{}'.format(result.sent, result.failed, result.pending,
+                                                               ' ({})'.format(result.error) if result.error else ''))
+        raise SystemExit(1 if result.error else 0)
@@ -1,12 +1,20 @@
+import argparse
 import os
 import glob
-import shutil
+
+from archive_manifest import Manifest
+from copy_engine import JOURNAL_FILE, checksum, copy_files, failed
+from log_bundle import BUNDLE_FILE, make_bundle, member_path
 
 
 # Constants
 instruments = {'hst': ['STIS', 'COS', 'ACS', 'WFC3', 'NICMOS', 'WFPC2'],
                'jwst': ['FGS', 'MIRI', 'NIRCAM', 'NIRISS', 'NIRSPEC']}
 
+# Record keeping area and HST central store
+REDCAT_ARCHIVE = '/ifs/redcat'
+CENTRAL_STORE = '/grp/hst/cdbs/'
+
 # ----------------------------------------------------------------------------------------------------------------------
 
 
@@ -27,50 +35,45 @@ def parse_directory_name(name):
 # ----------------------------------------------------------------------------------------------------------------------
 
 
-def move_results(directory, obs_instruments):
-    """ Move all .log and .txt files to the appropriate directory on /ifs/....
-        This should include the following:
-
-            1. rename.log: contains the results of uniqname
-            2. delivery_form.txt: contains a plain-text version of the delivery
-                form
-            3. certify_errored_files.txt
-            4. delivery.log: contains the results of the actual delivery
+def archive_sources(directory):
+    """ The .log, .txt and .jsonl files of a delivery, each once
     """
-    # Grab the logs and txts
-    results = glob.glob(os.path.join(directory, '*.log'))
-    results += glob.glob(os.path.join(directory, '*.txt'))
+    results = set()
+    for pattern in ('*.log', '*.txt', '*.jsonl'):
+        results.update(glob.glob(os.path.join(directory, pattern)))
+    return sorted(results)
 
+
+def archive_destination(directory, obs_instruments):
+    """ Where the results of the delivery in directory are archived on /ifs/...
+    """
     # Grab the delivery info
-    delivery = directory.split('/')[-1]
+    delivery = os.path.basename(os.path.normpath(directory))
     instrument, date_str = parse_directory_name(delivery)
-    print('-'*50)
-    print('\n\t{} DELIVERY\n\t{}'.format(instrument, date_str))
-    print('-'*50)
     date_dir = date_str
 
     # Construct Destination
     if 'test' in directory:
         if instrument in obs_instruments['hst']:
-            destination = '/ifs/redcat/hst/cdbstest/{}/'.format(instrument)
+            destination = '{}/hst/cdbstest/{}/'.format(REDCAT_ARCHIVE, instrument)
         elif instrument in obs_instruments['jwst']:
-            destination = '/ifs/redcat/jwst/cdbstest/{}/'.format(instrument)
+            destination = '{}/jwst/cdbstest/{}/'.format(REDCAT_ARCHIVE, instrument)
         else:
             raise Exception(
                 'Unknown Instrument or Observatory/Delivery Area Incorrectly Formatted')
     elif 'ops' in directory:
         if instrument in obs_instruments['hst']:
-            destination = '/ifs/redcat/hst/srefpipe/{}/'.format(instrument)
+            destination = '{}/hst/srefpipe/{}/'.format(REDCAT_ARCHIVE, instrument)
         elif instrument in obs_instruments['jwst']:
-            destination = '/ifs/redcat/jwst/srefpipe/{}/'.format(instrument)
+            destination = '{}/jwst/srefpipe/{}/'.format(REDCAT_ARCHIVE, instrument)
         else:
             raise Exception(
                 'Unknown Instrument or Observatory/Delivery Area Incorrectly Formatted')
     elif 'etc' in directory:
         if instrument in obs_instruments['hst']:
-            destination = '/ifs/redcat/hst/srefpipe/ETC/'
+            destination = '{}/hst/srefpipe/ETC/'.format(REDCAT_ARCHIVE)
         elif instrument in obs_instruments['jwst']: # JWST ETC directories are lowercase on /ifs/redcat/ tree
-            destination = '/ifs/redcat/jwst/srefpipe/ETC/deliveries/{}/'.format(instrument.lower())
+            destination = '{}/jwst/srefpipe/ETC/deliveries/{}/'.format(REDCAT_ARCHIVE, instrument.lower())
         else:
             raise Exception(
                 'Unknown Instrument or Observatory/Delivery Area Incorrectly Formatted')            
@@ -78,27 +81,121 @@ def move_results(directory, obs_instruments):
         raise Exception(
             'Cannot Identify Delivery Type/Delivery Is Not Located in Delivery Area')
 
+    return os.path.join(destination, date_dir)
+
+
+def is_archived(directory, obs_instruments=instruments):
+    """ True if the manifest of the archived delivery records every file of directory, unchanged
+    """
+    complete_destination = archive_destination(directory, obs_instruments)
+    manifest = Manifest.load(complete_destination)
+    if not manifest.complete:
+        return False
+    bundle = os.path.join(complete_destination, BUNDLE_FILE)
+    targets = [(item, member_path(bundle, item) if os.path.exists(bundle) else
+                os.path.join(complete_destination, os.path.basename(item))) for item in archive_sources(directory)]
+    instrument = parse_directory_name(os.path.basename(os.path.normpath(directory)))[0]
+    if instrument in obs_instruments['hst']:
+        targets += hst_reference_targets(instrument, directory)
+    return all(manifest.current(source, target) for source, target in targets)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def copy_with_manifest(targets, manifest, directory):
+    """ Copy the (source, target) pairs the manifest does not already record, and record them.
+        Returns the CopyResults of the copies made
+    """
+    pending = [(source, target) for source, target in targets if manifest.needs_copy(source, target)]
+    if len(pending) < len(targets):
+        print('{} of {} files already archived and unchanged'.format(len(targets) - len(pending), len(targets)))
+    if not pending:
+        return []
+    copied = copy_files(pending, journal=os.path.join(directory, JOURNAL_FILE))
+    manifest.record_results(copied)
+    manifest.save()
+    return copied
+
+
+def bundle_results(results, complete_destination, manifest, directory):
+    """ Archive the result files as one compressed bundle, rebuilt only if the manifest says one of them is
+        missing or changed. Returns the CopyResults of the copy made, if any
+    """
+    bundle = os.path.join(complete_destination, BUNDLE_FILE)
+    targets = [(item, member_path(bundle, item)) for item in results]
+    if os.path.exists(bundle) and all(manifest.current(source, target) for source, target in targets):
+        print('{} files already archived and unchanged in {}'.format(len(targets), bundle))
+        return []
+
+    local_bundle = os.path.join(directory, '.' + BUNDLE_FILE)  # Hidden, so it is never archived itself
+    make_bundle(results, local_bundle)
+    try:
+        copied = copy_files([(local_bundle, bundle)], journal=os.path.join(directory, JOURNAL_FILE))
+    finally:
+        os.remove(local_bundle)
+    if not failed(copied):
+        for source, target in targets:
+            manifest.record(source, target, checksum(source))
+        manifest.save()
+    return copied
+
+
+def move_results(directory, obs_instruments, bundle=False):
+    """ Move all .log and .txt files to the appropriate directory on /ifs/....
+        This should include the following:
+
+            1. rename.log: contains the results of uniqname
+            2. delivery_form.txt: contains a plain-text version of the delivery
+                form
+            3. certify_errored_files.txt
+            4. delivery.log: contains the results of the actual delivery
+            5. certify_results.jsonl: per-file certify records from check_references.py
+
+        What was copied where is kept in archive_manifest.json in the archived
+        delivery, so running this again only copies missing or changed files.
+        With bundle, the files are archived as one compressed results.zip
+    """
+    # Grab the logs, txts and the JSON Lines certify report
+    results = archive_sources(directory)
+
+    # Grab the delivery info
+    instrument, date_str = parse_directory_name(os.path.basename(os.path.normpath(directory)))
+    print('-'*50)
+    print('\n\t{} DELIVERY\n\t{}'.format(instrument, date_str))
+    print('-'*50)
+
     # Move the files
-    complete_destination = os.path.join(destination, date_dir)  # full path
-    os.mkdir(os.path.join(destination, date_dir))   # make the directory to deposit files
-    for item in results:
-        print('\nMOVING {} TO {}\n'.format(item, complete_destination))
-        shutil.copy(item, complete_destination)
+    complete_destination = archive_destination(directory, obs_instruments)  # full path
+    if not os.path.isdir(complete_destination):
+        os.makedirs(complete_destination)   # make the directory to deposit files
+    manifest = Manifest.load(complete_destination)
+    manifest.source = os.path.abspath(directory)
+    manifest.complete = False
+
+    print('\nMOVING {} FILES TO {}\n'.format(len(results), complete_destination))
+    if bundle:
+        copied = bundle_results(results, complete_destination, manifest, directory)
+    else:
+        targets = [(item, os.path.join(complete_destination, os.path.basename(item))) for item in results]
+        copied = copy_with_manifest(targets, manifest, directory)
+    if failed(copied):
+        raise IOError('{} files could not be copied to {}'.format(len(failed(copied)), complete_destination))
 
     # HST references should go to central store
     if instrument in obs_instruments['hst']:
-        move_hst_references(instrument, directory)
+        move_hst_references(instrument, directory, manifest)
 
+    manifest.complete = True
+    manifest.save()
     print('\n\tFILE MOVES COMPLETED\n')
 
 # ----------------------------------------------------------------------------------------------------------------------
 
 
-def move_hst_references(instrument, directory):
-    """ Move HST reference files to the appropriate ..ref directory on central store
+def hst_reference_targets(instrument, directory):
+    """ (reference file, central store path) for every reference file of an HST delivery
     """
-    print('\n\tMOVING HST REFERENCES TO CENTRAL STORE')
-    central_store_path = '/grp/hst/cdbs/'
+    central_store_path = CENTRAL_STORE
     central_store_names = {'COS': 'lref',
                            'STIS': 'oref',
                            'ACS': 'jref',
@@ -107,19 +204,43 @@ def move_hst_references(instrument, directory):
                            'NICMOS': 'nref'}
 
     # Grab the reference files
-    reference_files = glob.glob(os.path.join(directory, '*fits'))
+    reference_files = sorted(glob.glob(os.path.join(directory, '*fits')))
 
     # Construct the path
     central_store = os.path.join(central_store_path, central_store_names[instrument])
+    return [(ref, os.path.join(central_store, os.path.basename(ref))) for ref in reference_files]
+
+
+def move_hst_references(instrument, directory, manifest=None):
+    """ Move HST reference files to the appropriate ..ref directory on central store.
+        With a manifest, references it records as copied unchanged are skipped
+    """
+    print('\n\tMOVING HST REFERENCES TO CENTRAL STORE')
+    targets = hst_reference_targets(instrument, directory)
+    central_store = os.path.dirname(targets[0][1]) if targets else CENTRAL_STORE
 
     # Move the files
-    for ref in reference_files:
-        print('\nCOPYING {} TO {}'.format(os.path.split(ref)[-1], central_store_names[instrument]))
-        shutil.copy(ref, central_store)
+    print('\nCOPYING {} FILES TO {}'.format(len(targets), central_store))
+    if manifest is None:
+        copied = copy_files(targets, journal=os.path.join(directory, JOURNAL_FILE))
+    else:
+        copied = copy_with_manifest(targets, manifest, directory)
+    if failed(copied):
+        raise IOError('{} files could not be copied to {}'.format(len(failed(copied)), central_store))
 
 # ----------------------------------------------------------------------------------------------------------------------
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Archive the results of the delivery in the current directory')
+    parser.add_argument('--check', help='Only report whether the delivery is fully archived', action='store_true')
+    parser.add_argument('--bundle', help='Archive the results as one compressed {}'.format(BUNDLE_FILE),
+                        action='store_true')
+    options = parser.parse_args()
+
     delivery_directory = os.getcwd()
-    move_results(delivery_directory, instruments)
+    if options.check:
+        archived = is_archived(delivery_directory, instruments)
+        print('{} is {}fully archived'.format(delivery_directory, '' if archived else 'NOT '))
+        raise SystemExit(0 if archived else 1)
+    move_results(delivery_directory, instruments, options.bundle)
@@ -0,0 +1,116 @@
+"""In-memory index of a Pandeia release tree, used to place delivered ETC files and find the files they replace
+Use
+---
+    The instrument's tree is walked once with os.scandir, mapping each file's filetype (its name without the
+    timestamp and extension) to where it lives, so looking up the old version of a delivered file costs no further
+    filesystem access:
+    ::
+        index = PandeiaIndex('/ifs/.../pandeia_jwst_release_1.1dev/nircam')
+        old = index.find('nircam_f070w_trans_20200101120000.fits', subdirectory='filters')
+
+        match = match_subdirectory('miri_lyot_trans_20200101120000.fits', ext_to_dir)
+        if match.ambiguous:
+            ...
+"""
+
+import os
+from collections import namedtuple
+
+SubdirectoryMatch = namedtuple('SubdirectoryMatch', ['subdirectory', 'key', 'candidates', 'ambiguous'])
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def filetype_key(filename):
+    """ Name of a Pandeia file without directory, extension or trailing YYYYMMDDHHMMSS timestamp, e.g.
+        nircam_f070w_trans_20200101120000.fits -> nircam_f070w_trans
+    """
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    pieces = stem.split('_')
+    if len(pieces) > 1 and len(pieces[-1]) == 14 and pieces[-1].isdigit():
+        pieces = pieces[:-1]
+    return '_'.join(pieces)
+
+
+def match_subdirectory(filename, ext_to_dir):
+    """ Find the subdirectory for filename from a table of filename fragment -> subdirectory.
+        The longest fragment found in the name wins. The match is ambiguous when another fragment, not contained in
+        the winning one, also matches and points somewhere else (e.g. '_lyot' and '_trans' in 'miri_lyot_trans')
+    """
+    name = os.path.basename(filename)
+    found = [ext for ext in ext_to_dir if ext in name]
+    if not found:
+        return SubdirectoryMatch(None, None, [], False)
+
+    best = max(found, key=len)
+    conflicting = [ext for ext in found if ext not in best and ext_to_dir[ext] != ext_to_dir[best]]
+    candidates = [best] + conflicting
+    return SubdirectoryMatch(ext_to_dir[best], best, candidates, bool(conflicting))
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class PandeiaIndex(object):
+    """ filetype key -> paths of every file under root, built from one walk of the tree
+    """
+
+    def __init__(self, root):
+        self.root = os.path.normpath(os.path.abspath(root))
+        self.by_key = {}
+        self.n_files = 0
+        if os.path.isdir(self.root):
+            self._walk(self.root)
+
+    def _walk(self, directory):
+        for entry in os.scandir(directory):
+            if entry.is_dir(follow_symlinks=False):
+                self._walk(entry.path)
+            elif entry.is_file():
+                self.add(entry.path)
+
+    def add(self, path):
+        """ Record a file that was just written into the tree
+        """
+        path = os.path.normpath(os.path.abspath(path))
+        paths = self.by_key.setdefault(filetype_key(path), [])
+        if path not in paths:
+            paths.append(path)
+            self.n_files += 1
+
+    def remove(self, path):
+        """ Forget a file that was just deleted from the tree
+        """
+        path = os.path.normpath(os.path.abspath(path))
+        paths = self.by_key.get(filetype_key(path), [])
+        if path in paths:
+            paths.remove(path)
+            self.n_files -= 1
+
+    def directory(self, subdirectory):
+        return os.path.normpath(os.path.join(self.root, subdirectory.strip('/')))
+
+    def matches(self, filename, subdirectory=None):
+        """ Every indexed file with the same filetype as filename, optionally only those in subdirectory
+        """
+        paths = self.by_key.get(filetype_key(filename), [])
+        if subdirectory is None:
+            return list(paths)
+        target = self.directory(subdirectory)
+        return [p for p in paths if os.path.dirname(p) == target]
+
+    def find(self, filename, subdirectory=None):
+        """ The single old file filename replaces, or '' if there is none or more than one
+        """
+        matched = [p for p in self.matches(filename, subdirectory)
+                   if os.path.basename(p) != os.path.basename(filename)]
+        return matched[0] if len(matched) == 1 else ''
+
+    def resolve(self, filename, match, ext_to_dir):
+        """ Settle an ambiguous SubdirectoryMatch by looking for the old file in each candidate subdirectory.
+            Returns the subdirectory if exactly one candidate holds a file of the same filetype, otherwise None
+        """
+        holding = set()
+        for ext in match.candidates:
+            if self.find(filename, ext_to_dir[ext]):
+                holding.add(ext_to_dir[ext])
+        return holding.pop() if len(holding) == 1 else None
@@ -1,7 +1,7 @@
 from astropy.io import fits
 import glob
-import subprocess
 import shlex
+from subprocess_runner import report, run_command
 
 
 # ----------------------------------------------------------------------------------------------------------------------
@@ -35,16 +35,8 @@ def rename_files(list_of_files):
     uniqname = 'crds uniqname --hst -s -a -r --files {}'.format(string_list_of_files)
     rename_cmd = shlex.split(uniqname)
 
-    with subprocess.Popen(rename_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE) as p, \
-            open('rename.log', mode='w+') as log:
-
-        while p.poll() is None:
-            out = p.stderr.readline().decode('utf-8')
-            if out == '' and p.poll() is not None:
-                break
-            if out:
-                print(out)
-                print(out, file=log)  # Document rename results in a log file
+    result = run_command(rename_cmd, log_file='rename.log')  # Document rename results in a log file
+    report([result])
 
     print('DONE. FILES RENAMED')
 
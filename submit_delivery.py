@@ -1,15 +1,30 @@
+import argparse
+import json
 import os
-import smtplib
 from email.mime.text import MIMEText
 from deliver_files import parse_delivery_form
+from delivery_form import FORM_FILE, illegal_characters, load_form
 from astropy.time import Time
 import sys
 import glob
 import shutil
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from copy_engine import JOURNAL_FILE, WORKERS, CopyJournal, copy_files, failed
+from mail_outbox import OUTBOX_DIR, Outbox
 
 # Observatory/Instrument constants
 instruments = {'hst': ['STIS', 'COS', 'ACS', 'WFC3', 'NICMOS', 'WFPC2'],
                'jwst': ['FGS', 'MIRI', 'NIRCAM', 'NIRISS', 'NIRSPEC']}
+STAGING_ROOT = '/grp/redcat/staging/'
+STAGING_AREAS = ['ops', 'test', 'etc']
+MAIL_TIMEOUT = 30  # Seconds to wait for the notification to be sent before leaving it spooled in the outbox
+
+# A delivery to submit: the directory holding its files and delivery_form.txt, and where it goes
+Submission = namedtuple('Submission', ['directory', 'instrument', 'staging', 'resubmit'])
+# The outcome of staging one: staging directory, updated delivery form written there and error, if any
+Staged = namedtuple('Staged', ['submission', 'destination', 'form', 'error'])
 
 # ======================================================================================================================
 
@@ -17,14 +32,10 @@ instruments = {'hst': ['STIS', 'COS', 'ACS', 'WFC3', 'NICMOS', 'WFPC2'],
 def check_illegal_chars(description):
     """Checks string (typically reason for delivery in the delivery form) for characters that would make CRDS error.
     """
-    illegal_chars = [':', '!', '@', '#', '$', '%', '^', '&', '*', '(', ')', '?', '/', '\\', '|', '=', '+', '-', '_',
-                     '`', '~', '[', ']', '{', '}', '"', "'"]
-    valid_str = True
-    for char in illegal_chars:
-        if char in description:
-            print('Illegal character detected: {}'.format(char))
-            valid_str = False
-    return valid_str
+    found = illegal_characters(description)
+    for char in found:
+        print('Illegal character detected: {}'.format(char))
+    return not found
 # ======================================================================================================================
 
 
@@ -47,18 +58,13 @@ def recover_info():
         raise KeyError('INSTRUMENT DOES NOT EXIST\nor a typo may have occurred..\nplease try again')
 
     which_staging = input('Is the deliery going to CRDS OPS, CRDS TEST or ETC (ops/test/etc): ').lower()
-    if which_staging not in ['ops', 'test', 'etc']:
+    if which_staging not in STAGING_AREAS:
         raise TypeError('Must specify if the delivery is going to CRDS OPS, CRDS TEST or ETC')
 
     username = input('Email Username : ').lower().split('@')[0]
 
     subject = input('Subject of delivery request: ')
 
-    description = parse_delivery_form('delivery_form.txt')
-    all_good_chars = check_illegal_chars(description)
-    if not all_good_chars:
-        raise ValueError('Illegal characters in reason for delivery in delivery form, please remove and rerun tool.')
-
     # Today's date for constructing the delivery directory of INSTRUMENT_YYYY_MM_DD
     today = Time.now().datetime
 
@@ -67,14 +73,17 @@ def recover_info():
 # ======================================================================================================================
 
 
-def send_email(email_username, subject):
-    """Constructs the email to be sent to the redcat team upon submission of the files to be delivered
+def send_email(email_username, subject, form=FORM_FILE, text=None, outbox=None):
+    """Constructs the email to be sent to the redcat team upon submission of the files to be delivered. The body is the
+    updated delivery form, or text if given. The email is spooled in the outbox; without a running outbox it is sent
+    right away if the mail relay answers and otherwise left for the next run. Returns the spooled message path
     """
 
     # Check that the delivery form exists
     try:
-        with open('temp.txt', encoding='utf-8') as df:
-            message = MIMEText(df.read())
+        if text is None:
+            text = load_form(form).text()
+        message = MIMEText(text)
 
     except OSError:
         print('\nMissing delivery form\n\tPlease include the delivery form with the reference files to be submitted')
@@ -88,10 +97,15 @@ def send_email(email_username, subject):
     message['To'] = 'redcat@stsci.edu'
     message['CC'] = deliverer
 
-    # Send it!
-    s = smtplib.SMTP('smtp.stsci.edu')
-    s.send_message(message)
-    s.quit()
+    # Send it! (or leave it spooled if the mail relay is down)
+    if outbox is not None:
+        return outbox.queue(message)
+    outbox = Outbox()
+    path = outbox.queue(message)
+    result = outbox.flush_all()
+    if result.error:
+        print('\nMail relay unavailable ({}), the email is spooled in {}'.format(result.error, OUTBOX_DIR))
+    return path
 
 # ======================================================================================================================
 
@@ -110,39 +124,38 @@ def date_to_string(date):
 
 
 def update_delivery_form(path_to_delivery_form, files_being_delivered, file_destination):
-    """Update the delivery form to reflect the location and names of the files being delivered
+    """Write the delivery form into file_destination with the location and names of the files being delivered added
+    to field 16. Returns the path of the updated form
     """
-    form_path = os.path.split(path_to_delivery_form)[0]
-    temp_file = os.path.join(form_path, 'temp.txt')
+    form = load_form(path_to_delivery_form).copy()
+    form.insert_lines('16', [file_destination] + [os.path.split(f)[-1] for f in files_being_delivered])
+
+    updated = form.write(os.path.join(file_destination, FORM_FILE))
+    os.chmod(updated, 0o666)
+    return updated
 
-    with open(temp_file, mode='w+', encoding='utf-8') as out, open(path_to_delivery_form, encoding='utf-8') as old:
-        for line in old:
-            if "16. Disk location and name of files:" in line:
-                f_list = '{}\n'.format(file_destination)
-                for f in files_being_delivered:
-                    name = os.path.split(f)[-1]
-                    f_list += '{}\n'.format(name)
+# ======================================================================================================================
 
-                line += f_list
 
-            out.write(line)
+def first_staging_name(date, instrument):
+    """Name of the first staging directory of the day for instrument
+    """
+    return '{}_{}_{}_{}_0'.format(instrument, date.year, date_to_string(date.month), date_to_string(date.day))
 
-    return temp_file
 
-# ======================================================================================================================
+def has_pending_delivery(staging_path, date, instrument):
+    """True if a delivery of instrument staged on date is in the staging area, for a resubmission to replace
+    """
+    return os.path.isdir(os.path.join(STAGING_ROOT, staging_path, first_staging_name(date, instrument)))
 
 
 def create_staging_directory(staging_path, date, instrument, resubmission):
     """ Create the path to the staging directory for the delivery
     """
-    staging_directory = '/grp/redcat/staging/'
+    staging_directory = STAGING_ROOT
     staging_directory += '{}/'.format(staging_path)
 
-    year = str(date.year)
-    month = date_to_string(date.month)
-    day = date_to_string(date.day)
-
-    directory_name = '{}_{}_{}_{}_0'.format(instrument, year, month, day)
+    directory_name = first_staging_name(date, instrument)
 
     # Check to see if the destination alreading exists in the staging area
     pending_deliveries = os.listdir(staging_directory)
@@ -175,45 +188,250 @@ def create_staging_directory(staging_path, date, instrument, resubmission):
 # ======================================================================================================================
 
 
-def send_to_staging(delivery_instrument, date, staging_location, is_resubmit):
-    """Given the instrument string and the current date, create a delivery directory in /grp/redcat/staging/[ops/test]/
+def delivery_files(directory):
+    """The reference files (FITS, JSON and asdf) in a delivery directory
     """
-    # Get the files
-    current_dr = os.getcwd()
     files_to_deliver = []
     for ftype in ['*fits', '*json', '*asdf']:
-        files_to_deliver += glob.glob(os.path.join(current_dr, ftype))
+        files_to_deliver += glob.glob(os.path.join(directory, ftype))
+    return files_to_deliver
+
+# ======================================================================================================================
 
-    # Create the delivery directory
-    destination = create_staging_directory(staging_location, date, delivery_instrument, is_resubmit)
 
-    os.mkdir(destination)
-    os.chmod(destination, 0o777)
+def interrupted_staging(directory, staging_location):
+    """The staging directory an interrupted transfer of directory was copying into, according to the copy journal in
+    directory, or None. It only counts while it has no delivery form, which is written once every file is there
+    """
+    journal = CopyJournal(os.path.join(directory, JOURNAL_FILE))
+    area = os.path.normpath(os.path.join(STAGING_ROOT, staging_location))
+    for _, target in journal.completed:
+        destination = os.path.dirname(target)
+        if (os.path.dirname(destination) == area and os.path.isdir(destination)
+                and not os.path.exists(os.path.join(destination, FORM_FILE))):
+            return destination
+    return None
+
+
+def prepare_staging(delivery_instrument, date, staging_location, is_resubmit, directory):
+    """Create the delivery directory in the staging area for the files in directory, or reuse the one an
+    interrupted transfer of directory left unfinished. Returns the staging directory and the files to copy there
+    """
+    files_to_deliver = delivery_files(directory)
+
+    destination = interrupted_staging(directory, staging_location)
+    if destination is not None:
+        print('\nFinishing the interrupted transfer to {}'.format(destination))
+    else:
+        # Create the delivery directory
+        destination = create_staging_directory(staging_location, date, delivery_instrument, is_resubmit)
+
+        os.mkdir(destination)
+        os.chmod(destination, 0o777)
 
     print('\nItems to be moved to staging area:\n')
     for f in files_to_deliver:
         print('\t{}'.format(f))
 
-    print('\nUpdating delivery form... adding destination and filenames')
-    delivery_form = os.path.join(current_dr, 'delivery_form.txt')
-    updated = update_delivery_form(delivery_form, files_to_deliver, destination)
-    files_to_deliver.append(updated)
+    return destination, files_to_deliver
+
+# ======================================================================================================================
 
+
+def copy_to_staging(files_to_deliver, destination, directory, workers=WORKERS):
+    """Copy the files prepared by prepare_staging into the staging directory, then the updated delivery form. The form
+    is written last: a staging directory without one is still being staged (see delivery_queue.py)
+    """
     print('\nMoving files...')
-    for i, f in enumerate(files_to_deliver):
-        print('{} out of {}'.format(i+1, len(files_to_deliver)))
+    # Several files are copied at once, each verified against its checksum and made world writable before it is
+    # renamed into the staging area. The journal lets an interrupted transfer pick up where it stopped: the next run
+    # finds the unfinished staging directory through it (see interrupted_staging) and copies only what is missing
+    jobs = [(f, destination) for f in files_to_deliver]
+    copied = copy_files(jobs, workers, journal=os.path.join(directory, JOURNAL_FILE), mode=0o777, progress=True)
+    if failed(copied):
+        raise IOError('{} files could not be copied to {}'.format(len(failed(copied)), destination))
+
+    print('\nUpdating delivery form... adding destination and filenames')
+    update_delivery_form(os.path.join(directory, FORM_FILE), files_to_deliver, destination)
 
-        if 'temp.txt' in f:
-            shutil.copy(f, os.path.join(destination, 'delivery_form.txt'))
+    print('\nDone!')
+
+# ======================================================================================================================
+
+
+def send_to_staging(delivery_instrument, date, staging_location, is_resubmit, directory=None):
+    """Given the instrument string and the current date, create a delivery directory in /grp/redcat/staging/[ops/test]/
+    and copy the delivery in directory (default: the current directory) there. Returns the staging directory
+    """
+    directory = directory or os.getcwd()
+    destination, files_to_deliver = prepare_staging(delivery_instrument, date, staging_location, is_resubmit,
+                                                    directory)
+    copy_to_staging(files_to_deliver, destination, directory)
+    return destination
+
+# ======================================================================================================================
+
+
+def validate_submission(submission, date):
+    """Everything that would stop a submission from being staged on date, as a list of messages (empty if it is
+    fine)
+    """
+    problems = []
+    name = submission.directory
+    known_instrument = submission.instrument in instruments['hst'] or submission.instrument in instruments['jwst']
+    if not known_instrument:
+        problems.append('{}: instrument {} does not exist'.format(name, submission.instrument))
+    if submission.staging not in STAGING_AREAS:
+        problems.append('{}: staging must be one of {}, not {}'.format(name, '/'.join(STAGING_AREAS),
+                                                                        submission.staging))
+    elif (submission.resubmit and known_instrument
+          and not has_pending_delivery(submission.staging, date, submission.instrument)):
+        problems.append('{}: resubmission, but no {} delivery from {} is waiting in {}{} to replace'.format(
+            name, submission.instrument, date.strftime('%Y-%m-%d'), STAGING_ROOT, submission.staging))
+    if not os.path.isdir(submission.directory):
+        problems.append('{}: no such directory'.format(name))
+        return problems
+
+    if not delivery_files(submission.directory):
+        problems.append('{}: no FITS, JSON or asdf files to deliver'.format(name))
+    form = os.path.join(submission.directory, FORM_FILE)
+    if not os.path.isfile(form):
+        problems.append('{}: missing delivery form ({})'.format(name, FORM_FILE))
+    elif not check_illegal_chars(parse_delivery_form(form)):
+        problems.append('{}: illegal characters in reason for delivery in delivery form'.format(name))
+    return problems
+
+
+def validate_submissions(submissions, date):
+    """Check every submission before any is staged on date. Raises ValueError listing all the problems found
+    """
+    problems = []
+    seen = set()
+    resubmitted = {}  # (instrument, staging) -> directory of the resubmission replacing that pending delivery
+    for submission in submissions:
+        problems += validate_submission(submission, date)
+        directory = os.path.abspath(submission.directory)
+        if directory in seen:
+            problems.append('{}: submitted more than once'.format(submission.directory))
+        seen.add(directory)
+        if submission.resubmit:
+            key = (submission.instrument, submission.staging)
+            if key in resubmitted:
+                # The second resubmission would remove the staging directory the first one has just filled
+                problems.append('{}: {} already resubmits the {} delivery in {}{}'.format(
+                    submission.directory, resubmitted[key], submission.instrument, STAGING_ROOT, submission.staging))
+            resubmitted.setdefault(key, submission.directory)
+    if problems:
+        raise ValueError('Nothing was submitted:\n\t' + '\n\t'.join(problems))
+
+
+def stage_submissions(submissions, date, workers=WORKERS):
+    """Stage several submissions, copying them concurrently. Returns a Staged per submission, in order; a
+    submission that could not be staged has its error set and does not stop the others
+    """
+    # Staging directories are numbered after the ones already there, so they are created one at a time
+    prepared = []
+    for submission in submissions:
+        try:
+            destination, files_to_deliver = prepare_staging(submission.instrument, date, submission.staging,
+                                                            submission.resubmit, submission.directory)
+        except (OSError, IOError) as e:
+            prepared.append((submission, None, [], str(e)))
         else:
-            shutil.copy(f, destination)
+            prepared.append((submission, destination, files_to_deliver, None))
 
-        filename = os.path.split(f)[-1]  # isolate the filenames for use below
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = [pool.submit(copy_to_staging, files_to_deliver, destination, submission.directory)
+                   if error is None else None for submission, destination, files_to_deliver, error in prepared]
 
-        if 'temp.txt' not in f:
-            os.chmod(os.path.join(destination, filename), 0o777)  # os.chmod can only be used on one file at a time
+    staged = []
+    for (submission, destination, files_to_deliver, error), future in zip(prepared, futures):
+        if future is not None and future.exception() is not None:
+            error = str(future.exception())
+        form = os.path.join(destination, FORM_FILE) if destination else None
+        staged.append(Staged(submission, destination, form if form and os.path.exists(form) else None, error))
+    return staged
 
-    print('\nDone!')
+
+def report(staged):
+    """One line per submission: where it was staged, or why it failed
+    """
+    lines = []
+    for item in staged:
+        if item.error:
+            lines.append('FAILED  {} ({}) from {}: {}'.format(item.submission.instrument, item.submission.staging,
+                                                              item.submission.directory, item.error))
+        else:
+            lines.append('STAGED  {} ({}) in {}'.format(item.submission.instrument, item.submission.staging,
+                                                       item.destination))
+    return lines
+
+
+def summary(staged):
+    """Text of the one notification sent for a batch: where each delivery was staged, then each delivery form
+    """
+    lines = report(staged)
+    for item in staged:
+        if item.form and not item.error:
+            lines += ['', '=' * 80, item.destination, '=' * 80, load_form(item.form).text()]
+    return '\n'.join(lines) + '\n'
+
+
+def submit(submissions, date, username, subject, workers=WORKERS):
+    """Validate, stage and announce submissions: one email for all of them. Returns the Staged submissions
+    """
+    validate_submissions(submissions, date)
+
+    # The outbox sends in the background, starting with anything earlier runs could not send
+    outbox = Outbox().start()
+    staged = stage_submissions(submissions, date, workers)
+
+    single = staged[0] if len(staged) == 1 else None
+    if single is not None and not single.error and single.form:
+        # A single delivery that was staged is announced with its form, as always
+        send_email(username, subject, single.form, outbox=outbox)
+    elif any(item.destination for item in staged):
+        # Several deliveries, or a single one that failed part way: one summary of where each went or why it failed
+        send_email(username, subject, text=summary(staged), outbox=outbox)
+
+    unsent = outbox.stop(MAIL_TIMEOUT)
+    if unsent:
+        print('\n{} emails could not be sent yet and are spooled in {}'.format(unsent, OUTBOX_DIR))
+        print('\tThey go out with the next submission, or run: python mail_outbox.py flush')
+    return staged
+
+# ======================================================================================================================
+
+
+def read_batch(manifest):
+    """The submissions described by a batch manifest, with the username and subject of the batch. Directories are
+    relative to the manifest
+    """
+    with open(manifest) as f:
+        batch = json.load(f)
+
+    base = os.path.dirname(os.path.abspath(manifest))
+    submissions = []
+    for delivery in batch['deliveries']:
+        submissions.append(Submission(os.path.join(base, delivery['directory']),
+                                      delivery['instrument'].upper(),
+                                      delivery.get('staging', batch.get('staging', '')).lower(),
+                                      delivery.get('resubmit', batch.get('resubmit', False))))
+    return submissions, batch['username'].lower().split('@')[0], batch['subject']
+
+
+def submit_batch(manifest, workers=WORKERS):
+    """Submit every delivery described by a batch manifest
+    """
+    submissions, username, subject = read_batch(manifest)
+    inside = [s.directory for s in submissions
+              if os.path.abspath(manifest) in [os.path.abspath(f) for f in delivery_files(s.directory)]]
+    if inside:
+        raise ValueError('The batch manifest would be delivered with {}, move it out of the delivery'.format(inside[0]))
+    staged = submit(submissions, Time.now().datetime, username, subject, workers)
+
+    print('\n' + '\n'.join(report(staged)))
+    return staged
 
 # ======================================================================================================================
 
@@ -223,14 +441,23 @@ def submit_to_redcat():
     """
     resubmit_stat, instrument, staging, username, today, subject = recover_info()
 
-    send_to_staging(instrument, today, staging, resubmit_stat)
-
-    send_email(username, subject)
-
-    os.remove('temp.txt')
+    submission = Submission(os.getcwd(), instrument, staging, resubmit_stat)
+    staged = submit([submission], today, username, subject)
+    if staged[0].error:
+        raise IOError(staged[0].error)
 
 # ======================================================================================================================
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Submit reference files to the ReDCaT Team')
+    parser.add_argument('--batch', type=str, help='JSON manifest of several deliveries to submit without questions',
+                        action='store', default=None)
+    parser.add_argument('--workers', type=int, help='Deliveries copied at once in batch mode', action='store',
+                        default=WORKERS)
+    options = parser.parse_args()
+
+    if options.batch:
+        results = submit_batch(options.batch, options.workers)
+        sys.exit(1 if any(item.error for item in results) else 0)
     submit_to_redcat()
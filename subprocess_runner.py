@@ -0,0 +1,127 @@
+"""Shared runner for the crds command line tools used by the delivery scripts
+Use
+---
+    Runs one or more commands with asyncio, streaming stdout and stderr at the same time to the console and to a
+    log file, and records the exit code and wall time of each:
+    ::
+        result = run_command(['crds', 'uniqname', ...], log_file='rename.log')
+
+        results = run_commands([Command(['crds', 'certify', ...], 'shard_0.txt', label='[shard 1/2]'),
+                                Command(['crds', 'certify', ...], 'shard_1.txt', label='[shard 2/2]')])
+"""
+
+import asyncio
+import time
+from collections import namedtuple
+
+# Largest chunk read from a pipe at once, and the longest partial line held in memory before it is flushed
+READ_SIZE = 64 * 1024
+MAX_LINE = 1024 * 1024
+
+CommandResult = namedtuple('CommandResult', ['args', 'returncode', 'elapsed', 'log_file', 'label'])
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class Command(object):
+    """ A command to run: the argument list, where to log its output, a console prefix, an optional environment
+        (None inherits os.environ) and an optional on_line(line) callback called for every line of output
+    """
+
+    def __init__(self, args, log_file=None, label='', env=None, on_line=None):
+        self.args = args
+        self.log_file = log_file
+        self.label = label
+        self.env = env
+        self.on_line = on_line
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def _emit(line, command, prefix, log, echo):
+    """ Send one decoded line to the console, the log and the command's callback
+    """
+    if echo:
+        print('{}{}'.format(prefix, line))
+    if log is not None:
+        print(line, file=log)
+    if command.on_line is not None:
+        command.on_line(line)
+
+
+async def _pump(stream, command, prefix, log, echo):
+    """ Copy a subprocess pipe line by line until it closes, never holding more than MAX_LINE bytes
+    """
+    pending = b''
+    while True:
+        chunk = await stream.read(READ_SIZE)
+        if not chunk:
+            break
+        pending += chunk
+        *lines, pending = pending.split(b'\n')
+        for line in lines:
+            _emit(line.decode('utf-8', errors='replace').rstrip('\r'), command, prefix, log, echo)
+        if len(pending) > MAX_LINE:
+            _emit(pending.decode('utf-8', errors='replace'), command, prefix, log, echo)
+            pending = b''
+    if pending:
+        _emit(pending.decode('utf-8', errors='replace'), command, prefix, log, echo)
+
+
+async def _run(command, semaphore, echo):
+    """ Run a single command once a slot in the semaphore is free
+    """
+    async with semaphore:
+        prefix = '{} '.format(command.label) if command.label else ''
+        log = open(command.log_file, mode='w+') if command.log_file else None
+        start = time.time()
+        try:
+            process = await asyncio.create_subprocess_exec(*command.args,
+                                                           stdout=asyncio.subprocess.PIPE,
+                                                           stderr=asyncio.subprocess.PIPE,
+                                                           env=command.env,
+                                                           limit=READ_SIZE)
+            # Drain both pipes together; reading only one lets the other fill up and stall the process
+            await asyncio.gather(_pump(process.stdout, command, prefix, log, echo),
+                                 _pump(process.stderr, command, prefix, log, echo))
+            returncode = await process.wait()
+        finally:
+            if log is not None:
+                log.close()
+
+        return CommandResult(command.args, returncode, time.time() - start, command.log_file, command.label)
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def run_commands(commands, max_concurrent=None, echo=True):
+    """ Run several commands at once (at most max_concurrent at a time, default all of them) and return a list of
+        CommandResult in the same order as commands
+    """
+    commands = list(commands)
+    if not commands:
+        return []
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)  # Needed for the child watcher on older Pythons
+    try:
+        semaphore = asyncio.Semaphore(max_concurrent or len(commands))
+        return loop.run_until_complete(asyncio.gather(*[_run(c, semaphore, echo) for c in commands]))
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+def run_command(args, log_file=None, label='', env=None, echo=True):
+    """ Run a single command, streaming its output to the console and log_file. Returns a CommandResult
+    """
+    return run_commands([Command(args, log_file, label, env)], echo=echo)[0]
+
+
+def report(results):
+    """ Print the exit code and wall time of each finished command
+    """
+    for result in results:
+        status = 'OK' if result.returncode == 0 else 'EXIT CODE {}'.format(result.returncode)
+        print('{}{} finished in {:.1f} s: {}'.format('{} '.format(result.label) if result.label else '',
+                                                     result.args[0] if result.args else '', result.elapsed, status))
@@ -0,0 +1,28 @@
+"""Shared fixtures for the tests of the delivery tools. The tools are top-level modules, so the repository root is
+put on sys.path
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+from astropy.io import fits
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def fits_file(tmp_path):
+    """ Factory for small FITS files: a primary HDU with an image and one binary table extension
+    """
+    def make(name='ref.fits', checksum=True, header=None):
+        primary = fits.PrimaryHDU(np.arange(100, dtype='>i4').reshape(10, 10))
+        primary.header['INSTRUME'] = 'WFC3'
+        for keyword, value in (header or {}).items():
+            primary.header[keyword] = value
+        table = fits.BinTableHDU.from_columns([fits.Column(name='x', format='E', array=np.arange(5.0))])
+        path = str(tmp_path / name)
+        fits.HDUList([primary, table]).writeto(path, checksum=checksum)
+        return path
+    return make
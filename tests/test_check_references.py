@@ -0,0 +1,58 @@
+"""Observatory detection of check_references.py from the INSTRUME keyword of the delivered files
+"""
+
+import argparse
+import threading
+
+import pytest
+
+import check_references
+
+
+@pytest.fixture
+def scan(tmp_path, monkeypatch):
+    """ get_observatory run from a directory whose name does not name an instrument, without -o
+    """
+    monkeypatch.setattr(check_references, 'options', argparse.Namespace(o=None), raising=False)
+    monkeypatch.chdir(tmp_path)
+    return check_references.get_observatory
+
+
+def test_more_files_than_workers(scan, fits_file):
+    files = [fits_file('ref_{}.fits'.format(i), header={'SERIAL': i}) for i in range(20)]
+
+    assert scan(files, workers=2) == 'hst'
+
+
+def test_option_overrides_headers(scan, fits_file, monkeypatch):
+    monkeypatch.setattr(check_references.options, 'o', 'JWST')
+
+    assert scan([fits_file()]) == 'jwst'
+
+
+def test_disagreeing_files_report_first_file(scan, fits_file, monkeypatch, capsys):
+    jwst = fits_file('nircam.fits', header={'INSTRUME': 'NIRCAM'})
+    hst = fits_file('wfc3.fits')
+
+    # Both headers are read before either result is handled, so neither read can be cancelled by the other
+    barrier = threading.Barrier(2)
+    read_instrument = check_references.read_instrument
+
+    def read_together(f):
+        barrier.wait(timeout=10)
+        return read_instrument(f)
+
+    monkeypatch.setattr(check_references, 'read_instrument', read_together)
+
+    assert scan([hst, jwst], workers=2) == 'hst'
+    output = capsys.readouterr().out
+    assert 'disagree' in output
+    assert 'jwst: {}'.format(jwst) in output and 'hst: {}'.format(hst) in output
+
+
+def test_unknown_instrument_is_reported(scan, fits_file, capsys):
+    path = fits_file(header={'INSTRUME': 'WFPC3'})
+
+    with pytest.raises(ValueError):
+        scan([path])
+    assert 'cannot match WFPC3' in capsys.readouterr().out
@@ -0,0 +1,99 @@
+import hashlib
+import os
+
+import copy_engine
+from copy_engine import CopyJournal, copy_files, failed
+
+
+def make_sources(directory, n=4):
+    directory.mkdir()
+    paths = []
+    for i in range(n):
+        path = directory / 'ref{}.fits'.format(i)
+        path.write_bytes(os.urandom(1000 + i))
+        paths.append(str(path))
+    return paths
+
+
+def test_copies_are_verified_and_in_job_order(tmp_path):
+    sources = make_sources(tmp_path / 'src')
+    target = tmp_path / 'dst'
+    target.mkdir()
+
+    results = copy_files([(s, str(target)) for s in sources], workers=3, mode=0o640)
+
+    assert not failed(results)
+    assert [os.path.basename(r.target) for r in results] == [os.path.basename(s) for s in sources]
+    for source, result in zip(sources, results):
+        with open(source, 'rb') as f:
+            assert result.checksum == hashlib.sha256(f.read()).hexdigest()
+        assert os.stat(result.target).st_mode & 0o777 == 0o640
+    assert not any(name.endswith('.part') for name in os.listdir(str(target)))
+
+
+def test_interrupted_batch_resumes_from_the_journal(tmp_path, monkeypatch):
+    sources = make_sources(tmp_path / 'src')
+    target = tmp_path / 'dst'
+    target.mkdir()
+    journal = str(tmp_path / 'src' / '.copy_journal.jsonl')
+    jobs = [(s, str(target)) for s in sources]
+
+    # The third file fails, as if the transfer had been cut off
+    real_copy = copy_engine.verified_copy
+
+    def flaky(source, destination, mode=None):
+        if source.endswith('ref2.fits'):
+            raise IOError('connection lost')
+        return real_copy(source, destination, mode)
+    monkeypatch.setattr(copy_engine, 'verified_copy', flaky)
+    first = copy_files(jobs, workers=1, journal=journal)
+    assert [os.path.basename(r.source) for r in failed(first)] == ['ref2.fits']
+    assert os.path.exists(journal)
+
+    monkeypatch.setattr(copy_engine, 'verified_copy', real_copy)
+    second = copy_files(jobs, workers=1, journal=journal)
+    assert not failed(second)
+    assert [r.skipped for r in second] == [True, True, False, True]
+    assert not os.path.exists(journal)
+
+
+def test_journal_does_not_trust_a_changed_source(tmp_path):
+    sources = make_sources(tmp_path / 'src', 1)
+    target = str(tmp_path / 'ref0.fits')
+    journal = CopyJournal(str(tmp_path / 'journal.jsonl'))
+    copy_engine.verified_copy(sources[0], target)
+    journal.record(os.path.abspath(sources[0]), target, 'digest')
+
+    reloaded = CopyJournal(str(tmp_path / 'journal.jsonl'))
+    assert reloaded.done(os.path.abspath(sources[0]), target) is not None
+
+    with open(sources[0], 'ab') as f:
+        f.write(b'more')
+    assert reloaded.done(os.path.abspath(sources[0]), target) is None
+
+
+def test_journal_does_not_trust_a_missing_target(tmp_path):
+    sources = make_sources(tmp_path / 'src', 1)
+    target = str(tmp_path / 'ref0.fits')
+    journal = CopyJournal(str(tmp_path / 'journal.jsonl'))
+    copy_engine.verified_copy(sources[0], target)
+    journal.record(os.path.abspath(sources[0]), target, 'digest')
+    os.remove(target)
+    assert CopyJournal(str(tmp_path / 'journal.jsonl')).done(os.path.abspath(sources[0]), target) is None
+
+
+def test_checksum_mismatch_leaves_nothing_behind(tmp_path, monkeypatch):
+    sources = make_sources(tmp_path / 'src', 1)
+    target = tmp_path / 'dst'
+    target.mkdir()
+
+    def truncating_copy(source, partial):
+        with open(partial, 'wb'):
+            pass
+        return copy_engine.checksum(source)
+    monkeypatch.setattr(copy_engine, 'local_clone', lambda source, partial: False)
+    monkeypatch.setattr(copy_engine, 'stream_copy', truncating_copy)
+
+    results = copy_files([(sources[0], str(target))])
+    assert failed(results) and 'Checksum mismatch' in results[0].error
+    assert os.listdir(str(target)) == []
@@ -0,0 +1,88 @@
+import os
+
+import pytest
+
+from delivery_form import BLANK_FORM, DeliveryForm, clean, illegal_characters, load_form, parse_fields
+
+
+@pytest.fixture
+def filled(tmp_path):
+    """ The blank form filled in the ways deliverers fill it in
+    """
+    with open(BLANK_FORM, encoding='utf-8') as f:
+        text = f.read()
+    text = text.replace('1. Name of deliverer:', '1. Name of deliverer: Jane Doe')
+    text = text.replace('a. (other e-mail addresses)', 'a. (other e-mail addresses) jdoe@stsci.edu')
+    text = text.replace('3. Instrument:', '3. Instrument: WFC3')
+    text = text.replace('15. Additional Considerations:', '15. Additional Considerations:\n1. first point\n2. second')
+    text = text.replace('17. Reason for delivery:', '17. Reason for delivery: New darks\nfor cycle 28')
+    path = tmp_path / 'delivery_form.txt'
+    path.write_text(text, encoding='utf-8')
+    return str(path)
+
+
+def test_answers_by_number_and_name(filled):
+    form = load_form(filled)
+    assert form['1'] == 'Jane Doe'
+    assert form['deliverer'] == 'Jane Doe'
+    assert form['1a'] == 'jdoe@stsci.edu'
+    assert form['instrument'] == 'WFC3'
+    assert form['2'] == ''
+    assert form['99'] == ''
+
+
+def test_numbered_lists_stay_inside_their_field(filled):
+    form = load_form(filled)
+    assert form['15'] == '1. first point\n2. second'
+    assert form['16'] == ''
+    assert form.reason == 'New darks for cycle 28'
+
+
+def test_unedited_form_round_trips(filled, tmp_path):
+    form = load_form(filled)
+    copy = str(tmp_path / 'copy.txt')
+    form.copy().write(copy)
+    with open(filled) as a, open(copy) as b:
+        assert a.read() == b.read()
+
+
+def test_insert_lines_below_the_question(filled, tmp_path):
+    form = load_form(filled).copy()
+    form.insert_lines('16', ['/grp/redcat/staging/ops/WFC3_2020_01_01_0', 'abc1234_drk.fits'])
+    written = form.write(str(tmp_path / 'updated.txt'))
+
+    updated = DeliveryForm.read(written)
+    assert updated.locations == ['/grp/redcat/staging/ops/WFC3_2020_01_01_0', 'abc1234_drk.fits']
+    assert updated.reason == 'New darks for cycle 28'
+    assert updated['15'] == '1. first point\n2. second'
+
+
+def test_copy_leaves_the_shared_form_alone(filled):
+    shared = load_form(filled)
+    shared.copy().insert_lines('16', ['somewhere'])
+    assert load_form(filled).locations == []
+
+
+def test_load_form_reparses_a_changed_file(filled):
+    first = load_form(filled)
+    assert load_form(filled) is first
+
+    form = first.copy()
+    form.insert_lines('16', ['somewhere'])
+    form.write()
+    os.utime(filled, ns=(0, 1))  # Different mtime even on coarse clocks
+    assert load_form(filled) is not first
+    assert load_form(filled).locations == ['somewhere']
+
+
+def test_fields_without_the_blank_form():
+    preamble, fields = parse_fields('Header\n1. Name: A\n2. Date: today\nb. not a subfield\n')
+    assert preamble == ['Header\n']
+    assert list(fields) == ['1', '2']
+    assert fields['2'][-1] == 'b. not a subfield\n'
+
+
+def test_illegal_characters():
+    assert illegal_characters('New darks: cycle 28 (v2)') == [':', '(', ')']
+    assert clean('a_b-c') == 'a b c'
+    assert DeliveryForm('1. Name of deliverer: J. O\'Neil-Smith\n').deliverer == 'J. O Neil Smith'
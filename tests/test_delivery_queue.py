@@ -0,0 +1,113 @@
+"""Which staged deliveries delivery_queue.py picks up, and the order and isolation of their submissions
+"""
+
+import os
+import threading
+import time
+
+import delivery_queue
+from subprocess_runner import CommandResult
+
+
+def stage(root, name, area='ops', checked=True, renamed=True, priority=None):
+    path = os.path.join(str(root), area, name)
+    os.makedirs(path)
+    open(os.path.join(path, delivery_queue.FORM_FILE), 'w').close()
+    if checked:
+        open(os.path.join(path, delivery_queue.CHECKED_FILE), 'w').close()
+    if renamed:
+        open(os.path.join(path, delivery_queue.RENAME_LOG), 'w').close()
+    if priority is not None:
+        with open(os.path.join(path, delivery_queue.PRIORITY_FILE), 'w') as f:
+            f.write(str(priority))
+    return path
+
+
+def names(queue):
+    return [os.path.basename(delivery.path) for delivery in queue]
+
+
+def test_only_checked_deliveries_are_queued(tmp_path, capsys):
+    stage(tmp_path, 'WFC3_2020_01_01_0')
+    stage(tmp_path, 'WFC3_2020_01_01_1', checked=False)
+    stage(tmp_path, 'WFC3_2020_01_01_2', renamed=False)
+    stage(tmp_path, 'NIRCAM_2020_01_01_0', renamed=False)  # JWST files are not renamed
+    submitted = stage(tmp_path, 'ACS_2020_01_01_0')
+    open(os.path.join(submitted, delivery_queue.LOG_FILE), 'w').close()
+
+    queue = delivery_queue.find_queue(str(tmp_path), ['ops'])
+
+    assert sorted(names(queue)) == ['NIRCAM_2020_01_01_0', 'WFC3_2020_01_01_0']
+    output = capsys.readouterr().out
+    assert 'WFC3_2020_01_01_1: not checked' in output
+    assert 'WFC3_2020_01_01_2: checked but not renamed' in output
+
+
+def test_priority_then_age(tmp_path):
+    old = stage(tmp_path, 'WFC3_2020_01_01_0')
+    os.utime(os.path.join(old, delivery_queue.FORM_FILE), (time.time() - 60, time.time() - 60))
+    stage(tmp_path, 'WFC3_2020_01_01_1')
+    stage(tmp_path, 'ACS_2020_01_01_0', priority=5)
+
+    queue = delivery_queue.find_queue(str(tmp_path), ['ops'])
+
+    assert names(queue) == ['ACS_2020_01_01_0', 'WFC3_2020_01_01_0', 'WFC3_2020_01_01_1']
+
+
+def queued(name, priority=0, area='ops'):
+    return delivery_queue.Queued('/staging/{}/{}'.format(area, name), area, name.split('_')[0], priority, 0.0)
+
+
+def test_one_slot_follows_priority_across_servers(monkeypatch):
+    started = []
+
+    def submit(delivery):
+        started.append(os.path.basename(delivery.path))
+        return CommandResult(['crds'], 0, 0.0, None, delivery.path)
+
+    monkeypatch.setattr(delivery_queue, 'submit', submit)
+    queue = [queued('WFC3_2020_01_01_0', 9), queued('NIRCAM_2020_01_01_0', 5), queued('WFC3_2020_01_01_1', 1)]
+
+    results = delivery_queue.run_queue(queue, max_concurrent=1)
+
+    assert started == ['WFC3_2020_01_01_0', 'NIRCAM_2020_01_01_0', 'WFC3_2020_01_01_1']
+    assert [r.label for r in results] == [d.path for d in queue]
+
+
+def test_one_delivery_at_a_time_per_server(monkeypatch):
+    lock = threading.Lock()
+    running = {}
+    overlap = []
+
+    def submit(delivery):
+        key = delivery_queue.server(delivery)
+        with lock:
+            running[key] = running.get(key, 0) + 1
+            overlap.append(running[key])
+        time.sleep(0.02)
+        with lock:
+            running[key] -= 1
+        return CommandResult(['crds'], 0, 0.02, None, delivery.path)
+
+    monkeypatch.setattr(delivery_queue, 'submit', submit)
+    queue = [queued('WFC3_2020_01_01_{}'.format(i)) for i in range(3)] + [queued('NIRCAM_2020_01_01_0')]
+
+    results = delivery_queue.run_queue(queue, max_concurrent=4)
+
+    assert max(overlap) == 1
+    assert len(results) == 4
+
+
+def test_failed_submission_does_not_stop_the_queue(monkeypatch):
+    def submit(delivery):
+        if delivery.path.endswith('_0'):
+            raise ValueError('unreadable delivery form')
+        return CommandResult(['crds'], 0, 0.0, None, delivery.path)
+
+    monkeypatch.setattr(delivery_queue, 'submit', submit)
+    queue = [queued('WFC3_2020_01_01_0'), queued('WFC3_2020_01_01_1')]
+
+    results = delivery_queue.run_queue(queue, max_concurrent=2)
+
+    assert [r.returncode for r in results] == [-1, 0]
+    assert results[1].label == queue[1].path
@@ -0,0 +1,145 @@
+import json
+import os
+
+import pytest
+
+import etc_plan
+from etc_plan import RETIRED_SUFFIX, Journal, apply_operation, execute, operation, resume, rollback
+from file_sync import REUSED, HashIndex
+
+
+@pytest.fixture(autouse=True)
+def hash_index(tmp_path, monkeypatch):
+    """ Runs remember hashes in the test directory rather than ~/.redcat
+    """
+    path = str(tmp_path / 'sync_hashes.json')
+    monkeypatch.setattr(etc_plan, 'HashIndex', lambda: HashIndex(path))
+    return path
+
+
+@pytest.fixture
+def delivery(tmp_path):
+    """ A delivery directory with a table and a configuration file, and a destination holding the old table
+    """
+    source = tmp_path / 'delivery'
+    destination = tmp_path / 'pandeia'
+    source.mkdir()
+    destination.mkdir()
+    (source / 'table.fits').write_bytes(b'new table')
+    (source / 'config.json').write_text(json.dumps({'paths': {'table': 'old.fits'}}))
+    (destination / 'old.fits').write_bytes(b'old table')
+    return source, destination
+
+
+def plan(source, destination):
+    return [operation('rename', str(source / 'table.fits'), str(source / 'table_1.fits')),
+            operation('write_json', target=str(source / 'config.json'), data={'paths': {'table': 'table_1.fits'}},
+                      previous={'paths': {'table': 'old.fits'}}),
+            operation('copy', str(source / 'table_1.fits'), str(destination / 'table_1.fits'),
+                      previous=str(destination / 'old.fits')),
+            operation('retire', str(destination / 'old.fits'))]
+
+
+def interrupt(operations, journal_file, at):
+    """ Run operations with the one at index `at` failing, as a crash part way through would leave them
+    """
+    broken = list(operations)
+    broken[at] = operation('copy', '/nonexistent/source', broken[at].target)
+    with pytest.raises(OSError):
+        execute(broken, journal_file)
+    # The journal holds the broken plan; put the real one back, keeping what was recorded as done
+    journal = Journal(journal_file).load()
+    with open(journal_file, 'w') as f:
+        f.write(json.dumps({'plan': [op._asdict() for op in operations]}) + '\n')
+        for i in sorted(journal.done):
+            f.write(json.dumps({'done': i}) + '\n')
+
+
+def test_execute_applies_everything_and_commits(delivery, tmp_path):
+    source, destination = delivery
+    journal_file = str(tmp_path / 'journal.jsonl')
+    execute(plan(source, destination), journal_file)
+
+    assert not os.path.exists(journal_file)
+    assert (destination / 'table_1.fits').read_bytes() == b'new table'
+    assert json.loads((source / 'config.json').read_text())['paths']['table'] == 'table_1.fits'
+    assert sorted(os.listdir(str(destination))) == ['table_1.fits']
+
+
+def test_resume_finishes_an_interrupted_run(delivery, tmp_path):
+    source, destination = delivery
+    journal_file = str(tmp_path / 'journal.jsonl')
+    operations = plan(source, destination)
+    interrupt(operations, journal_file, at=2)
+    assert not (destination / 'table_1.fits').exists()
+    assert not any(name.endswith('.part') for name in os.listdir(str(destination)))
+
+    assert resume(journal_file) == operations
+    assert not os.path.exists(journal_file)
+    assert (destination / 'table_1.fits').read_bytes() == b'new table'
+    assert not (destination / 'old.fits').exists()
+
+
+def test_rollback_puts_everything_back(delivery, tmp_path):
+    source, destination = delivery
+    journal_file = str(tmp_path / 'journal.jsonl')
+    interrupt(plan(source, destination), journal_file, at=2)
+
+    rollback(journal_file)
+    assert not os.path.exists(journal_file)
+    assert (source / 'table.fits').read_bytes() == b'new table'
+    assert not (source / 'table_1.fits').exists()
+    assert json.loads((source / 'config.json').read_text())['paths']['table'] == 'old.fits'
+    assert sorted(os.listdir(str(destination))) == ['old.fits']
+
+
+def test_rollback_restores_retired_files(delivery, tmp_path):
+    source, destination = delivery
+    journal_file = str(tmp_path / 'journal.jsonl')
+    journal = Journal(journal_file)
+    journal.start(plan(source, destination))
+    for i, op in enumerate(journal.operations):
+        apply_operation(op)
+        journal.mark('done', i)
+    assert (destination / ('old.fits' + RETIRED_SUFFIX)).exists()
+
+    rollback(journal_file)
+    assert (destination / 'old.fits').read_bytes() == b'old table'
+    assert not (destination / 'table_1.fits').exists()
+
+
+def test_committed_run_cannot_be_rolled_back(delivery, tmp_path):
+    source, destination = delivery
+    journal_file = str(tmp_path / 'journal.jsonl')
+    journal = Journal(journal_file)
+    journal.start(plan(source, destination))
+    journal.mark('committed', True)
+    with pytest.raises(RuntimeError):
+        rollback(journal_file)
+
+
+def test_a_second_run_waits_for_the_first(delivery, tmp_path):
+    source, destination = delivery
+    journal_file = str(tmp_path / 'journal.jsonl')
+    interrupt(plan(source, destination), journal_file, at=2)
+    with pytest.raises(RuntimeError):
+        execute(plan(source, destination), journal_file)
+
+
+def test_copy_never_overwrites(delivery, tmp_path):
+    source, destination = delivery
+    (destination / 'table_1.fits').write_bytes(b'already there')
+    operations = plan(source, destination)
+    with pytest.raises(OSError):
+        execute(operations, str(tmp_path / 'journal.jsonl'))
+    assert (destination / 'table_1.fits').read_bytes() == b'already there'
+
+
+def test_copy_identical_to_the_replaced_file_is_reused(delivery, tmp_path, capsys):
+    source, destination = delivery
+    (destination / 'old.fits').write_bytes(b'new table')
+    execute(plan(source, destination), str(tmp_path / 'journal.jsonl'))
+
+    assert (destination / 'table_1.fits').read_bytes() == b'new table'
+    assert '1 {}'.format(REUSED) in capsys.readouterr().out
+    assert sorted(os.listdir(str(destination))) == ['table_1.fits']
@@ -0,0 +1,71 @@
+import os
+
+import numpy as np
+from astropy.io import fits
+
+from header_stamp import encode_checksum, ones_complement_sum, stamp_keywords
+
+
+def checksums_valid(path):
+    with fits.open(path, checksum=True) as hdul:
+        return all(hdu.verify_checksum() == 1 and hdu.verify_datasum() == 1 for hdu in hdul)
+
+
+def test_ones_complement_sum_folds_carries():
+    assert ones_complement_sum(b'\xff\xff\xff\xff\x00\x00\x00\x02') == 2
+    assert ones_complement_sum(b'\x00\x00\x00\x01', 0xffffffff) == 1
+
+
+def test_encode_checksum_matches_astropy():
+    hdu = fits.PrimaryHDU(np.arange(10, dtype='>i4'))
+    for value in (0, 1, 0x12345678, 0x3a3b3c3d, 0xffffffff):
+        assert encode_checksum(value) == hdu._char_encode(value)
+
+
+def test_stamp_in_place_keeps_checksums_valid(fits_file):
+    path = fits_file()
+    data_before = fits.getdata(path, 1).copy()
+    size = os.path.getsize(path)
+
+    result = stamp_keywords(path, {'VERIFIED': 'PASSED', 'CERTIFYD': 'PASSED'})
+
+    assert result.in_place
+    assert os.path.getsize(path) == size
+    assert fits.getval(path, 'VERIFIED') == 'PASSED'
+    assert fits.getval(path, 'CERTIFYD') == 'PASSED'
+    assert (fits.getdata(path, 1) == data_before).all()
+    assert checksums_valid(path)
+
+
+def test_restamp_replaces_the_existing_card(fits_file):
+    path = fits_file()
+    stamp_keywords(path, {'VERIFIED': 'FAILED'})
+    stamp_keywords(path, {'VERIFIED': 'PASSED'})
+
+    header = fits.getheader(path)
+    assert list(header.keys()).count('VERIFIED') == 1
+    assert header['VERIFIED'] == 'PASSED'
+    assert checksums_valid(path)
+
+
+def test_file_without_checksum_gets_none(fits_file):
+    path = fits_file(checksum=False)
+    assert stamp_keywords(path, {'VERIFIED': 'PASSED'}).in_place
+    assert 'CHECKSUM' not in fits.getheader(path)
+
+
+def test_full_header_falls_back_to_a_rewrite(fits_file):
+    # Fill the primary header so no blank card is left after END
+    path = fits_file()
+    with fits.open(path) as hdul:
+        free = -(len(hdul[0].header) + 1) % 36
+    header = {'FILL{:04d}'.format(i): i for i in range(free)}
+    path = fits_file('full.fits', checksum=True, header=header)
+    with fits.open(path) as hdul:
+        assert (len(hdul[0].header) + 1) % 36 == 0
+
+    result = stamp_keywords(path, {'VERIFIED': 'PASSED'})
+
+    assert not result.in_place
+    assert fits.getval(path, 'VERIFIED') == 'PASSED'
+    assert checksums_valid(path)
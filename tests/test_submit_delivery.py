@@ -0,0 +1,63 @@
+"""Checks submit_delivery.py makes on a batch before anything is staged
+"""
+
+import datetime
+import os
+import shutil
+
+import pytest
+
+import submit_delivery
+from submit_delivery import Submission, first_staging_name, validate_submissions
+
+DATE = datetime.datetime(2020, 1, 1)
+FORM = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'delivery_form.txt')
+
+
+@pytest.fixture
+def staging(tmp_path, monkeypatch):
+    """ An empty staging area in place of /grp/redcat/staging
+    """
+    root = tmp_path / 'staging'
+    for area in submit_delivery.STAGING_AREAS:
+        (root / area).mkdir(parents=True)
+    monkeypatch.setattr(submit_delivery, 'STAGING_ROOT', str(root) + '/')
+    return root
+
+
+def delivery(tmp_path, name):
+    directory = tmp_path / name
+    directory.mkdir()
+    (directory / 'ref.fits').write_bytes(b'')
+    shutil.copy(FORM, str(directory))
+    return str(directory)
+
+
+def test_valid_batch_passes(staging, tmp_path):
+    validate_submissions([Submission(delivery(tmp_path, 'a'), 'WFC3', 'ops', False),
+                          Submission(delivery(tmp_path, 'b'), 'WFC3', 'ops', False)], DATE)
+
+
+def test_resubmission_needs_a_pending_delivery(staging, tmp_path):
+    with pytest.raises(ValueError, match='no WFC3 delivery from 2020-01-01'):
+        validate_submissions([Submission(delivery(tmp_path, 'a'), 'WFC3', 'ops', True)], DATE)
+
+
+def test_two_resubmissions_of_one_delivery_are_rejected(staging, tmp_path):
+    (staging / 'ops' / first_staging_name(DATE, 'WFC3')).mkdir()
+    first = delivery(tmp_path, 'a')
+    second = delivery(tmp_path, 'b')
+
+    with pytest.raises(ValueError) as error:
+        validate_submissions([Submission(first, 'WFC3', 'ops', True), Submission(second, 'WFC3', 'ops', True)], DATE)
+    assert '{}: {} already resubmits'.format(second, first) in str(error.value)
+
+    # One resubmission per instrument and staging area is fine
+    validate_submissions([Submission(first, 'WFC3', 'ops', True), Submission(second, 'WFC3', 'ops', False)], DATE)
+
+
+def test_same_directory_twice_is_rejected(staging, tmp_path):
+    directory = delivery(tmp_path, 'a')
+    with pytest.raises(ValueError, match='submitted more than once'):
+        validate_submissions([Submission(directory, 'WFC3', 'ops', False),
+                              Submission(directory, 'WFC3', 'test', False)], DATE)
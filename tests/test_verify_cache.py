@@ -0,0 +1,104 @@
+from collections import namedtuple
+
+from astropy.io import fits
+
+from header_stamp import stamp_keywords
+from verify_cache import VerifyCache, stable_hash
+
+Verify = namedtuple('Verify', ['passed', 'messages'])
+
+
+def test_stable_hash_ignores_tool_stamps_only(fits_file):
+    path = fits_file(checksum=False)
+    digest, stamps = stable_hash(path)
+    assert digest.startswith('fits:') and stamps == {}
+
+    stamp_keywords(path, {'VERIFIED': 'PASSED', 'CERTIFYD': 'FAILED'})
+    stamped, stamps = stable_hash(path)
+    assert stamped == digest
+    assert stamps == {'VERIFIED': 'PASSED', 'CERTIFYD': 'FAILED'}
+
+    with fits.open(path, mode='update') as hdul:
+        hdul[0].header['PEDIGREE'] = 'GROUND'
+    assert stable_hash(path)[0] != digest
+
+
+def test_stable_hash_covers_checksum_and_data(fits_file):
+    path = fits_file()
+    digest = stable_hash(path)[0]
+    with fits.open(path, mode='update') as hdul:
+        hdul[1].data['x'][0] = 42.0
+    assert stable_hash(path)[0] != digest
+
+
+def test_non_fits_files_are_hashed_byte_for_byte(tmp_path):
+    path = tmp_path / 'config.json'
+    path.write_text('{"a": 1}')
+    digest = stable_hash(str(path))[0]
+    assert digest.startswith('raw:')
+    path.write_text('{"a": 2}')
+    assert stable_hash(str(path))[0] != digest
+
+
+def test_cached_outcome_survives_save_and_load(tmp_path, fits_file):
+    path = fits_file()
+    cache_file = str(tmp_path / 'cache.json')
+    cache = VerifyCache(cache_file)
+    assert cache.lookup(path, 'hst_0700.pmap') is None
+    cache.store(path, 'hst_0700.pmap', verify=Verify(True, []), certify=True)
+    cache.save()
+
+    entry = VerifyCache(cache_file).lookup(path, 'hst_0700.pmap')
+    assert entry['certify'] is True and entry['verify']['passed'] is True
+    assert VerifyCache(cache_file).lookup(path, 'hst_0701.pmap') is None
+
+
+def test_fits_entry_needs_a_verify_outcome(tmp_path, fits_file):
+    path = fits_file()
+    cache = VerifyCache(str(tmp_path / 'cache.json'))
+    cache.store(path, 'ctx', certify=True)
+    assert cache.lookup(path, 'ctx') is None
+
+
+def test_changed_file_misses(tmp_path, fits_file):
+    path = fits_file()
+    cache = VerifyCache(str(tmp_path / 'cache.json'))
+    cache.store(path, 'ctx', verify=Verify(True, []), certify=True)
+    with fits.open(path, mode='update', checksum=True) as hdul:
+        hdul[1].data['x'][0] = 42.0
+    assert cache.lookup(path, 'ctx') is None
+
+
+def test_refresh_follows_the_file_through_a_stamp(tmp_path, fits_file):
+    path = fits_file()
+    cache_file = str(tmp_path / 'cache.json')
+    cache = VerifyCache(cache_file)
+    cache.store(path, 'ctx', verify=Verify(True, []), certify=True)
+    before = cache.file_hash(path)[0]
+
+    # Stamping rewrites CHECKSUM, which is part of the hash
+    stamp_keywords(path, {'VERIFIED': 'PASSED', 'CERTIFYD': 'PASSED'})
+    assert stable_hash(path)[0] != before
+    cache.refresh(path)
+    cache.save()
+
+    assert VerifyCache(cache_file).lookup(path, 'ctx') is not None
+
+
+def test_evict_drops_old_and_surplus_entries(tmp_path, fits_file):
+    cache = VerifyCache(str(tmp_path / 'cache.json'))
+    paths = [fits_file('ref{}.fits'.format(i), header={'SERIAL': i}) for i in range(3)]
+    for i, path in enumerate(paths):
+        cache.store(path, 'ctx', verify=Verify(True, []), certify=True)
+        cache.entries['{}|ctx'.format(cache.file_hash(path)[0])]['last_used'] = 1000.0 * (i + 1)
+
+    assert cache.evict(max_age_days=1e9, max_entries=2) == 1
+    assert cache.lookup(paths[0], 'ctx') is None
+    assert cache.lookup(paths[2], 'ctx') is not None
+
+
+def test_disabled_cache_never_answers(tmp_path, fits_file):
+    path = fits_file()
+    cache = VerifyCache(str(tmp_path / 'cache.json'), enabled=False)
+    cache.store(path, 'ctx', verify=Verify(True, []), certify=True)
+    assert cache.lookup(path, 'ctx') is None
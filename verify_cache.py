@@ -0,0 +1,231 @@
+"""Persistent cache of verification and certification outcomes for check_references.py
+Use
+---
+    Entries are keyed by a stable content hash of each file plus the name of the context it was certified
+    against, so rerunning check_references.py in a staging directory only re-checks files that changed:
+    ::
+        cache = VerifyCache()
+        entry = cache.lookup('file.fits', 'hst_0700.pmap')
+        ...
+        cache.store('file.fits', 'hst_0700.pmap', verify=result, certify=True)
+        cache.save()
+"""
+
+import hashlib
+import json
+import os
+import time
+
+from fits_header import BLOCK_SIZE, CARD_SIZE, card_value, data_size
+
+# Keywords written by the delivery tools themselves.  They are left out of the content hash, so stamping a file does
+# not make it look like a new file on the next run.  CHECKSUM and DATASUM are hashed like any other card: they are
+# what the archive checks the file against
+TOOL_KEYWORDS = ('VERIFIED', 'CERTIFYD')
+
+DEFAULT_CACHE_FILE = os.path.join(os.path.expanduser('~'), '.redcat', 'verify_cache.json')
+MAX_AGE_DAYS = 30
+MAX_ENTRIES = 5000
+
+READ_SIZE = BLOCK_SIZE * 1024
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def hash_fits(f, digest):
+    """ Feed a FITS file into digest card by card, skipping TOOL_KEYWORDS and blank padding cards.
+        Returns the values of the tool keywords found in the primary header
+    """
+    stamps = {}
+    primary = True
+    while True:
+        keywords = {}
+        block = f.read(BLOCK_SIZE)
+        if not block:
+            return stamps  # Clean end of file after the last HDU
+        if primary and not block.startswith(b'SIMPLE'):
+            raise ValueError('Not a FITS file')
+
+        ended = False
+        while not ended:
+            if len(block) != BLOCK_SIZE:
+                raise ValueError('Truncated FITS header')
+            for i in range(0, BLOCK_SIZE, CARD_SIZE):
+                card = block[i:i + CARD_SIZE].decode('ascii', errors='replace')
+                key = card[:8].strip()
+                if key == 'END':
+                    ended = True
+                    break
+                if not card.strip():
+                    continue
+                if key in TOOL_KEYWORDS:
+                    if primary:
+                        stamps[key] = card_value(card)
+                    continue
+                if card[8:10] == '= ':
+                    keywords[key] = card_value(card)
+                digest.update(block[i:i + CARD_SIZE])
+            if not ended:
+                block = f.read(BLOCK_SIZE)
+
+        remaining = data_size(keywords)
+        while remaining > 0:
+            chunk = f.read(min(READ_SIZE, remaining))
+            if not chunk:
+                raise ValueError('Truncated FITS data')
+            digest.update(chunk)
+            remaining -= len(chunk)
+        primary = False
+
+
+def stable_hash(filename):
+    """ Hash the content of a file in a way that does not change when the delivery tools stamp it.
+        FITS files are hashed card by card (see hash_fits); anything else, or a FITS file too malformed to walk, is
+        hashed byte for byte.
+
+        Returns (hex digest, dict of tool keywords found in the primary header)
+    """
+    with open(filename, 'rb') as f:
+        if filename.endswith('.fits'):
+            digest = hashlib.sha256()
+            try:
+                stamps = hash_fits(f, digest)
+                return 'fits:' + digest.hexdigest(), stamps
+            except (ValueError, KeyError):
+                f.seek(0)
+
+        digest = hashlib.sha256()
+        for chunk in iter(lambda: f.read(READ_SIZE), b''):
+            digest.update(chunk)
+    return 'raw:' + digest.hexdigest(), {}
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class VerifyCache(object):
+    """ On-disk record of verify/certify outcomes keyed by stable content hash and context name
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_FILE, enabled=True):
+        self.path = path
+        self.enabled = enabled
+        self.entries = {}
+        self.files = {}  # absolute path -> size/mtime of the file when it was last hashed, so it is not re-read
+        if enabled:
+            self.load()
+
+    def load(self):
+        """ Read the cache file, starting empty if it is missing or unreadable
+        """
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            self.entries = data.get('entries', {})
+            self.files = data.get('files', {})
+        except (OSError, ValueError):
+            self.entries = {}
+            self.files = {}
+
+    def save(self, max_age_days=MAX_AGE_DAYS, max_entries=MAX_ENTRIES):
+        """ Evict stale entries and write the cache back to disk atomically
+        """
+        if not self.enabled:
+            return
+        self.evict(max_age_days, max_entries)
+
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        temp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+        with open(temp_path, mode='w') as f:
+            json.dump({'entries': self.entries, 'files': self.files}, f, indent=1, sort_keys=True)
+        os.replace(temp_path, self.path)
+
+    def clear(self):
+        """ Forget every cached outcome
+        """
+        self.entries = {}
+        self.files = {}
+
+    def evict(self, max_age_days=MAX_AGE_DAYS, max_entries=MAX_ENTRIES):
+        """ Drop entries unused for more than max_age_days, then the least recently used beyond max_entries.
+            Returns the number of entries removed
+        """
+        before = len(self.entries)
+        oldest = time.time() - max_age_days * 86400
+        self.entries = {k: v for k, v in self.entries.items() if v['last_used'] >= oldest}
+
+        if len(self.entries) > max_entries:
+            keep = sorted(self.entries, key=lambda k: self.entries[k]['last_used'], reverse=True)[:max_entries]
+            self.entries = {k: self.entries[k] for k in keep}
+
+        live_hashes = set(k.split('|')[0] for k in self.entries)
+        self.files = {k: v for k, v in self.files.items() if v['hash'] in live_hashes and os.path.exists(k)}
+
+        return before - len(self.entries)
+
+    def file_hash(self, filename, rehash=False):
+        """ Stable hash and tool keyword stamps of filename, reusing the last result if the file is untouched
+        """
+        path = os.path.abspath(filename)
+        stat = os.stat(path)
+        known = self.files.get(path)
+        if (not rehash and known is not None
+                and known['size'] == stat.st_size and known['mtime_ns'] == stat.st_mtime_ns):
+            return known['hash'], known['stamps']
+
+        digest, stamps = stable_hash(path)
+        self.files[path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'hash': digest, 'stamps': stamps}
+        return digest, stamps
+
+    def lookup(self, filename, context):
+        """ Return the cached entry for filename certified against context, or None if the file needs checking.
+            An entry only counts if it has a certify outcome, and a verify outcome for FITS files
+        """
+        if not self.enabled:
+            return None
+        digest, _ = self.file_hash(filename)
+        entry = self.entries.get('{}|{}'.format(digest, context))
+        if entry is None or entry.get('certify') is None:
+            return None
+        is_fits = '.json' not in filename and '.asdf' not in filename
+        if is_fits and entry.get('verify') is None:
+            return None
+
+        entry['last_used'] = time.time()
+        return entry
+
+    def store(self, filename, context, verify=None, certify=None):
+        """ Record the outcome of checking filename. verify is a check_references.VerifyResult (or None for files
+            that are not verified) and certify is True/False.  The file is re-hashed, since verification may have
+            rewritten it
+        """
+        if not self.enabled:
+            return
+        digest, _ = self.file_hash(filename, rehash=True)
+        entry = {'filename': os.path.basename(filename),
+                 'certify': certify,
+                 'verify': None,
+                 'last_used': time.time()}
+        if verify is not None:
+            entry['verify'] = {'passed': verify.passed, 'messages': verify.messages}
+        self.entries['{}|{}'.format(digest, context)] = entry
+
+    def refresh(self, filename):
+        """ Re-hash a file that was stamped after it was checked, and carry its cached outcomes over to the new hash.
+            Stamping rewrites CHECKSUM, so the hash of a stamped file changes even though its content did not
+        """
+        if not self.enabled:
+            return
+        path = os.path.abspath(filename)
+        known = self.files.get(path)
+        if known is None:
+            return
+        old_digest = known['hash']
+        digest, _ = self.file_hash(path, rehash=True)
+        if digest == old_digest:
+            return
+        prefix = old_digest + '|'
+        for key in [k for k in self.entries if k.startswith(prefix)]:
+            self.entries['{}|{}'.format(digest, key[len(prefix):])] = dict(self.entries[key])